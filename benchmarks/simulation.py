@@ -0,0 +1,131 @@
+import argparse
+import copy
+import logging
+import random
+import time
+
+from src.garage.api.allocation import BUS_SPOTS, LARGE, STRATEGIES
+from src.garage.api.garage import build_garage_doc, Garage
+from src.garage.api.parking import park_vehicle, unpark_vehicle
+from src.garage.utils import APIError
+
+logger = logging.getLogger(__name__)
+
+
+# returns garage document with levels of rows of spots. Spot ids are unique across the garage and
+# every row holds MOTORCYCLE, COMPACT and LARGE spots in that order.
+def build_document(level_count, row_count, spot_count, name='simulation'):
+    spot_id = 0
+    levels = {}
+    for level_number in range(1, level_count + 1):
+        rows = {}
+        for row_number in range(1, row_count + 1):
+            spots = {}
+            for spot_number in range(spot_count):
+                spot_id += 1
+                spot_type = 0 if spot_number < spot_count // 5 else 1 if spot_number < spot_count // 2 else 2
+                spots[str(spot_id)] = {'spot_type': spot_type, 'vehicle': {}}
+            rows[str(row_number)] = {'spots': spots}
+        levels[str(level_number)] = {'rows': rows}
+    return {'name': name, 'levels': levels}
+
+
+# returns arrival trace of (vehicle type value, steps parked), one arrival per step
+def build_trace(steps, seed=0, mix=(0.3, 0.6, 0.1), mean_stay=500):
+    generator = random.Random(seed)
+    return [(generator.choices((0, 1, 2), weights=mix)[0], max(1, int(generator.expovariate(1.0 / mean_stay))))
+            for _ in range(steps)]
+
+
+# share of free LARGE spots outside any run a bus can still use. 0 when every free LARGE spot could
+# hold part of a bus, 1 when no bus fits anywhere although LARGE spots are free.
+def fragmentation(garage):
+    free_large = 0
+    usable = 0
+    for level in garage.levels.values():
+        for row in level.rows.values():
+            run = 0
+            for spot in list(row.spots.values()) + [None]:
+                if spot is not None and not spot.vehicle and spot.spot_type.value == LARGE:
+                    run += 1
+                    free_large += 1
+                else:
+                    usable += run // BUS_SPOTS * BUS_SPOTS
+                    run = 0
+    if not free_large:
+        return 0.0
+    return 1 - float(usable) / free_large
+
+
+# replays the arrival trace against a copy of the garage document with one allocation strategy.
+# Vehicles leave after their steps parked; departures of a step are handled before its arrival.
+def simulate(document, strategy_name, trace, sample_every=100):
+    garage = Garage(copy.deepcopy(document), strategy_name=strategy_name)
+    departures = {}
+    arrivals = [0, 0, 0]
+    turned_away = [0, 0, 0]
+    latencies = []
+    samples = []
+    for step, (vehicle_type, stay) in enumerate(trace):
+        for response in departures.pop(step, []):
+            unpark_vehicle(garage, {'vehicle_id': response['vehicle_id'],
+                                    'spot_id': response['spot_id'],
+                                    'row': response['row'],
+                                    'level': response['level']})
+
+        arrivals[vehicle_type] += 1
+        start = time.perf_counter()
+        try:
+            response = park_vehicle(garage, {'vehicle_type': vehicle_type})
+        except APIError:
+            response = None
+        latencies.append(time.perf_counter() - start)
+        if response is None:
+            turned_away[vehicle_type] += 1
+        else:
+            departures.setdefault(step + stay, []).append(response)
+
+        if step % sample_every == 0:
+            samples.append(fragmentation(garage))
+
+    latencies.sort()
+    return {'strategy': strategy_name,
+            'arrivals': arrivals,
+            'turned_away': turned_away,
+            'turn_away_rate': float(sum(turned_away)) / max(1, sum(arrivals)),
+            'latency_mean_us': sum(latencies) / max(1, len(latencies)) * 1e6,
+            'latency_p99_us': latencies[int(len(latencies) * 0.99)] * 1e6 if latencies else 0.0,
+            'fragmentation': sum(samples) / max(1, len(samples))}
+
+
+# compare allocation strategies over the same arrival trace.
+# e.g. python -m benchmarks.simulation --levels 4 --rows 10 --spots 50 --steps 10000
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Compare allocation strategies over one arrival trace')
+    parser.add_argument('--garage', help='garage document in the data directory, instead of a generated one')
+    parser.add_argument('--levels', type=int, default=4)
+    parser.add_argument('--rows', type=int, default=10)
+    parser.add_argument('--spots', type=int, default=50)
+    parser.add_argument('--steps', type=int, default=10000)
+    parser.add_argument('--mean-stay', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--strategies', nargs='+', choices=sorted(STRATEGIES), default=sorted(STRATEGIES))
+    parsed = parser.parse_args(args)
+
+    if parsed.garage:
+        document = build_garage_doc(fn=parsed.garage)
+    else:
+        document = build_document(parsed.levels, parsed.rows, parsed.spots)
+    trace = build_trace(parsed.steps, seed=parsed.seed, mean_stay=parsed.mean_stay)
+
+    print('%-16s %10s %10s %10s %10s %12s %12s %14s' % ('strategy', 'turned', 'moto', 'car', 'bus',
+                                                       'mean us', 'p99 us', 'fragmentation'))
+    for strategy_name in parsed.strategies:
+        result = simulate(document, strategy_name, trace)
+        print('%-16s %9.2f%% %10d %10d %10d %12.1f %12.1f %14.3f' % (
+            strategy_name, result['turn_away_rate'] * 100, result['turned_away'][0], result['turned_away'][1],
+            result['turned_away'][2], result['latency_mean_us'], result['latency_p99_us'], result['fragmentation']))
+
+
+if __name__ == '__main__':
+    main()
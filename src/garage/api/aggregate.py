@@ -0,0 +1,187 @@
+import heapq
+import logging
+
+from src.garage.api.spots import EMPTY
+
+# NumPy is optional. Without it the counts are taken with a pure Python pass over the same arrays.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+# number of spot type values and of vehicle type values
+TYPE_COUNT = 3
+
+
+# returns counts of spot numbers start to end - 1 of the spot table, taken in one pass.
+# row_bounds are the (start, end) spot numbers of each row in the range, in order.
+#   spot_count:      number of spots
+#   spot_type_counts: spots per spot type value
+#   free_spots:      free spots per spot type value
+#   vehicle_counts:  vehicles per vehicle type value. A vehicle in several spots counts once.
+#   parked_counts:   vehicles per vehicle type value, per spot type value of the spots they take
+#   vehicle_ids:     ids of those vehicles, ascending
+#   vehicle_types:   vehicle type value of each of the vehicle ids
+#   available_spots: spot ids of the free spots, in spot number order
+#   assigned_spots:  spot ids of the taken spots, in spot number order
+#   row_free:        free spots of each row
+def aggregate(table, start, end, row_bounds, use_numpy=None):
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy and end > start:
+        return aggregate_numpy(table, start, end, row_bounds)
+    return aggregate_python(table, start, end, row_bounds)
+
+
+# counts through bincount and masks over views of the spot table arrays, without copying them
+def aggregate_numpy(table, start, end, row_bounds):
+    logger.debug('Aggregating spots {} to {} with NumPy'.format(start, end - 1))
+    spot_ids = array_view(table.spot_ids, start, end)
+    spot_types = array_view(table.spot_types, start, end)
+    vehicle_ids = array_view(table.vehicle_ids, start, end)
+    vehicle_types = array_view(table.vehicle_types, start, end)
+
+    free = vehicle_ids == EMPTY
+    taken = ~free
+    unique_ids, first = numpy.unique(vehicle_ids[taken], return_index=True)
+    unique_types = vehicle_types[taken][first]
+    # a vehicle takes spots of one spot type, so the spot type of its first spot is the one it parks in
+    parked_types = spot_types[taken][first].astype(numpy.intp) * TYPE_COUNT + unique_types
+    # free spots before each spot number, so the free spots of a row are a difference of two entries
+    free_before = numpy.concatenate(([0], numpy.cumsum(free)))
+    row_starts = numpy.array([row_start - start for row_start, row_end in row_bounds], dtype=numpy.intp)
+    row_ends = numpy.array([row_end - start for row_start, row_end in row_bounds], dtype=numpy.intp)
+    return {'spot_count': end - start,
+            'spot_type_counts': numpy.bincount(spot_types, minlength=TYPE_COUNT).tolist(),
+            'free_spots': numpy.bincount(spot_types[free], minlength=TYPE_COUNT).tolist(),
+            'vehicle_counts': numpy.bincount(unique_types, minlength=TYPE_COUNT).tolist(),
+            'parked_counts': numpy.bincount(parked_types, minlength=TYPE_COUNT * TYPE_COUNT)
+                                  .reshape(TYPE_COUNT, TYPE_COUNT).tolist(),
+            'vehicle_ids': unique_ids.tolist(),
+            'vehicle_types': unique_types.tolist(),
+            'available_spots': spot_ids[free].tolist(),
+            'assigned_spots': spot_ids[taken].tolist(),
+            'row_free': (free_before[row_ends] - free_before[row_starts]).tolist()}
+
+
+# NumPy array over spot numbers start to end - 1 of an array.array. The view must not outlive the
+# aggregation, as the array cannot grow while it is exported.
+def array_view(values, start, end):
+    return numpy.frombuffer(values, dtype=values.typecode, count=end - start, offset=start * values.itemsize)
+
+
+def aggregate_python(table, start, end, row_bounds):
+    logger.debug('Aggregating spots {} to {}'.format(start, end - 1))
+    counts = {'spot_count': end - start,
+              'spot_type_counts': [0] * TYPE_COUNT,
+              'free_spots': [0] * TYPE_COUNT,
+              'vehicle_counts': [0] * TYPE_COUNT,
+              'parked_counts': [[0] * TYPE_COUNT for spot_type in range(TYPE_COUNT)],
+              'vehicle_ids': [],
+              'vehicle_types': [],
+              'available_spots': [],
+              'assigned_spots': [],
+              'row_free': []}
+    vehicles = {}
+    for row_start, row_end in row_bounds:
+        row_free = 0
+        for spot_id, spot_type, vehicle_id, vehicle_type in table.spots(row_start, row_end):
+            counts['spot_type_counts'][spot_type] += 1
+            if vehicle_id == EMPTY:
+                row_free += 1
+                counts['free_spots'][spot_type] += 1
+                counts['available_spots'].append(spot_id)
+                continue
+            counts['assigned_spots'].append(spot_id)
+            if vehicle_id not in vehicles:
+                vehicles[vehicle_id] = vehicle_type
+                counts['vehicle_counts'][vehicle_type] += 1
+                counts['parked_counts'][spot_type][vehicle_type] += 1
+        counts['row_free'].append(row_free)
+    for vehicle_id in sorted(vehicles):
+        counts['vehicle_ids'].append(vehicle_id)
+        counts['vehicle_types'].append(vehicles[vehicle_id])
+    return counts
+
+
+# returns counts of the spots of the spot type values in spot_types, over (start, end) spot number ranges.
+# Keys as in aggregate: spot_count, free_spots and vehicle_counts. With a vehicle type value, only
+# vehicles of that type are counted.
+def aggregate_filtered(table, ranges, spot_types, vehicle_type=None):
+    logger.debug('Aggregating spots of spot types {} in {} ranges'.format(sorted(spot_types), len(ranges)))
+    counts = {'spot_count': 0,
+              'free_spots': [0] * TYPE_COUNT,
+              'vehicle_counts': [0] * TYPE_COUNT}
+    vehicles = set()
+    for start, end in ranges:
+        for spot_id, spot_type, vehicle_id, spot_vehicle_type in table.spots(start, end):
+            if spot_type not in spot_types:
+                continue
+            counts['spot_count'] += 1
+            if vehicle_id == EMPTY:
+                counts['free_spots'][spot_type] += 1
+                continue
+            if vehicle_type is not None and spot_vehicle_type != vehicle_type:
+                continue
+            if vehicle_id not in vehicles:
+                vehicles.add(vehicle_id)
+                counts['vehicle_counts'][spot_vehicle_type] += 1
+    return counts
+
+
+# returns up to limit ids greater than after, ascending, of the spots of the spot type values in
+# spot_types over (start, end) spot number ranges. field available_spots gives the ids of the free spots,
+# assigned_spots the ids of the vehicles in the taken spots, only of vehicle_type if given.
+# Only the ids past after are sorted, so a page costs a pass over the ranges rather than a sort of them.
+def filtered_ids(table, ranges, spot_types, field, after=-1, vehicle_type=None, limit=None, use_numpy=None):
+    logger.debug('Listing {} of spot types {} after {}'.format(field, sorted(spot_types), after))
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy:
+        return filtered_ids_numpy(table, ranges, spot_types, field, after, vehicle_type, limit)
+    ids = filtered_ids_python(table, ranges, spot_types, field, after, vehicle_type)
+    if field == 'assigned_spots':
+        ids = set(ids)
+    if limit is None:
+        return sorted(ids)
+    return heapq.nsmallest(limit, ids)
+
+
+def filtered_ids_numpy(table, ranges, spot_types, field, after, vehicle_type, limit):
+    selected = [numpy.empty(0, dtype=table.spot_ids.typecode)]
+    for start, end in ranges:
+        if end <= start:
+            continue
+        spot_ids = array_view(table.spot_ids, start, end)
+        vehicle_ids = array_view(table.vehicle_ids, start, end)
+        mask = numpy.isin(array_view(table.spot_types, start, end), sorted(spot_types))
+        if field == 'available_spots':
+            mask &= (vehicle_ids == EMPTY) & (spot_ids > after)
+            selected.append(spot_ids[mask])
+            continue
+        mask &= (vehicle_ids != EMPTY) & (vehicle_ids > after)
+        if vehicle_type is not None:
+            mask &= array_view(table.vehicle_types, start, end) == vehicle_type
+        selected.append(vehicle_ids[mask])
+    ids = numpy.concatenate(selected)
+    if field == 'assigned_spots':
+        ids = numpy.unique(ids)
+    elif limit is not None and limit < len(ids):
+        ids = numpy.sort(numpy.partition(ids, limit - 1)[:limit])
+    else:
+        ids = numpy.sort(ids)
+    return ids[:limit].tolist()
+
+
+def filtered_ids_python(table, ranges, spot_types, field, after, vehicle_type):
+    for start, end in ranges:
+        for spot_id, spot_type, vehicle_id, spot_vehicle_type in table.spots(start, end):
+            if spot_type not in spot_types:
+                continue
+            if field == 'available_spots':
+                if vehicle_id == EMPTY and spot_id > after:
+                    yield spot_id
+            elif vehicle_id != EMPTY and vehicle_id > after and vehicle_type in (None, spot_vehicle_type):
+                yield vehicle_id
@@ -0,0 +1,602 @@
+import bisect
+import heapq
+import logging
+import os
+from array import array
+
+from src.garage.api.aggregate import array_view
+from src.garage.api.spots import EMPTY
+
+# NumPy is optional. Without it free spots are counted with a pure Python pass over the spot table.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+# number of LARGE spots in one row taken by a bus
+BUS_SPOTS = 5
+# spot type value of LARGE spots, the only spot type a bus fits
+LARGE = 2
+# returned when no spot fits a vehicle type
+NO_LOCATION = (None, None, None)
+
+
+# returns free spots per spot type value and the number of rows a bus fits in, for a level
+def count_free(level, use_numpy=None):
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy and level.end > level.start:
+        return count_free_numpy(level)
+    free_spots = [0, 0, 0]
+    bus_rows = 0
+    spot_types = level.table.spot_types
+    vehicle_ids = level.table.vehicle_ids
+    for row in level.rows.values():
+        run = 0
+        longest_run = 0
+        for number in range(row.start, row.end):
+            if vehicle_ids[number] == EMPTY:
+                free_spots[spot_types[number]] += 1
+            if vehicle_ids[number] == EMPTY and spot_types[number] == LARGE:
+                run += 1
+                longest_run = max(longest_run, run)
+            else:
+                run = 0
+        if longest_run >= BUS_SPOTS:
+            bus_rows += 1
+    return free_spots, bus_rows
+
+
+# count_free through masks and running sums over views of the spot table arrays
+def count_free_numpy(level):
+    free = array_view(level.table.vehicle_ids, level.start, level.end) == EMPTY
+    spot_types = array_view(level.table.spot_types, level.start, level.end)
+    free_spots = numpy.bincount(spot_types[free], minlength=3).tolist()
+    return free_spots, int(numpy.count_nonzero(bus_room_numpy(level, free & (spot_types == LARGE))))
+
+
+# returns bool array telling for each row of a level whether a bus fits in it. large_free tells for each
+# spot of the level whether it is a free LARGE spot.
+def bus_room_numpy(level, large_free):
+    # free LARGE spots before each spot, so BUS_SPOTS of them in a row start where the difference is BUS_SPOTS
+    large_before = numpy.concatenate(([0], numpy.cumsum(large_free)))
+    bus_runs = large_before[BUS_SPOTS:] - large_before[:-BUS_SPOTS] == BUS_SPOTS
+    runs_before = numpy.concatenate(([0], numpy.cumsum(bus_runs)))
+    # a row has room for a bus if a run starts between its first spot and its last BUS_SPOTS spots
+    offsets = array_view(level.row_offsets, 0, len(level.row_offsets)) - level.start
+    row_starts = numpy.minimum(offsets[:-1], len(bus_runs))
+    last_starts = numpy.minimum(numpy.maximum(offsets[1:] - BUS_SPOTS + 1, offsets[:-1]), len(bus_runs))
+    return runs_before[last_starts] > runs_before[row_starts]
+
+
+# returns (free spot ordinals per spot type value, free spots per spot type value of each row,
+# whether a bus fits in each row) of a level, for LevelIndex
+def index_rows(level, use_numpy=None):
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy and level.end > level.start:
+        return index_rows_numpy(level)
+
+    free = ([], [], [])
+    row_free = []
+    bus_room = []
+    spot_types = level.table.spot_types
+    vehicle_ids = level.table.vehicle_ids
+    offsets = level.row_offsets
+    for ordinal in range(len(offsets) - 1):
+        counts = [0, 0, 0]
+        run = 0
+        longest_run = 0
+        for number in range(offsets[ordinal], offsets[ordinal + 1]):
+            spot_type = spot_types[number]
+            if vehicle_ids[number] == EMPTY:
+                free[spot_type].append(number - level.start)
+                counts[spot_type] += 1
+            if vehicle_ids[number] == EMPTY and spot_type == LARGE:
+                run += 1
+                longest_run = max(longest_run, run)
+            else:
+                run = 0
+        row_free.append(counts)
+        bus_room.append(longest_run >= BUS_SPOTS)
+    return free, row_free, bus_room
+
+
+# index_rows through masks and running sums over views of the spot table arrays
+def index_rows_numpy(level):
+    free = array_view(level.table.vehicle_ids, level.start, level.end) == EMPTY
+    spot_types = array_view(level.table.spot_types, level.start, level.end)
+    offsets = array_view(level.row_offsets, 0, len(level.row_offsets)) - level.start
+    ordinals = []
+    row_free = []
+    for spot_type in range(3):
+        free_of_type = free & (spot_types == spot_type)
+        ordinals.append(numpy.flatnonzero(free_of_type).tolist())
+        # free spots of the type in each row, as differences of a running count at the row offsets
+        row_free.append(numpy.diff(numpy.concatenate(([0], numpy.cumsum(free_of_type)))[offsets]))
+    return (tuple(ordinals),
+            numpy.stack(row_free, axis=1).tolist(),
+            bus_room_numpy(level, free & (spot_types == LARGE)).tolist())
+
+
+# OrdinalHeap keeps ordinals in a heap with lazy deletion. Ordinals that stopped qualifying stay
+# in the heap until they reach the top, where the caller's check drops them.
+class OrdinalHeap(object):
+    def __init__(self, ordinals=()):
+        self.heap = list(ordinals)
+        heapq.heapify(self.heap)
+        self.members = set(self.heap)
+
+    def push(self, ordinal):
+        if ordinal not in self.members:
+            self.members.add(ordinal)
+            heapq.heappush(self.heap, ordinal)
+
+    # returns the lowest ordinal for which qualifies(ordinal) is True, or None
+    def first(self, qualifies):
+        while self.heap:
+            if qualifies(self.heap[0]):
+                return self.heap[0]
+            self.members.discard(heapq.heappop(self.heap))
+        return None
+
+
+# RunTree is a segment tree over the spots of a row that tracks runs of adjacent free LARGE spots.
+# Every node keeps the free run at the start of its range, the free run at its end and the longest
+# free run within, so a spot changes in O(log n) and the first run of k spots is found in O(log n).
+class RunTree(object):
+    def __init__(self, free):
+        self.count = len(free)
+        self.size = 1
+        while self.size < self.count:
+            self.size *= 2
+        self.length = array('i', [0]) * (2 * self.size)
+        self.prefix = array('i', [0]) * (2 * self.size)
+        self.suffix = array('i', [0]) * (2 * self.size)
+        self.best = array('i', [0]) * (2 * self.size)
+        for index in range(self.size):
+            node = self.size + index
+            self.length[node] = 1
+            if index < self.count and free[index]:
+                self.prefix[node] = self.suffix[node] = self.best[node] = 1
+        for node in range(self.size - 1, 0, -1):
+            self.combine(node)
+
+    def combine(self, node):
+        left = 2 * node
+        right = left + 1
+        self.length[node] = self.length[left] + self.length[right]
+        self.prefix[node] = self.prefix[left]
+        if self.prefix[left] == self.length[left]:
+            self.prefix[node] += self.prefix[right]
+        self.suffix[node] = self.suffix[right]
+        if self.suffix[right] == self.length[right]:
+            self.suffix[node] += self.suffix[left]
+        self.best[node] = max(self.best[left], self.best[right], self.suffix[left] + self.prefix[right])
+
+    # longest run of adjacent free spots in the row
+    def longest(self):
+        return self.best[1]
+
+    def set(self, index, free):
+        node = self.size + index
+        self.prefix[node] = self.suffix[node] = self.best[node] = 1 if free else 0
+        node //= 2
+        while node:
+            self.combine(node)
+            node //= 2
+
+    # returns index of the first spot of the first run of k adjacent free spots, or None
+    def find(self, k):
+        if self.best[1] < k:
+            return None
+        node = 1
+        start = 0
+        end = self.size
+        while node < self.size:
+            middle = (start + end) // 2
+            left = 2 * node
+            if self.best[left] >= k:
+                node = left
+                end = middle
+            elif self.suffix[left] + self.prefix[left + 1] >= k:
+                return middle - self.suffix[left]
+            else:
+                node = left + 1
+                start = middle
+        return start
+
+
+# LevelIndex keeps the free spots of one level per spot type, ordered as in the garage document,
+# and a RunTree per row for the runs of adjacent free LARGE spots a bus needs.
+# The ordinal of a spot is its spot number less the first spot number of the level.
+# The RunTree of a row is only built once a lookup or a change reaches the row. Until then whether
+# a bus fits in the row is the one counted when the level was indexed.
+class LevelIndex(object):
+    def __init__(self, level):
+        logger.debug('Indexing free spots of level: ' + level.id)
+        self.level = level
+        self.table = level.table
+        self.start = level.start
+        self.rows = level.rows.values()
+        self.row_starts = [row.start - self.start for row in self.rows]
+        self.row_ordinals = {row.id: ordinal for ordinal, row in enumerate(self.rows)}
+        free, self.row_free, self.row_bus_room = index_rows(level)
+        self.row_runs = [None] * len(self.rows)
+
+        self.free_heaps = [OrdinalHeap(ordinals) for ordinals in free]
+        self.free_counts = [len(ordinals) for ordinals in free]
+        self.bus_heap = OrdinalHeap(row for row in range(len(self.rows)) if self.has_bus_room(row))
+        self.bus_rows = len(self.bus_heap.heap)
+        self.fragment_heap = OrdinalHeap(row for row in range(len(self.rows)) if self.is_fragment_row(row))
+
+    def is_free(self, ordinal):
+        return self.table.vehicle_ids[self.start + ordinal] == EMPTY
+
+    # returns (row, spot) of a spot ordinal
+    def spot(self, ordinal):
+        row_ordinal = bisect.bisect_right(self.row_starts, ordinal) - 1
+        return self.rows[row_ordinal], self.level.spot(self.start + ordinal)
+
+    # returns RunTree of a row, building it from the spot table on first use
+    def row_run(self, row_ordinal):
+        run = self.row_runs[row_ordinal]
+        if run is None:
+            row = self.rows[row_ordinal]
+            spot_types = self.table.spot_types
+            vehicle_ids = self.table.vehicle_ids
+            run = RunTree([spot_types[number] == LARGE and vehicle_ids[number] == EMPTY
+                           for number in range(row.start, row.end)])
+            self.row_runs[row_ordinal] = run
+        return run
+
+    def has_bus_room(self, row_ordinal):
+        run = self.row_runs[row_ordinal]
+        if run is None:
+            return self.row_bus_room[row_ordinal]
+        return run.longest() >= BUS_SPOTS
+
+    # a row with free LARGE spots but no run a bus fits in. Parking there breaks up no bus run.
+    def is_fragment_row(self, row_ordinal):
+        return self.row_free[row_ordinal][LARGE] > 0 and not self.has_bus_room(row_ordinal)
+
+    # returns first free spot ordinal of spot type value, or None
+    def first_free(self, spot_type):
+        if not self.free_counts[spot_type]:
+            return None
+        return self.free_heaps[spot_type].first(self.is_free)
+
+    # returns (row, spots) of the first run of adjacent free LARGE spots a bus fits in, or None
+    def first_bus_row(self):
+        if not self.bus_rows:
+            return None
+        row_ordinal = self.bus_heap.first(self.has_bus_room)
+        start = self.start + self.row_starts[row_ordinal] + self.row_run(row_ordinal).find(BUS_SPOTS)
+        return self.rows[row_ordinal], [self.level.spot(number) for number in range(start, start + BUS_SPOTS)]
+
+    # returns ordinal of the first free LARGE spot in a row without room for a bus, or None
+    def first_fragment_spot(self):
+        row_ordinal = self.fragment_heap.first(self.is_fragment_row)
+        if row_ordinal is None:
+            return None
+        return self.row_starts[row_ordinal] + self.row_run(row_ordinal).find(1)
+
+    # update counts after the spots of a row were taken (delta -1) or freed (delta 1).
+    # Returns the change in rows with room for a bus.
+    def update(self, row, spots, delta):
+        row_ordinal = self.row_ordinals[row.id]
+        had_bus_room = self.has_bus_room(row_ordinal)
+        for spot in spots:
+            ordinal = spot.number - self.start
+            spot_type = self.table.spot_types[spot.number]
+            self.free_counts[spot_type] += delta
+            self.row_free[row_ordinal][spot_type] += delta
+            if delta > 0:
+                self.free_heaps[spot_type].push(ordinal)
+            if spot_type == LARGE:
+                self.row_run(row_ordinal).set(ordinal - self.row_starts[row_ordinal], delta > 0)
+        if self.is_fragment_row(row_ordinal):
+            self.fragment_heap.push(row_ordinal)
+        has_bus_room = self.has_bus_room(row_ordinal)
+        if has_bus_room == had_bus_room:
+            return 0
+        if has_bus_room:
+            self.bus_heap.push(row_ordinal)
+            self.bus_rows += 1
+            return 1
+        self.bus_rows -= 1
+        return -1
+
+
+# SpotIndex finds the next spot for a vehicle type in O(log n) through the allocation strategy.
+# Each spot type keeps a heap of the levels with free spots of that type, and each level a LevelIndex
+# with heaps of its free spots. Levels are only indexed once a lookup reaches them, so lazily loaded
+# levels are read through the counts in their summary until then.
+# Free spot totals per spot type and the number of rows with room for a bus are kept up to date
+# on every change, so availability per vehicle type is a constant time read.
+class SpotIndex(object):
+    def __init__(self, garage, strategy_name=None):
+        self.garage = garage
+        self.strategy = get_strategy(self, strategy_name)
+        self.level_ids = list(garage.levels)
+        self.level_ordinals = {level_id: ordinal for ordinal, level_id in enumerate(self.level_ids)}
+        self.levels = {}
+        self.bus_type = garage.Vehicle.VehicleType.BUS
+        self.vehicle_spot_types = {}
+        for spot_type, vehicle_types in garage.spot_type_map.items():
+            for vehicle_type in vehicle_types:
+                self.vehicle_spot_types.setdefault(vehicle_type, []).append(spot_type.value)
+
+        # levels that may have room. Checked against the level counts when they reach the top.
+        self.free_levels = [OrdinalHeap(), OrdinalHeap(), OrdinalHeap()]
+        self.bus_levels = OrdinalHeap()
+        self.free_totals = [0, 0, 0]
+        self.bus_row_total = 0
+        for ordinal, level_id in enumerate(self.level_ids):
+            free_spots, bus_rows = self.level_counts(level_id)
+            for spot_type, count in enumerate(free_spots):
+                self.free_totals[spot_type] += count
+                if count:
+                    self.free_levels[spot_type].push(ordinal)
+            self.bus_row_total += bus_rows
+            if bus_rows:
+                self.bus_levels.push(ordinal)
+
+    # returns (free spots per spot type value, bus rows) of a level without indexing it if possible
+    def level_counts(self, level_id):
+        if level_id in self.levels:
+            return self.levels[level_id].free_counts, self.levels[level_id].bus_rows
+        summaries = getattr(self.garage.levels, 'summaries', None)
+        if summaries is not None and not self.garage.levels.is_loaded(level_id):
+            summary = summaries[level_id]
+            if 'free_spots' in summary:
+                return summary['free_spots'], summary['bus_rows']
+        return count_free(self.garage.levels[level_id])
+
+    # returns free spots per spot type value of the garage, a level, or a row of a level
+    def free_spots(self, level_id=None, row_id=None):
+        if level_id is None:
+            return list(self.free_totals)
+        if row_id is None:
+            return list(self.level_counts(level_id)[0])
+        level_index = self.level_index(level_id)
+        return list(level_index.row_free[level_index.row_ordinals[row_id]])
+
+    # returns how many more vehicles of the vehicle type fit, counting one bus per row with room for one
+    def capacity(self, vehicle_type):
+        if vehicle_type == self.bus_type:
+            return self.bus_row_total
+        return sum(self.free_totals[spot_type] for spot_type in self.vehicle_spot_types.get(vehicle_type, []))
+
+    # levels indexed so far are handed to the new strategy as if they just changed
+    def set_strategy(self, strategy_name):
+        self.strategy = get_strategy(self, strategy_name)
+        for level_id, level_index in self.levels.items():
+            self.strategy.level_changed(self.level_ordinals[level_id], level_index)
+
+    # returns how many more vehicles of the vehicle type fit on a level
+    def level_capacity(self, level_ordinal, vehicle_type):
+        free_spots, bus_rows = self.level_counts(self.level_ids[level_ordinal])
+        if vehicle_type == self.bus_type:
+            return bus_rows
+        return sum(free_spots[spot_type] for spot_type in self.vehicle_spot_types[vehicle_type])
+
+    def level_index(self, level_id):
+        if level_id not in self.levels:
+            self.levels[level_id] = LevelIndex(self.garage.levels[level_id])
+            self.strategy.level_changed(self.level_ordinals[level_id], self.levels[level_id])
+        return self.levels[level_id]
+
+    def level_has_free(self, spot_type):
+        return lambda ordinal: self.level_index(self.level_ids[ordinal]).free_counts[spot_type] > 0
+
+    def level_has_bus_room(self, ordinal):
+        return self.level_index(self.level_ids[ordinal]).bus_rows > 0
+
+    # returns ordinal of the first level with a free spot of spot type value, or None
+    def first_level(self, spot_type):
+        return self.free_levels[spot_type].first(self.level_has_free(spot_type))
+
+    # returns ordinal of the first level with room for a bus, or None
+    def first_bus_level(self):
+        return self.bus_levels.first(self.level_has_bus_room)
+
+    # returns (level, row, spots) of the first run of adjacent free LARGE spots on a level
+    def bus_location(self, level_ordinal):
+        if level_ordinal is None:
+            return NO_LOCATION
+        level_index = self.level_index(self.level_ids[level_ordinal])
+        row, spots = level_index.first_bus_row()
+        return level_index.level, row, spots
+
+    # returns (level, row, spots) of the first free spot of any of the spot type values on a level
+    def spot_location(self, level_ordinal, spot_types):
+        if level_ordinal is None:
+            return NO_LOCATION
+        level_index = self.level_index(self.level_ids[level_ordinal])
+        ordinals = [level_index.first_free(spot_type) for spot_type in spot_types]
+        ordinals = [ordinal for ordinal in ordinals if ordinal is not None]
+        if not ordinals:
+            return NO_LOCATION
+        row, spot = level_index.spot(min(ordinals))
+        return level_index.level, row, [spot]
+
+    # returns (level, row, spots) of the next spot for the vehicle type, or (None, None, None)
+    def find(self, vehicle_type):
+        if vehicle_type not in self.vehicle_spot_types:
+            return NO_LOCATION
+        return self.strategy.find(vehicle_type, self.vehicle_spot_types[vehicle_type])
+
+    # spots of location are being taken. Call before changing the spots.
+    def assign(self, location):
+        self.update(location, -1)
+
+    # spots of location are being freed. Call before changing the spots.
+    def unassign(self, location):
+        self.update(location, 1)
+
+    def update(self, location, delta):
+        level_index = self.level_index(location.level.id)
+        ordinal = self.level_ordinals[location.level.id]
+        self.bus_row_total += level_index.update(location.row, location.spots, delta)
+        spot_types = [level_index.table.spot_types[spot.number] for spot in location.spots]
+        for spot_type in spot_types:
+            self.free_totals[spot_type] += delta
+        if delta > 0:
+            for spot_type in spot_types:
+                self.free_levels[spot_type].push(ordinal)
+            if level_index.bus_rows:
+                self.bus_levels.push(ordinal)
+        self.strategy.level_changed(ordinal, level_index)
+
+
+# AllocationStrategy picks the next spot for a vehicle type from the heaps and counters of a SpotIndex.
+# Strategies keep any extra state of their own up to date through level_changed.
+class AllocationStrategy(object):
+    name = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls is AllocationStrategy:
+            raise TypeError('AllocationStrategy class may not be instantiated')
+        return object.__new__(cls)
+
+    def __init__(self, index):
+        self.index = index
+
+    # returns (level, row, spots) for the vehicle type fitting spot type values, or (None, None, None)
+    def find(self, vehicle_type, spot_types):
+        raise NotImplementedError('find is not implemented')
+
+    # a level was indexed or the free spots of a level changed
+    def level_changed(self, level_ordinal, level_index):
+        pass
+
+    # first run a bus fits in, walking levels, rows and spots in document order
+    def find_bus(self):
+        return self.index.bus_location(self.index.first_bus_level())
+
+
+# FirstFitStrategy takes the first compatible spot walking levels, rows and spots in document order
+class FirstFitStrategy(AllocationStrategy):
+    name = 'first-fit'
+
+    def find(self, vehicle_type, spot_types):
+        if vehicle_type == self.index.bus_type:
+            return self.find_bus()
+
+        # first level with any compatible free spot, then the first compatible free spot on it
+        level_ordinals = [self.index.first_level(spot_type) for spot_type in spot_types]
+        level_ordinals = [ordinal for ordinal in level_ordinals if ordinal is not None]
+        if not level_ordinals:
+            return NO_LOCATION
+        return self.index.spot_location(min(level_ordinals), spot_types)
+
+
+# BestFitStrategy takes the first spot of the smallest compatible spot type with any free spot left,
+# so cars only take LARGE spots once the COMPACT spots are gone
+class BestFitStrategy(AllocationStrategy):
+    name = 'best-fit'
+
+    def find(self, vehicle_type, spot_types):
+        if vehicle_type == self.index.bus_type:
+            return self.find_bus()
+
+        for spot_type in sorted(spot_types):
+            if self.index.free_totals[spot_type]:
+                return self.index.spot_location(self.index.first_level(spot_type), [spot_type])
+        return NO_LOCATION
+
+
+# LevelBalancingStrategy spreads vehicles over levels by taking the first compatible spot on the level
+# with the most room for the vehicle type. Each vehicle type keeps a max heap of (room, level) entries
+# with lazy deletion: an entry is pushed on every change and dropped at the top once its room is stale.
+class LevelBalancingStrategy(AllocationStrategy):
+    name = 'level-balancing'
+
+    def __init__(self, index):
+        super(LevelBalancingStrategy, self).__init__(index)
+        self.heaps = {}
+
+    def build_heap(self, vehicle_type):
+        heap = [(-self.index.level_capacity(ordinal, vehicle_type), ordinal)
+                for ordinal in range(len(self.index.level_ids))]
+        heapq.heapify(heap)
+        self.heaps[vehicle_type] = heap
+
+    def level_changed(self, level_ordinal, level_index):
+        for vehicle_type, heap in self.heaps.items():
+            if len(heap) > 2 * len(self.index.level_ids) + 64:
+                # mostly stale entries, start over from the level counts
+                self.build_heap(vehicle_type)
+            else:
+                heapq.heappush(heap, (-self.index.level_capacity(level_ordinal, vehicle_type), level_ordinal))
+
+    # returns ordinal of the level with the most room for the vehicle type, or None
+    def roomiest_level(self, vehicle_type):
+        if vehicle_type not in self.heaps:
+            self.build_heap(vehicle_type)
+        heap = self.heaps[vehicle_type]
+        while heap:
+            room, ordinal = heap[0]
+            if -room == self.index.level_capacity(ordinal, vehicle_type):
+                return ordinal if room else None
+            heapq.heappop(heap)
+        return None
+
+    def find(self, vehicle_type, spot_types):
+        level_ordinal = self.roomiest_level(vehicle_type)
+        if vehicle_type == self.index.bus_type:
+            return self.index.bus_location(level_ordinal)
+        return self.index.spot_location(level_ordinal, spot_types)
+
+
+# BusPreservingStrategy keeps runs of adjacent free LARGE spots for buses. Smaller vehicles take the
+# smallest compatible spot type first, and LARGE spots in rows without room for a bus before any other.
+# Only levels that were indexed are searched for such rows; the rest fall back to first fit.
+class BusPreservingStrategy(AllocationStrategy):
+    name = 'bus-preserving'
+
+    def __init__(self, index):
+        super(BusPreservingStrategy, self).__init__(index)
+        self.fragment_levels = OrdinalHeap()
+
+    def level_changed(self, level_ordinal, level_index):
+        if level_index.fragment_heap.heap:
+            self.fragment_levels.push(level_ordinal)
+
+    def has_fragment_row(self, level_ordinal):
+        return self.index.levels[self.index.level_ids[level_ordinal]].first_fragment_spot() is not None
+
+    def find(self, vehicle_type, spot_types):
+        if vehicle_type == self.index.bus_type:
+            return self.find_bus()
+
+        for spot_type in sorted(spot_types):
+            if spot_type != LARGE and self.index.free_totals[spot_type]:
+                return self.index.spot_location(self.index.first_level(spot_type), [spot_type])
+        if LARGE not in spot_types or not self.index.free_totals[LARGE]:
+            return NO_LOCATION
+
+        level_ordinal = self.fragment_levels.first(self.has_fragment_row)
+        if level_ordinal is None:
+            return self.index.spot_location(self.index.first_level(LARGE), [LARGE])
+        level_index = self.index.levels[self.index.level_ids[level_ordinal]]
+        row, spot = level_index.spot(level_index.first_fragment_spot())
+        return level_index.level, row, [spot]
+
+
+STRATEGIES = {strategy.name: strategy for strategy in (FirstFitStrategy,
+                                                       BestFitStrategy,
+                                                       LevelBalancingStrategy,
+                                                       BusPreservingStrategy)}
+
+
+# returns allocation strategy for the spot index. Name defaults to ALLOCATION_STRATEGY, then first-fit.
+def get_strategy(index, strategy_name=None):
+    strategy_name = strategy_name or os.getenv('ALLOCATION_STRATEGY', 'first-fit')
+    logger.debug('Allocation strategy is: ' + strategy_name)
+    if strategy_name not in STRATEGIES:
+        raise ValueError('Unknown allocation strategy: ' + strategy_name)
+    return STRATEGIES[strategy_name](index)
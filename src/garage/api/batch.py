@@ -0,0 +1,149 @@
+import logging
+
+from src.garage.api.parking import get_garage_data, update_garage_data, parked_response
+from src.garage.api.state import garage_state
+from src.garage.utils import (validate_request_body,
+                              APIError,
+                              status_codes)
+
+logger = logging.getLogger(__name__)
+
+
+def http_put(request, response, params, document=None):
+    """ Resource = garage/v1/parking/batch """
+
+    # the garage is taken under the lock, so it is the live one while it is changed
+    with garage_state.lock:
+        logger.debug('Loading garage')
+        garage = get_garage_data(document)
+        results = park_vehicles(garage, request.body)
+
+    # update garage document once for the whole batch
+    update_garage_data(garage, document)
+
+    # vehicles that could not be parked are reported per item
+    if any('error' in result for result in results):
+        response.status = status_codes.HTTP_MULTI_STATUS
+    else:
+        response.status = status_codes.HTTP_CREATED
+    response.body = {'results': results}
+
+
+# park every vehicle type of the request in order, in one batch of changes to the garage.
+# Returns one response dict per vehicle type, holding an error for the vehicles that were not parked.
+def park_vehicles(garage, request_body):
+    # validate request body
+    validate_request_body(request_body,
+                          required_params={'vehicle_types': list})
+
+    results = []
+    with garage.batch():
+        for selected_vehicle_type in request_body['vehicle_types']:
+            try:
+                results.append(park_next_vehicle(garage, selected_vehicle_type))
+            except APIError as error:
+                logger.debug('Vehicle not parked: ' + error.code)
+                results.append({'vehicle_type': selected_vehicle_type,
+                                'error': {'code': error.code,
+                                          'cause': error.cause,
+                                          'message': error.message}})
+    return results
+
+
+# park one vehicle of a batch. The next spot map is only refreshed when the batch ends,
+# so the spot comes straight from the allocation index.
+def park_next_vehicle(garage, selected_vehicle_type):
+    # validate vehicle type
+    if type(selected_vehicle_type) != int or \
+            selected_vehicle_type not in [vehicle_type.value for vehicle_type in garage.Vehicle.VehicleType]:
+        raise APIError(code='Invalid Vehicle Type',
+                       cause='Invalid Vehicle Type',
+                       message='Please enter correct Vehicle Type',
+                       status=status_codes.HTTP_BAD_REQUEST)
+    vehicle_type = garage.Vehicle.VehicleType(selected_vehicle_type)
+
+    if not garage.available_id_count():
+        raise APIError(code='Garage Full',
+                       cause='Garage Full',
+                       message='Please come again',
+                       status=status_codes.HTTP_BAD_REQUEST)
+
+    logger.debug('Getting Spot for Vehicle')
+    location = garage.get_spot(vehicle_type)
+    if not location.spots:
+        raise APIError(code='Full for Vehicle Type: ' + vehicle_type.name,
+                       cause='Full for Vehicle Type: ' + vehicle_type.name,
+                       message='Please come again',
+                       status=status_codes.HTTP_BAD_REQUEST)
+
+    logger.debug('Creating Vehicle')
+    vehicle = garage.set_vehicle(selected_vehicle_type)
+    garage.assign_spot(location, vehicle)
+
+    return parked_response(garage, location, vehicle)
+
+
+def http_delete(request, response, params, document=None):
+    """ Resource = garage/v1/parking/batch """
+
+    # the garage is taken under the lock, so it is the live one while it is changed
+    with garage_state.lock:
+        logger.debug('Loading garage')
+        garage = get_garage_data(document)
+        results = unpark_vehicles(garage, request.body)
+
+    # update garage document once for the whole batch
+    logger.debug('Updating garage document')
+    update_garage_data(garage, document)
+
+    # vehicles that could not be found are reported per item
+    if any('error' in result for result in results):
+        response.status = status_codes.HTTP_MULTI_STATUS
+    else:
+        response.status = status_codes.HTTP_OK
+    response.body = {'results': results}
+
+
+# free the spots of every vehicle id of the request, in one batch of changes to the garage.
+# Locations are looked up in the vehicle location index rather than sent by the client.
+# Returns one response dict per vehicle id, holding an error for the vehicles that were not found.
+def unpark_vehicles(garage, request_body):
+    # validate request body
+    validate_request_body(request_body,
+                          required_params={'vehicle_ids': list})
+
+    results = []
+    with garage.batch():
+        locations = garage.locate_vehicles(vehicle_id for vehicle_id in request_body['vehicle_ids']
+                                           if type(vehicle_id) == str)
+        for selected_vehicle in request_body['vehicle_ids']:
+            try:
+                # a vehicle listed twice is only found the first time
+                location = locations.pop(selected_vehicle, None) if type(selected_vehicle) == str else None
+                results.append(unpark_located_vehicle(garage, selected_vehicle, location))
+            except APIError as error:
+                logger.debug('Vehicle not unparked: ' + error.code)
+                results.append({'vehicle_id': selected_vehicle,
+                                'error': {'code': error.code,
+                                          'cause': error.cause,
+                                          'message': error.message}})
+    return results
+
+
+# unpark one vehicle of a batch from its located spots
+def unpark_located_vehicle(garage, selected_vehicle, location):
+    logger.debug('Checking assigned vehicle ids')
+    if location is None or not garage.is_assigned(selected_vehicle):
+        raise APIError(code='Invalid Vehicle ID',
+                       cause='Invalid Vehicle ID',
+                       message='Please enter correct Vehicle ID',
+                       status=status_codes.HTTP_NOT_FOUND)
+
+    logger.debug('Unassigning vehicle')
+    garage.unassign_spot(location, garage.check_spot(location))
+
+    spots = garage.format_spot(location.spots)
+    return {'vehicle_id': selected_vehicle,
+            'level': location.level.id,
+            'row': location.row.id,
+            'spot_id': spots['spot_id']}
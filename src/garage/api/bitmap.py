@@ -0,0 +1,197 @@
+import logging
+
+# NumPy is optional. Without it the bits of a new bit set are set one member at a time.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+
+# Bitmap stores one bit per index in any writable buffer, such as a bytearray or a slice of an mmap
+class Bitmap(object):
+    def __init__(self, buffer, size):
+        self.buffer = buffer
+        self.size = size
+
+    # number of bytes needed for size bits
+    @staticmethod
+    def byte_length(size):
+        return (size + 7) // 8
+
+    def get(self, index):
+        return bool(self.buffer[index >> 3] & (1 << (index & 7)))
+
+    def set(self, index):
+        self.buffer[index >> 3] |= 1 << (index & 7)
+
+    def clear(self, index):
+        self.buffer[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+    # returns first index at or after start whose bit is not set, or None if every bit is set
+    def find_first_zero(self, start=0, chunk_size=4096):
+        byte_index = start >> 3
+        byte_count = self.byte_length(self.size)
+        while byte_index < byte_count:
+            chunk = bytes(self.buffer[byte_index:min(byte_index + chunk_size, byte_count)])
+            # skip full bytes in C rather than bit by bit
+            skipped = len(chunk) - len(chunk.lstrip(b'\xff'))
+            if skipped < len(chunk):
+                byte_index += skipped
+                value = self.buffer[byte_index]
+                for bit in range(8):
+                    index = (byte_index << 3) + bit
+                    if index >= self.size:
+                        return None
+                    if index >= start and not value & (1 << bit):
+                        return index
+                byte_index += 1
+            else:
+                byte_index += len(chunk)
+        return None
+
+    # indexes at or after start whose bit is set, in ascending order
+    def iter_set(self, start=0, chunk_size=4096):
+        byte_index = max(start, 0) >> 3
+        byte_count = self.byte_length(self.size)
+        while byte_index < byte_count:
+            chunk = bytes(self.buffer[byte_index:min(byte_index + chunk_size, byte_count)])
+            # skip empty bytes in C rather than bit by bit
+            stripped = chunk.lstrip(b'\x00')
+            byte_index += len(chunk) - len(stripped)
+            for value in stripped:
+                while value:
+                    low_bit = value & -value
+                    index = (byte_index << 3) + low_bit.bit_length() - 1
+                    if index >= self.size:
+                        return
+                    if index >= start:
+                        yield index
+                    value ^= low_bit
+                byte_index += 1
+
+
+# returns number of bits set in a bytes-like object
+def bit_count(data):
+    return bin(int.from_bytes(bytes(data), 'little')).count('1')
+
+
+# set the bits of a list of members in a bytearray, all at once when NumPy is installed.
+# Members must be lower than 8 * len(buffer).
+def set_bits(buffer, members):
+    if numpy is None:
+        for member in members:
+            buffer[member >> 3] |= 1 << (member & 7)
+        return
+    bits = numpy.zeros(len(buffer) * 8, dtype=bool)
+    bits[numpy.array(members, dtype=numpy.intp)] = True
+    view = numpy.frombuffer(buffer, dtype=numpy.uint8)
+    view |= numpy.packbits(bits, bitorder='little')
+
+
+# BitSet is an ordered set of ints from 0 up, one bit per possible member, growing as larger members
+# are added. Members are counted per block of bits, so rank and select skip whole blocks at a time.
+class BitSet(object):
+    BLOCK_BITS = 4096
+
+    def __init__(self, members=(), size=0):
+        members = list(members)
+        if members:
+            size = max(size, max(members) + 1)
+        buffer = bytearray(Bitmap.byte_length(size))
+        set_bits(buffer, members)
+        self.bitmap = Bitmap(buffer, size)
+        # members are counted once the bits are set, so repeated members count once
+        block_bytes = self.BLOCK_BITS // 8
+        self.block_counts = [bit_count(buffer[start:start + block_bytes])
+                             for start in range(0, block_bytes * (size // self.BLOCK_BITS + 1), block_bytes)]
+        self.count = sum(self.block_counts)
+
+    def grow(self, size):
+        logger.debug('Growing bit set to: ' + str(size))
+        self.bitmap.buffer.extend(bytes(Bitmap.byte_length(size) - len(self.bitmap.buffer)))
+        self.bitmap.size = size
+        self.block_counts.extend([0] * (size // self.BLOCK_BITS + 1 - len(self.block_counts)))
+
+    def __contains__(self, member):
+        return 0 <= member < self.bitmap.size and self.bitmap.get(member)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, member):
+        if member >= self.bitmap.size:
+            self.grow(max(member + 1, 2 * self.bitmap.size))
+        if not self.bitmap.get(member):
+            self.bitmap.set(member)
+            self.block_counts[member // self.BLOCK_BITS] += 1
+            self.count += 1
+
+    def discard(self, member):
+        if member in self:
+            self.bitmap.clear(member)
+            self.block_counts[member // self.BLOCK_BITS] -= 1
+            self.count -= 1
+
+    # members in ascending order
+    def __iter__(self):
+        buffer = self.bitmap.buffer
+        for byte_index in range(len(buffer)):
+            value = buffer[byte_index]
+            while value:
+                low_bit = value & -value
+                yield (byte_index << 3) + low_bit.bit_length() - 1
+                value ^= low_bit
+
+    # returns number of members lower than member
+    def rank(self, member):
+        member = min(max(member, 0), self.bitmap.size)
+        block = member // self.BLOCK_BITS
+        count = sum(self.block_counts[:block])
+        start = block * self.BLOCK_BITS // 8
+        end = member // 8
+        count += bit_count(self.bitmap.buffer[start:end])
+        if member % 8:
+            count += bin(self.bitmap.buffer[end] & ((1 << (member % 8)) - 1)).count('1')
+        return count
+
+    # returns member of rank k, the (k + 1)th lowest member
+    def select(self, k):
+        if not 0 <= k < self.count:
+            raise IndexError('BitSet index out of range')
+        block = 0
+        while k >= self.block_counts[block]:
+            k -= self.block_counts[block]
+            block += 1
+        buffer = self.bitmap.buffer
+        byte_index = block * self.BLOCK_BITS // 8
+        while True:
+            value = buffer[byte_index]
+            bits = bin(value).count('1')
+            if k < bits:
+                for bit in range(8):
+                    if value & (1 << bit):
+                        if not k:
+                            return (byte_index << 3) + bit
+                        k -= 1
+            k -= bits
+            byte_index += 1
+
+    # members from rank start on, in ascending order
+    def iter_from(self, start):
+        if start >= self.count:
+            return
+        member = self.select(max(start, 0))
+        buffer = self.bitmap.buffer
+        byte_index = member >> 3
+        value = buffer[byte_index] & ~((1 << (member & 7)) - 1) & 0xFF
+        while True:
+            while value:
+                low_bit = value & -value
+                yield (byte_index << 3) + low_bit.bit_length() - 1
+                value ^= low_bit
+            byte_index += 1
+            if byte_index >= len(buffer):
+                return
+            value = buffer[byte_index]
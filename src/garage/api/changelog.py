@@ -0,0 +1,46 @@
+import logging
+import os
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+# ChangeLog keeps the last size changes of a Garage with their sequence numbers, oldest first.
+# floor is the sequence number of the newest change that left the log, so the changes since a
+# sequence number are complete while it is at least floor.
+class ChangeLog(object):
+    def __init__(self, size=10000):
+        self.entries = deque(maxlen=size)
+        self.floor = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def append(self, sequence, change):
+        if len(self.entries) == self.entries.maxlen:
+            self.floor = self.entries[0][0] if self.entries else sequence
+        self.entries.append((sequence, change))
+
+    # returns up to limit changes after sequence, oldest first, each with its sequence number.
+    # None if some of them already left the log. Sequence numbers ascend, so the first change after
+    # sequence is found by bisection and only the changes returned are looked at after it.
+    def since(self, sequence, limit=None):
+        if sequence < self.floor:
+            return None
+        low, high = 0, len(self.entries)
+        while low < high:
+            middle = (low + high) // 2
+            if self.entries[middle][0] <= sequence:
+                low = middle + 1
+            else:
+                high = middle
+        end = len(self.entries) if limit is None else min(len(self.entries), low + limit)
+        return [dict(change, sequence=entry_sequence)
+                for entry_sequence, change in (self.entries[index] for index in range(low, end))]
+
+
+# returns change log of the size set by CHANGE_LOG_SIZE
+def get_change_log(size=None):
+    size = size or int(os.getenv('CHANGE_LOG_SIZE', '10000'))
+    logger.debug('Keeping change log of size: ' + str(size))
+    return ChangeLog(size)
@@ -0,0 +1,56 @@
+import logging
+
+from src.garage.api.parking import get_garage_data
+from src.garage.api.state import garage_state
+from src.garage.api.status import parse_int
+from src.garage.utils import (raise_invalid_param_error,
+                              status_codes)
+
+logger = logging.getLogger(__name__)
+
+
+def http_get(request, response, params, document=None):
+    """ Resource = garage/v1/changes """
+
+    # the garage is taken under the lock, so it is not reloaded while it is read
+    with garage_state.lock:
+        logger.debug('Loading garage')
+        garage = get_garage_data(document)
+        response.body = get_changes(garage, getattr(request, 'params', None) or {})
+
+    response.status = status_codes.HTTP_OK
+
+
+# returns the changes of the garage since sequence number since, for mirrors of the garage to replay.
+# Without since, or when the changes since are no longer all kept, returns a snapshot of the garage
+# document instead to resync from. Sequence numbers are only comparable within one epoch, as they start
+# over whenever the garage is loaded again.
+def get_changes(garage, params):
+    since = parse_int(params, 'since', 0)
+    limit = parse_int(params, 'limit', 1)
+    if since is None:
+        return snapshot_response(garage, resync=False)
+    if 'epoch' not in params:
+        raise_invalid_param_error('epoch', 'epoch is required with since')
+
+    changes = None
+    if params['epoch'] == garage.epoch and since <= garage.version:
+        changes = garage.changes.since(since, None if limit is None else limit + 1)
+    if changes is None:
+        logger.debug('Changes since {} are not kept. Sending snapshot.'.format(since))
+        return snapshot_response(garage, resync=True)
+
+    more = limit is not None and len(changes) > limit
+    changes = changes[:limit]
+    return {'epoch': garage.epoch,
+            'sequence': changes[-1]['sequence'] if changes else since,
+            'changes': changes,
+            'more': more}
+
+
+# garage document with the sequence number it is current at. Changes after it have higher numbers.
+def snapshot_response(garage, resync):
+    return {'epoch': garage.epoch,
+            'sequence': garage.version,
+            'resync': resync,
+            'snapshot': garage.garage_to_dict()}
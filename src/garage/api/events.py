@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import threading
+from collections import deque
+
+from src.garage import utils
+from src.garage.api.state import garage_state
+from src.garage.api.status import StatusQuery, parse_query
+
+logger = logging.getLogger(__name__)
+
+# status fields of snapshot events
+SNAPSHOT_FIELDS = ('max_capacity,occupancy,cars,motorcycles,buses,available,available_spot_types,'
+                   'available_spots_total')
+# event name of each change op
+CHANGE_EVENTS = {'assign': 'park', 'unassign': 'unpark'}
+# sent to idle watchers so proxies keep the connection open
+KEEPALIVE = b': keepalive\n\n'
+
+
+def http_get(request, response, params, document=None):
+    """ Resource = garage/v1/events """
+
+    logger.debug('Opening garage event stream')
+    response.content_type = 'text/event-stream'
+    response.set_header('Cache-Control', 'no-cache')
+    response.stream = event_hub.stream(garage_state, utils.get_header(request, 'Last-Event-ID'))
+
+
+# returns server-sent event as bytes
+def format_event(sequence, name, data):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(sequence, name,
+                                                    json.dumps(data, separators=(',', ':'))).encode('utf-8')
+
+
+# EventHub fans the changes of the live Garage out to every watcher of the event stream.
+# Each event is encoded once into a bounded log shared by the watchers, and each watcher reads the log
+# from its own sequence number, so a change costs the same however many watchers there are.
+# The log bounds how far a watcher may fall behind. A watcher whose next event already left the log
+# gets a snapshot of the garage counts instead, built once per garage version for every such watcher.
+class EventHub(object):
+    def __init__(self, buffer_size=1024, keepalive=15.0):
+        self.events = deque(maxlen=buffer_size)
+        self.sequence = 0
+        self.keepalive = keepalive
+        self.watchers = 0
+        self.condition = threading.Condition()
+        # (available, available spot types) last sent
+        self.availability = None
+        self._snapshot = None
+
+    # GarageState listener. Called under the garage lock after every change of the live Garage.
+    def publish_change(self, change, garage):
+        if not self.watchers:
+            # nobody to tell. Resuming watchers cannot skip the change, as the log is emptied.
+            with self.condition:
+                self.sequence += 1
+                self.events.clear()
+            self.availability = None
+            return
+
+        self.publish(CHANGE_EVENTS[change['op']], {'vehicle_id': change['vehicle_id'],
+                                                   'vehicle_type': change['vehicle_type'],
+                                                   'level': change['level'],
+                                                   'row': change['row'],
+                                                   'spots': change['spots']})
+        availability = (str(garage.available), list(garage.available_spot_types))
+        if self.availability is not None and availability != self.availability:
+            self.publish('availability', {'available': availability[0], 'available_spot_types': availability[1]})
+        self.availability = availability
+
+    def publish(self, name, data):
+        with self.condition:
+            self.sequence += 1
+            self.events.append(format_event(self.sequence, name, data))
+            self.condition.notify_all()
+
+    # returns events after sequence, waiting up to timeout for one. None if the next of them already
+    # left the log.
+    def events_after(self, sequence, timeout=None):
+        with self.condition:
+            if self.sequence == sequence and timeout:
+                self.condition.wait(timeout)
+            behind = self.sequence - sequence
+            if behind > len(self.events) or behind < 0:
+                return None
+            # the newest events are at the right end of the log
+            return [self.events[index] for index in range(-behind, 0)]
+
+    # returns (snapshot event, sequence of the last event it covers) of the live Garage
+    def snapshot(self, state):
+        # changes are published under the garage lock, so no event is missed or counted twice
+        with state.lock:
+            garage = state.garage
+            with self.condition:
+                key = (self.sequence, state.etag(garage))
+                if self._snapshot is None or self._snapshot[0] != key:
+                    logger.debug('Building garage event snapshot')
+                    status = StatusQuery(garage, parse_query({'fields': SNAPSHOT_FIELDS})).build()
+                    self._snapshot = (key, format_event(self.sequence, 'snapshot', status))
+                    self.availability = (status['available'], status['available_spot_types'])
+                return self._snapshot[1], key[0]
+
+    # returns event stream of a new watcher. Starts with a snapshot, or resumes after last_event_id
+    # while its events are still in the log.
+    def stream(self, state, last_event_id=None):
+        with self.condition:
+            self.watchers += 1
+            return Watcher(self, self.watch(state, self.resume_sequence(last_event_id)))
+
+    def watch(self, state, sequence):
+        while True:
+            if sequence is None:
+                event, sequence = self.snapshot(state)
+                yield event
+            events = self.events_after(sequence, self.keepalive)
+            if events is None:
+                logger.debug('Watcher fell behind the event log. Sending snapshot.')
+                sequence = None
+                continue
+            if not events:
+                yield KEEPALIVE
+                continue
+            sequence += len(events)
+            for event in events:
+                yield event
+
+    # returns sequence number to resume a reconnecting watcher from, or None for a snapshot
+    def resume_sequence(self, last_event_id):
+        try:
+            sequence = int(last_event_id)
+        except (TypeError, ValueError):
+            return None
+        with self.condition:
+            if 0 <= self.sequence - sequence <= len(self.events):
+                logger.debug('Resuming watcher after event: ' + str(sequence))
+                return sequence
+        return None
+
+
+# Watcher is the event stream of one watcher. The WSGI server closes it once the client is gone.
+class Watcher(object):
+    def __init__(self, hub, events):
+        self.hub = hub
+        self.events = events
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.events)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.events.close()
+        with self.hub.condition:
+            self.hub.watchers -= 1
+
+
+event_hub = EventHub(int(os.getenv('EVENT_BUFFER_SIZE', '1024')))
+garage_state.add_listener(event_hub.publish_change)
@@ -1,18 +1,37 @@
 import json
 import logging
 import os
+import threading
+import uuid
+from array import array
+from collections.abc import Mapping
+from contextlib import contextmanager
 from enum import Enum
+from itertools import chain
 
+from src.garage.api.aggregate import aggregate
+from src.garage.api.allocation import SpotIndex, count_free
+from src.garage.api.bitmap import BitSet
+from src.garage.api.changelog import get_change_log
+from src.garage.api.ids import VehicleIdPool
+from src.garage.api.spots import EMPTY, SpotTable
 from src.garage.utils import APIError, status_codes
 
 logger = logging.getLogger(__name__)
 
+# status map count of each vehicle type value
+VEHICLE_TYPE_COUNTS = ('moto_count', 'car_count', 'bus_count')
+
 
 # Garage is the Parent object. Contains Levels.
 class Garage(object):
-    def __init__(self, document=None):
+    # levels of the document may be Level objects already over spot_table, as loaded from a binary snapshot
+    def __init__(self, document=None, strategy_name=None, spot_table=None):
         levels = document.get('levels', {})
         self.name = document.get('name', '')
+        # sequence number of the last journal record a journal snapshot includes, see JournalStorage
+        self.journal_sequence = document.get('journal_sequence', 0)
+        self.spot_table = SpotTable() if spot_table is None else spot_table
         self.levels = self.set_levels(levels)
         self.vehicle_count = 0
         self.max_capacity = 0
@@ -20,13 +39,30 @@ class Garage(object):
         self.car_count = 0
         self.bus_count = 0
         self.available = bool
-        self.available_ids = []
-        self.assigned_ids = []
+        self.vehicle_ids = VehicleIdPool(0)
         self.available_spot_types = []
-        self.available_spots = []
-        self.assigned_spots = []
+        self.available_spot_ids = BitSet()
+        self.assigned_spot_ids = BitSet()
+        self.vehicle_locations = {}
+        # level id to the spots per spot type value and to the vehicles per vehicle type value parked in
+        # spots of each spot type value, for status queries by spot type or vehicle type
+        self.spot_type_counts = {}
+        self.parked_counts = {}
+        # level id to the summary last taken of a materialized level, dropped when the level changes
+        self.level_summaries = {}
         self._spot_type_map = self.spot_type_map
         self._next_spot_map = self.next_spot_map
+        self._listeners = []
+        self._remote = False
+        self._batch = False
+        self.shared = None
+        # state version, bumped on every change. epoch tells apart Garage objects built from storage,
+        # so (epoch, version) names one state of the garage.
+        self.epoch = uuid.uuid4().hex[:12]
+        self.version = 0
+        # the last changes, numbered by the version they produced
+        self.changes = get_change_log()
+        self.spot_index = SpotIndex(self, strategy_name)
         self.initialize_spot_map()
         self.map_status()
 
@@ -55,10 +91,17 @@ class Garage(object):
     # assign levels from json to objects
     def set_levels(self, levels):
         logger.debug('Setting garage levels')
+        if isinstance(levels, LazyLevels):
+            logger.debug('Levels are materialized on first use')
+            levels.table = self.spot_table
+            return levels
         new_levels = {}
         for level_id, level in levels.items():
+            if isinstance(level, Garage.Level):
+                new_levels[level_id] = level
+                continue
             logger.debug('Creating Level object: ' + level_id)
-            new_levels[level_id] = self.Level(level_id, level['rows'])
+            new_levels[level_id] = self.Level(level_id, level['rows'], self.spot_table)
 
         return new_levels
 
@@ -75,15 +118,19 @@ class Garage(object):
     # sets next spot of one vehicle type of the next_spot_map
     # update availability
     def set_next_spot(self, vehicle_type, location):
-        logger.debug('Setting next spot for: ' + self.Vehicle.VehicleType.MOTORCYCLE.name)
+        logger.debug('Setting next spot for: ' + vehicle_type.name)
         self._next_spot_map[vehicle_type] = location
-        if location.spots:
+        self.update_availability(vehicle_type)
+
+    # update availability of one vehicle type from the free spot counters of the spot index
+    def update_availability(self, vehicle_type):
+        if self.spot_index.capacity(vehicle_type):
             self.available = True
             if vehicle_type.name not in self.available_spot_types:
                 self.available_spot_types.append(vehicle_type.name)
         else:
             if vehicle_type.name in self.available_spot_types:
-                logger.debug('Setting full for: ' + self.Vehicle.VehicleType.MOTORCYCLE.name)
+                logger.debug('Setting full for: ' + vehicle_type.name)
                 self.available_spot_types.remove(vehicle_type.name)
             if not self.available_spot_types:
                 logger.debug('Garage full. Setting available status.')
@@ -93,6 +140,41 @@ class Garage(object):
     def get_next_spot(self, vehicle_type):
         return self._next_spot_map[vehicle_type]
 
+    # switch the allocation strategy that picks the next spot of every vehicle type
+    def set_strategy(self, strategy_name):
+        logger.debug('Setting allocation strategy: ' + strategy_name)
+        self.spot_index.set_strategy(strategy_name)
+        self.initialize_spot_map()
+        self.version += 1
+
+    # free vehicle ids in ascending order, as strings
+    @property
+    def available_ids(self):
+        return list(map(str, self.vehicle_ids.available()))
+
+    # assigned vehicle ids in ascending order, as strings
+    @property
+    def assigned_ids(self):
+        return list(map(str, self.vehicle_ids.assigned()))
+
+    # available spot ids in ascending order, as strings
+    @property
+    def available_spots(self):
+        return list(map(str, self.available_spot_ids))
+
+    # assigned spot ids in ascending order, as strings
+    @property
+    def assigned_spots(self):
+        return list(map(str, self.assigned_spot_ids))
+
+    # returns how many more vehicles of vehicle type fit in the garage
+    def capacity(self, vehicle_type):
+        return self.spot_index.capacity(vehicle_type)
+
+    # returns free spots per spot type value of the garage, a level, or a row of a level
+    def free_spots(self, level_id=None, row_id=None):
+        return self.spot_index.free_spots(level_id, row_id)
+
     # get all counts from actual document in case initial counts are incorrect
     def map_status(self):
         # hold found counts
@@ -103,46 +185,74 @@ class Garage(object):
             'moto_count': 0,
             'car_count': 0,
             'bus_count': 0,
-            'assigned_ids': [],
-            'available_ids': [],
+            'assigned_ids': set(),
+            # assigned ids as ints, for the vehicle id pool
+            'vehicle_ids': [],
             'available_spots': [],
-            'assigned_spots': []}
+            'assigned_spots': [],
+            'spot_type_counts': {},
+            'parked_counts': {}}
+        # vehicle id to the level id of the vehicles found. Their Location is indexed on first lookup.
+        vehicle_levels = {}
         for level in self.levels:
             logger.debug('Evaluating level ' + level)
-            for row in self.levels[level].rows:
-                logger.debug('Row ' + row)
-                logger.debug('Updating max_capacity count')
-                status_map['max_capacity'] += len(self.levels[level].rows[row].spots)
-                for spot in self.levels[level].rows[row].spots:
-                    vehicle = self.levels[level].rows[row].spots[spot].vehicle
-                    if vehicle:
-                        logger.debug('Appending assigned spot: ' + spot)
-                        status_map['assigned_spots'].append(spot)
-                        if vehicle.id not in status_map['assigned_ids']:
-                            logger.debug('Appending assigned vehicle: ' + vehicle.id)
-                            status_map['assigned_ids'].append(vehicle.id)
-                            logger.debug('Incrementing vehicle count')
-                            status_map['vehicle_count'] += 1
-                            if vehicle.vehicle_type == Garage.Vehicle.VehicleType.MOTORCYCLE:
-                                logger.debug('Incrementing vehicle type count: ' + vehicle.vehicle_type.name)
-                                status_map['moto_count'] += 1
-                            if vehicle.vehicle_type == Garage.Vehicle.VehicleType.CAR:
-                                logger.debug('Incrementing vehicle type count: ' + vehicle.vehicle_type.name)
-                                status_map['car_count'] += 1
-                            if vehicle.vehicle_type == Garage.Vehicle.VehicleType.BUS:
-                                logger.debug('Incrementing vehicle type count: ' + vehicle.vehicle_type.name)
-                                status_map['bus_count'] += 1
-                    else:
-                        logger.debug('Appending available spot: ' + spot)
-                        status_map['available_spots'].append(spot)
+            if isinstance(self.levels, LazyLevels) and not self.levels.is_loaded(level):
+                self.map_level_summary(status_map, level, self.levels.summaries[level])
+                vehicle_levels.update(dict.fromkeys(self.levels.summaries[level]['vehicles'], level))
+                continue
+            self.map_level(status_map, vehicle_levels, self.levels[level])
         self.update_status(status_map)
+        self.vehicle_locations = vehicle_levels
+
+    # add counts of a level from one pass over its spot numbers in the spot table
+    @staticmethod
+    def map_level(status_map, vehicle_levels, level):
+        counts = level.counts()
+        vehicle_ids = list(map(str, counts['vehicle_ids']))
+        logger.debug('Updating max_capacity count')
+        status_map['max_capacity'] += counts['spot_count']
+        status_map['available_spots'].extend(counts['available_spots'])
+        status_map['assigned_spots'].extend(counts['assigned_spots'])
+        status_map['spot_type_counts'][level.id] = counts['spot_type_counts']
+        status_map['parked_counts'][level.id] = counts['parked_counts']
+        if not status_map['assigned_ids'].isdisjoint(vehicle_ids):
+            # a vehicle was already counted on another level
+            Garage.map_vehicles(status_map, zip(vehicle_ids, counts['vehicle_types']))
+            vehicle_levels.update((vehicle_id, level.id) for vehicle_id in vehicle_ids
+                                  if vehicle_id not in vehicle_levels)
+            return
+        status_map['assigned_ids'].update(vehicle_ids)
+        status_map['vehicle_ids'].extend(counts['vehicle_ids'])
+        status_map['vehicle_count'] += len(vehicle_ids)
+        for vehicle_type, count in enumerate(counts['vehicle_counts']):
+            status_map[VEHICLE_TYPE_COUNTS[vehicle_type]] += count
+        vehicle_levels.update(dict.fromkeys(vehicle_ids, level.id))
+
+    # add counts of a level that is not materialized from its stored summary.
+    # Summaries written before the spot type counts were kept leave them to type_counts.
+    @staticmethod
+    def map_level_summary(status_map, level_id, summary):
+        logger.debug('Updating max_capacity count from level summary')
+        status_map['max_capacity'] += summary['max_capacity']
+        status_map['assigned_spots'].extend(summary['assigned_spots'])
+        status_map['available_spots'].extend(summary['available_spots'])
+        if 'parked_counts' in summary:
+            status_map['spot_type_counts'][level_id] = list(summary['spot_type_counts'])
+            status_map['parked_counts'][level_id] = [list(counts) for counts in summary['parked_counts']]
+        Garage.map_vehicles(status_map, summary['vehicles'].items())
+
+    # count the (vehicle id, vehicle type value) pairs of vehicles not counted yet
+    @staticmethod
+    def map_vehicles(status_map, vehicles):
+        for vehicle_id, vehicle_type in vehicles:
+            if vehicle_id not in status_map['assigned_ids']:
+                status_map['assigned_ids'].add(vehicle_id)
+                status_map['vehicle_ids'].append(int(vehicle_id))
+                status_map['vehicle_count'] += 1
+                status_map[VEHICLE_TYPE_COUNTS[vehicle_type]] += 1
 
     # update values of garage per status map
     def update_status(self, status_map):
-        logger.debug('Creating list of available vehicle ids')
-        new_ids = self.create_vehicle_ids(status_map['max_capacity'])
-        status_map['available_ids'] = self.remove_assigned_ids(new_ids, status_map['assigned_ids'])
-
         logger.debug('Updating max_capacity')
         self.max_capacity = status_map['max_capacity']
 
@@ -158,57 +268,91 @@ class Garage(object):
         logger.debug('Updating bus_count')
         self.bus_count = status_map['bus_count']
 
-        # update available ids. This is safe because found assigned ids have been removed from available list,
-        # therefore they cannot assigned to another vehicle
-        logger.debug('Updating available ids')
-        self.available_ids = self.sort_ids(status_map['available_ids'])
-
-        logger.debug('Updating assigned_ids')
-        self.assigned_ids = self.sort_ids(status_map['assigned_ids'])
+        # one vehicle id per spot. Found assigned ids are reserved, therefore they cannot be assigned
+        # to another vehicle
+        logger.debug('Updating vehicle id pool')
+        self.vehicle_ids = VehicleIdPool(status_map['max_capacity'], status_map['vehicle_ids'])
 
         logger.debug('Updating available_spots')
-        self.available_spots = self.sort_ids(status_map['available_spots'])
+        self.available_spot_ids = BitSet(map(int, status_map['available_spots']))
 
         logger.debug('Updating assigned_spots')
-        self.assigned_spots = self.sort_ids(status_map['assigned_spots'])
+        self.assigned_spot_ids = BitSet(map(int, status_map['assigned_spots']))
+
+        logger.debug('Updating spot type counts')
+        self.spot_type_counts = status_map['spot_type_counts']
+        self.parked_counts = status_map['parked_counts']
+
+    # returns (spots per spot type value, vehicles per vehicle type value per spot type value) of a level.
+    # Levels whose summary did not have them are counted from the spot table once.
+    def type_counts(self, level_id):
+        if level_id not in self.parked_counts:
+            logger.debug('Counting spot types of level ' + level_id)
+            counts = self.levels[level_id].counts()
+            self.spot_type_counts[level_id] = counts['spot_type_counts']
+            self.parked_counts[level_id] = counts['parked_counts']
+        return self.spot_type_counts[level_id], self.parked_counts[level_id]
+
+    # keep the vehicles parked per spot type of a level up to date. Levels not counted yet are left to
+    # type_counts.
+    def count_parked(self, level_id, spots, vehicle, delta):
+        if level_id in self.parked_counts:
+            self.parked_counts[level_id][spots[0].spot_type.value][vehicle.vehicle_type.value] += delta
+
+    # defer looking up the next spots until a batch of changes ends, so every change within the batch
+    # is O(log n) and the next spot map is refreshed once at the end
+    @contextmanager
+    def batch(self):
+        if self._batch:
+            yield self
+            return
+        logger.debug('Starting batch of changes')
+        self._batch = True
+        try:
+            yield self
+        finally:
+            logger.debug('Ending batch of changes')
+            self._batch = False
+            self.initialize_spot_map()
+            if not self.vehicle_ids.available_count():
+                logger.debug('No available vehicle ids. Updating available status.')
+                self.available = False
+
+    # returns number of vehicle ids left to assign
+    def available_id_count(self):
+        return self.vehicle_ids.available_count()
+
+    # returns True if vehicle id is assigned to a vehicle parked in the garage
+    def is_assigned(self, vehicle_id):
+        return vehicle_id in self.vehicle_locations
 
     # returns first available vehicle id
-    # removes id from available ids and adds to assigned ids
+    # marks the id assigned in the vehicle id pool
     def get_vehicle_id(self):
         logger.debug('Getting first available vehicle id')
-        veh_id = self.available_ids[0]
-        logger.debug('Updating available vehicle ids')
-        updated_available = self.available_ids
-        updated_available.remove(veh_id)
-        self.available_ids = self.sort_ids(updated_available)
-        logger.debug('Updating assigned vehicle ids')
-        updated_assigned = self.assigned_ids
-        updated_assigned.append(veh_id)
-        self.assigned_ids = self.sort_ids(updated_assigned)
-        if not self.available_ids:
+        veh_id = self.vehicle_ids.acquire()
+        if veh_id is None:
+            raise IndexError('No available vehicle ids')
+        if not self.vehicle_ids.available_count():
             logger.debug('No available vehicle ids. Updating available status.')
             self.available = False
-        return veh_id
+        return str(veh_id)
 
-    # returns vehicle id from assigned ids to the vehicle ids list
+    # returns vehicle id of the vehicle to the vehicle id pool
     def unassign_vehicle_id(self, vehicle):
         logger.debug('Unassigning vehicle id')
-        if vehicle.id in self.assigned_ids:
-            logger.debug('Updating assigned vehicle ids')
-            updated_assigned = self.assigned_ids
-            updated_assigned.remove(vehicle.id)
-            self.assigned_ids = self.sort_ids(updated_assigned)
-            logger.debug('Updating available vehicle ids')
-            updated_available = self.available_ids
-            updated_available.append(vehicle.id)
-            self.available_ids = self.sort_ids(updated_available)
-        else:
+        if not self.vehicle_ids.release(int(vehicle.id)):
             logger.debug('Vehicle ID was not assigned')
             raise APIError(code='Invalid Vehicle ID',
                            cause='Invalid Vehicle ID',
                            message='Vehicle ID was not assigned in system',
                            status=status_codes.HTTP_NOT_FOUND)
 
+    # take a specific vehicle id out of the available ids, as when replaying a change
+    def reserve_vehicle_id(self, vehicle_id):
+        logger.debug('Reserving vehicle id: ' + vehicle_id)
+        self.vehicle_ids.reserve(int(vehicle_id))
+
     # create new vehicle object
     def set_vehicle(self, vehicle_type):
         logger.debug('Generating new Vehicle object')
@@ -244,57 +388,48 @@ class Garage(object):
             self.bus_count -= 1
 
     # find allocatable spot(s) in garage for vehicle type and return with level and row
-    # as Location object
+    # as Location object. The allocation strategy of the spot index picks the spots, first fit by default.
+    # A bus takes 5 adjacent LARGE spots of one row.
     def get_spot(self, vehicle_type=None):
-        logger.debug('Getting required number of spots')
-        spots_required = 1
-        if vehicle_type == Garage.Vehicle.VehicleType.BUS:
-            spots_required = 5
         logger.debug('Getting location with required spots')
-        location = Garage.Location()
-        for level in self.levels:
-            for row in self.levels[level].rows:
-                spots_found = []
-                for spot in self.levels[level].rows[row].spots:
-                    spot_type = self.levels[level].rows[row].spots[spot].spot_type
-                    if vehicle_type in self._spot_type_map[spot_type]:
-                        if not self.levels[level].rows[row].spots[spot].vehicle:
-                            spot = self.levels[level].rows[row].spots[spot]
-                            spots_found.append(spot)
-                        if len(spots_found) == spots_required:
-                            location.level = self.levels[level]
-                            location.row = self.levels[level].rows[row]
-                            location.spots = spots_found
-                            logger.debug('Location found')
-                            return location
-        logger.debug('No location found. Returning empty location')
-        return location
+        level, row, spots = self.spot_index.find(vehicle_type)
+        if not spots:
+            logger.debug('No location found. Returning empty location')
+        return Garage.Location(level, row, spots)
 
     # assign vehicle to a spot
     def assign_spot(self, location, vehicle):
         level = location.level
         row = location.row
+        if self.shared is not None and not self._remote:
+            # another worker may have taken the spots. location and vehicle id are updated in place if so.
+            self.shared.claim(location, vehicle)
+            level = location.level
+            row = location.row
         spots = location.spots
+        self.spot_index.assign(location)
         for spot in spots:
             logger.debug('Assigning vehicle ' + vehicle.id +
                          ' to spot: ' + spot.id)
             self.levels[level.id].rows[row.id].spots[spot.id].vehicle = vehicle
             self.assign_spot_id(spot)
         self.increment_vehicle_count(vehicle)
-        next_location = self.get_spot(vehicle.vehicle_type)
-        self.set_next_spot(vehicle.vehicle_type, next_location)
+        self.count_parked(level.id, spots, vehicle, 1)
+        self.level_summaries.pop(level.id, None)
+        self.vehicle_locations[vehicle.id] = Garage.Location(level, row, list(spots))
+        # spots are shared between vehicle types, so every next spot may have moved
+        if not self._batch:
+            self.initialize_spot_map()
+        self.version += 1
+        self.notify_change('assign', location, vehicle)
 
     # returns spot id from available spots to the assigned spots
     def assign_spot_id(self, spot):
-        if spot.id in self.available_spots:
+        if int(spot.id) in self.available_spot_ids:
             logger.debug('Updating available spots')
-            updated_available = self.available_spots
-            updated_available.remove(spot.id)
-            self.available_spots = self.sort_ids(updated_available)
+            self.available_spot_ids.discard(int(spot.id))
             logger.debug('Updating assigned spots')
-            updated_assigned = self.assigned_spots
-            updated_assigned.append(spot.id)
-            self.assigned_spots = self.sort_ids(updated_assigned)
+            self.assigned_spot_ids.add(int(spot.id))
 
     # check vehicle assignment of a spot
     def check_spot(self, location):
@@ -312,71 +447,221 @@ class Garage(object):
         level = location.level
         row = location.row
         spots = location.spots
+        if self.shared is not None and not self._remote:
+            self.shared.release(location, vehicle)
+        self.spot_index.unassign(location)
         for spot in spots:
             logger.debug('Unassigning vehicle ' + vehicle.id +
                          ' from spot: ' + spot.id)
             self.levels[level.id].rows[row.id].spots[spot.id].vehicle = None
             self.unassign_spot_id(spot)
         self.unassign_vehicle_id(vehicle)
+        self.vehicle_locations.pop(vehicle.id, None)
         self.decrement_vehicle_count(vehicle)
-        next_location = self.get_spot(vehicle.vehicle_type)
-        self.set_next_spot(vehicle.vehicle_type, next_location)
+        self.count_parked(level.id, spots, vehicle, -1)
+        self.level_summaries.pop(level.id, None)
+        if not self._batch:
+            self.initialize_spot_map()
+        self.version += 1
+        self.notify_change('unassign', location, vehicle)
 
     # returns spot id from assigned spots to the available spots
     def unassign_spot_id(self, spot):
-        if spot.id in self.assigned_spots:
+        if int(spot.id) in self.assigned_spot_ids:
             logger.debug('Updating assigned spots')
-            updated_assigned = self.assigned_spots
-            updated_assigned.remove(spot.id)
-            self.assigned_spots = self.sort_ids(updated_assigned)
+            self.assigned_spot_ids.discard(int(spot.id))
             logger.debug('Updating available spots')
-            updated_available = self.available_spots
-            updated_available.append(spot.id)
-            self.available_spots = self.sort_ids(updated_available)
+            self.available_spot_ids.add(int(spot.id))
+
+    # keep occupancy in a region shared with the other worker processes
+    def attach_shared(self, shared):
+        logger.debug('Attaching shared garage state')
+        self.shared = shared
+
+    # register a callable that receives a change dict after every assign and unassign.
+    # Changes replayed from another worker carry 'remote': True.
+    def add_listener(self, listener):
+        logger.debug('Adding change listener')
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        logger.debug('Removing change listener')
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    # build compact change record, keep it in the change log and pass it to every listener
+    def notify_change(self, op, location, vehicle):
+        change = {'op': op,
+                  'level': location.level.id,
+                  'row': location.row.id,
+                  'spots': [spot.id for spot in location.spots],
+                  'vehicle_id': vehicle.id,
+                  'vehicle_type': vehicle.vehicle_type.value}
+        self.changes.append(self.version, change)
+        if not self._listeners:
+            return
+        if self._remote:
+            change = dict(change, remote=True)
+        for listener in self._listeners:
+            listener(change)
+
+    # build Location object from level, row and spot ids
+    def locate(self, level_id, row_id, spot_ids):
+        level = self.levels[level_id]
+        row = level.rows[row_id]
+        spots = [row.spots[spot_id] for spot_id in spot_ids]
+        return Garage.Location(level, row, spots)
+
+    # returns Location of the spots a vehicle is parked in, or None. Vehicles found by map_status are
+    # only indexed by level id, so the first lookup on a level walks that level once to index all of its
+    # vehicles. Lookups are constant time after that, and for vehicles parked since the garage loaded.
+    def locate_vehicle(self, vehicle_id):
+        location = self.vehicle_locations.get(vehicle_id)
+        if isinstance(location, str):
+            self.index_level_vehicles(location)
+            location = self.vehicle_locations.get(vehicle_id)
+        return location
+
+    # index Location of every vehicle parked on a level
+    def index_level_vehicles(self, level_id):
+        logger.debug('Indexing vehicle locations of level: ' + level_id)
+        level = self.levels[level_id]
+        vehicle_ids = level.table.vehicle_ids
+        vehicle_spots = {}
+        for row in level.rows.values():
+            for number in range(row.start, row.end):
+                if vehicle_ids[number] != EMPTY:
+                    vehicle_spots.setdefault(str(vehicle_ids[number]), (row, []))[1].append(level.spot(number))
+        for vehicle_id, (row, spots) in vehicle_spots.items():
+            if self.vehicle_locations.get(vehicle_id) == level_id:
+                self.vehicle_locations[vehicle_id] = Garage.Location(level, row, spots)
+
+    # returns {vehicle id: Location} of the vehicles found
+    def locate_vehicles(self, vehicle_ids):
+        logger.debug('Locating vehicles')
+        locations = {}
+        for vehicle_id in vehicle_ids:
+            location = self.locate_vehicle(vehicle_id)
+            if location is not None:
+                locations[vehicle_id] = location
+        return locations
+
+    # apply a recorded change to the garage. Changes already reflected in the garage are skipped,
+    # so replaying a change twice is harmless. Remote changes were made by another worker and are
+    # already in the shared state.
+    def apply_change(self, change, remote=False):
+        logger.debug('Applying change: ' + change['op'] + ' vehicle ' + change['vehicle_id'])
+        self._remote = remote
+        try:
+            self.replay_change(change)
+        finally:
+            self._remote = False
+
+    def replay_change(self, change):
+        location = self.locate(change['level'], change['row'], change['spots'])
+        vehicle_in_spot = self.check_spot(location)
+        if change['op'] == 'assign':
+            if vehicle_in_spot and vehicle_in_spot.id == change['vehicle_id']:
+                logger.debug('Change already applied')
+                return
+            self.reserve_vehicle_id(change['vehicle_id'])
+            self.assign_spot(location, Garage.Vehicle(change['vehicle_id'], change['vehicle_type']))
+        elif change['op'] == 'unassign':
+            if not vehicle_in_spot or vehicle_in_spot.id != change['vehicle_id']:
+                logger.debug('Change already applied')
+                return
+            self.unassign_spot(location, vehicle_in_spot)
 
     # Level objects are contained by Garage. Level contains Rows.
+    # The spots of a level take a contiguous range of spot numbers, start to end - 1, of the spot table.
+    # Row objects are created from the row offsets on access, see LevelRows.
     class Level:
-        def __init__(self, level_id, rows):
+        __slots__ = ('id', 'rows', 'table', 'start', 'end', 'row_ids', 'row_ordinals', 'row_offsets')
+
+        def __init__(self, level_id, rows, table=None):
             self.id = level_id
-            self.rows = self.set_rows(rows)
+            self.table = SpotTable() if table is None else table
+            self.start = len(self.table)
+            self.row_ids = []
+            self.row_ordinals = {}
+            # spot number of the first spot of each row, followed by the end of the level
+            self.row_offsets = array('i', [self.start])
+            self.set_rows(rows)
+            self.end = len(self.table)
+            self.rows = LevelRows(self)
+
+        # Level object over rows already in the spot table, with row offsets as kept in row_offsets
+        @classmethod
+        def from_table(cls, level_id, table, row_ids, row_offsets):
+            level = cls(level_id, {}, table)
+            level.start = row_offsets[0]
+            level.end = row_offsets[-1]
+            level.row_ids = row_ids
+            level.row_ordinals = {row_id: ordinal for ordinal, row_id in enumerate(row_ids)}
+            level.row_offsets = array('i', row_offsets)
+            return level
 
-        # assign rows from json to objects
-        @staticmethod
-        def set_rows(rows):
-            new_rows = {}
+        # append spots of the rows from json to the spot table
+        def set_rows(self, rows):
             for row_id, row in rows.items():
-                logger.debug('Creating Row object: ' + row_id)
-                new_rows[row_id] = Garage.Row(row_id, row['spots'])
+                logger.debug('Appending row spots to spot table: ' + row_id)
+                self.row_ordinals[row_id] = len(self.row_ids)
+                self.row_ids.append(row_id)
+                start, end = self.table.append_spots(row['spots'])
+                self.row_offsets.append(end)
 
-            return new_rows
+        # returns Spot object of a spot number of the level
+        def spot(self, number):
+            return Garage.Spot(self.table, number)
+
+        # (key, value) pairs of the level in the garage document
+        def json_items(self):
+            yield 'rows', lambda: ((row_id, row.json_items) for row_id, row in self.rows.items())
+
+        # counts of the level and of each of its rows, taken in one pass over its spot numbers.
+        # Vectorized when NumPy is installed, see aggregate.
+        def counts(self, use_numpy=None):
+            offsets = self.row_offsets
+            return aggregate(self.table, self.start, self.end,
+                             [(offsets[ordinal], offsets[ordinal + 1]) for ordinal in range(len(self.row_ids))],
+                             use_numpy)
+
+        # counts of the level needed by map_status, kept with sharded levels that are not materialized
+        def summary(self):
+            counts = self.counts()
+            free_spots, bus_rows = count_free(self)
+            return {'max_capacity': counts['spot_count'],
+                    'vehicles': dict(zip(map(str, counts['vehicle_ids']), counts['vehicle_types'])),
+                    'available_spots': list(map(str, counts['available_spots'])),
+                    'assigned_spots': list(map(str, counts['assigned_spots'])),
+                    'free_spots': free_spots,
+                    'bus_rows': bus_rows,
+                    'spot_type_counts': counts['spot_type_counts'],
+                    'parked_counts': counts['parked_counts']}
 
     # Row objects are contained by Level. Row contains Spots.
+    # The spots of a row take a contiguous range of spot numbers, start to end - 1, of the spot table.
     class Row:
+        __slots__ = ('id', 'spots', 'start', 'end')
+
         def __init__(self, row_id, spots):
             self.id = row_id
-            self.spots = self.set_spots(spots)
+            self.spots = spots
+            self.start = spots.start
+            self.end = spots.end
 
-        # assign spots from json to objects
-        @staticmethod
-        def set_spots(spots):
-            new_spots = {}
-            for spot_id, spot in spots.items():
-                logger.debug('Creating Spot object: ' + spot_id)
-                spot_type = spot['spot_type']
-                vehicle = spot['vehicle']
-                new_spots[spot_id] = Garage.Spot(spot_id, spot_type, vehicle)
+        # (key, value) pairs of the row in the garage document
+        def json_items(self):
+            yield 'spots', lambda: ((spot.id, spot.json_items) for spot in self.spots.values())
 
-            return new_spots
-
-    # Spot objects are contained by Rows. Spots can contain Vehicle.
+    # Spot objects are views of one spot number of the spot table, created on access.
+    # Spots can contain Vehicle.
     class Spot:
-        def __init__(self, spot_id, spot_type, vehicle=None):
-            self.id = spot_id
-            self.spot_type = self.SpotType(spot_type)
-            self.vehicle = None
+        __slots__ = ('table', 'number')
 
-            if vehicle:
-                self.vehicle = self.set_vehicle(vehicle)
+        def __init__(self, table, number):
+            self.table = table
+            self.number = number
 
         # SpotType Enum for easy assignment of SpotType to Spot
         class SpotType(Enum):
@@ -384,20 +669,57 @@ class Garage(object):
             COMPACT = 1
             LARGE = 2
 
-        # assign Vehicle in spot in doc to Vehicle object
-        @staticmethod
-        def set_vehicle(vehicle):
-            logger.debug('Creating Vehicle object: ' + vehicle['vehicle_id'] +
-                         ' of type: ' + str(vehicle['vehicle_type']))
-            new_vehicle = Garage.Vehicle(vehicle['vehicle_id'], vehicle['vehicle_type'])
-            return new_vehicle
+        def __eq__(self, other):
+            return isinstance(other, Garage.Spot) and self.table is other.table and self.number == other.number
+
+        def __hash__(self):
+            return hash((id(self.table), self.number))
+
+        @property
+        def id(self):
+            return str(self.table.spot_ids[self.number])
+
+        @property
+        def spot_type(self):
+            return SPOT_TYPES[self.table.spot_types[self.number]]
+
+        # Vehicle object of the vehicle in the spot, or None
+        @property
+        def vehicle(self):
+            vehicle_id = self.table.vehicle_ids[self.number]
+            if vehicle_id == EMPTY:
+                return None
+            return Garage.Vehicle(vehicle_id, self.table.vehicle_types[self.number])
+
+        @vehicle.setter
+        def vehicle(self, vehicle):
+            if vehicle is None:
+                self.table.clear_vehicle(self.number)
+            else:
+                self.table.set_vehicle(self.number, int(vehicle.id), vehicle.vehicle_type.value)
+
+        # (key, value) pairs of the spot in the garage document
+        def json_items(self):
+            yield 'spot_type', self.table.spot_types[self.number]
+            vehicle = self.vehicle
+            if vehicle:
+                yield 'vehicle', vehicle.json_items
+            else:
+                yield 'vehicle', no_json_items
 
     # Vehicle objects are assigned to Spots
     class Vehicle:
+        __slots__ = ('id', 'vehicle_type')
+
         def __init__(self, vehicle_id, vehicle_type):
             self.id = str(vehicle_id)
             self.vehicle_type = self.VehicleType(vehicle_type)
 
+        # (key, value) pairs of the vehicle in the garage document
+        def json_items(self):
+            yield 'vehicle_type', self.vehicle_type.value
+            yield 'vehicle_id', self.id
+
         # VehicleType Enum for easy assignment of VehicleType to Vehicle
         class VehicleType(Enum):
             MOTORCYCLE = 0
@@ -407,6 +729,8 @@ class Garage(object):
     # Location serves as a container to make assignment of vehicles to spots
     # more efficient
     class Location:
+        __slots__ = ('level', 'row', 'spots')
+
         def __init__(self, level=None, row=None, spots=None):
             self.level = None
             self.row = None
@@ -423,30 +747,6 @@ class Garage(object):
                 if new_spots:
                     self.spots = new_spots
 
-    # this method insures numeric order of list of ids
-    @staticmethod
-    def sort_ids(ids):
-        logger.debug('Sorting ids as ints.')
-        int_ids = list(map(int, ids))
-        int_ids = sorted(int_ids)
-        str_ids = list(map(str, int_ids))
-        return str_ids
-
-    # returns list of all ids based on capacity of garage
-    @staticmethod
-    def create_vehicle_ids(max_capacity):
-        logger.debug('Creating ranged list of vehicle ids')
-        int_ids = sorted(list(range(0, max_capacity)))
-        str_ids = list(map(str, int_ids))
-        return str_ids
-
-    # returns list of available ids with assigned ids removed.
-    @staticmethod
-    def remove_assigned_ids(available_ids, assigned_ids):
-        logger.debug('Removing assigned list from available list')
-        available_ids = list(set(available_ids) - set(assigned_ids))
-        return available_ids
-
     @staticmethod
     def decouple_spot_id(spots):
         if '-' in spots:
@@ -468,52 +768,274 @@ class Garage(object):
         spot_type = spots[0].spot_type.name
         return {'spot_id': spot_id, 'spot_type': spot_type}
 
-    # parse garage object to dictionary
+    # parse garage object to dictionary. The Garage object is left untouched so it can be reused.
     def garage_to_dict(self):
         logger.debug('Parsing Garage object to dict')
-        garage = self.__dict__
-        for level_id in garage['levels']:
+        levels = {}
+        for level_id, level in self.levels.items():
             logger.debug('Parsing Level object to dict: ' + level_id)
-            level = garage['levels'][level_id].__dict__
-            del level['id']
-            for row_id in level['rows']:
+            rows = {}
+            for row_id, row in level.rows.items():
                 logger.debug('Parsing Row object to dict: ' + row_id)
-                row = level['rows'][row_id].__dict__
-                del row['id']
-                for spot_id in row['spots']:
-                    logger.debug('Parsing Spot object to dict: ' + spot_id)
-                    spot = row['spots'][spot_id].__dict__
-                    del spot['id']
-                    spot['spot_type'] = spot['spot_type'].__dict__.get('_value_', '0')  # should be int
-                    if spot['vehicle']:
-                        logger.debug('Parsing Vehicle object to dict')
-                        vehicle = spot['vehicle'].__dict__
-                        if 'id' in vehicle:
-                            vehicle['vehicle_id'] = vehicle.pop('id')
-                        if not isinstance(vehicle['vehicle_type'], int):
-                            vehicle['vehicle_type'] = vehicle['vehicle_type'].value
-                    else:
-                        vehicle = {}
-                    spot['vehicle'] = vehicle
-                    row['spots'][spot_id] = spot
-                level['rows'][row_id] = row
-            garage['levels'][level_id] = level
-        logger.debug('Deleting unneeded fields from garage dict')
-        del garage['_spot_type_map']
-        del garage['_next_spot_map']
-        del garage['vehicle_count']
-        del garage['max_capacity']
-        del garage['moto_count']
-        del garage['car_count']
-        del garage['bus_count']
-        del garage['available']
-        del garage['available_ids']
-        del garage['assigned_ids']
-        del garage['available_spots']
-        del garage['available_spot_types']
-        del garage['assigned_spots']
-
-        return garage
+                spots = {}
+                for spot_id, spot_type, vehicle_id, vehicle_type in level.table.spots(row.start, row.end):
+                    vehicle = {}
+                    if vehicle_id != EMPTY:
+                        vehicle = {'vehicle_type': vehicle_type,
+                                   'vehicle_id': str(vehicle_id)}
+                    spots[str(spot_id)] = {'spot_type': spot_type,
+                                           'vehicle': vehicle}
+                rows[row_id] = {'spots': spots}
+            levels[level_id] = {'rows': rows}
+
+        return {'name': self.name, 'levels': levels}
+
+    # stream garage as JSON document chunks straight from the object graph, without building
+    # an intermediate dict. Output matches json.dump(self.garage_to_dict(), indent=2).
+    def iter_json(self):
+        return iter_json_dict(self.json_items())
+
+    # (key, value) pairs of the garage document. Nested objects are given as functions
+    # returning their own pairs, so they are only walked while being written.
+    def json_items(self):
+        yield 'name', self.name
+        yield 'levels', lambda: ((level_id, self.level_json_items(level_id)) for level_id in self.levels)
+
+    def level_json_items(self, level_id):
+        if isinstance(self.levels, LazyLevels):
+            return self.levels.json_items(level_id)
+        return self.levels[level_id].json_items
+
+    # counts of a level as kept in level summaries. Levels not materialized give their stored summary,
+    # and the summary of a materialized level is only taken again after the level changed.
+    def level_summary(self, level_id):
+        if isinstance(self.levels, LazyLevels) and not self.levels.is_loaded(level_id):
+            return self.levels.summaries[level_id]
+        if level_id not in self.level_summaries:
+            self.level_summaries[level_id] = self.levels[level_id].summary()
+        return self.level_summaries[level_id]
+
+
+# write (key, value) pairs as indented JSON object chunks. Callable values are nested objects.
+def iter_json_dict(items, depth=0):
+    indent = '  ' * (depth + 1)
+    separator = '{\n'
+    for key, value in items:
+        yield separator + indent + json.dumps(key) + ': '
+        separator = ',\n'
+        if callable(value):
+            yield from iter_json_dict(value(), depth + 1)
+        else:
+            yield json.dumps(value)
+
+    if separator == '{\n':
+        yield '{}'
+    else:
+        yield '\n' + '  ' * depth + '}'
+
+
+# LazyLevels maps level ids to Level objects that are only built on first access.
+# loader(level_id) returns the level document, summaries hold the counts of each level for map_status.
+# documents, if given, holds the level documents of levels not materialized yet, so they can be written
+# back without building them.
+class LazyLevels(dict):
+    def __init__(self, loader, summaries, documents=None):
+        super(LazyLevels, self).__init__()
+        self.loader = loader
+        self.summaries = summaries
+        self.documents = documents
+        # spot table of the Garage the levels belong to. Levels get their own table until one is set.
+        self.table = None
+        for level_id in summaries:
+            dict.__setitem__(self, level_id, None)
+
+    def __getitem__(self, level_id):
+        level = dict.__getitem__(self, level_id)
+        if level is None:
+            logger.debug('Materializing Level object: ' + level_id)
+            level = Garage.Level(level_id, self.loader(level_id)['rows'], self.table)
+            dict.__setitem__(self, level_id, level)
+        return level
+
+    def get(self, level_id, default=None):
+        if level_id in self:
+            return self[level_id]
+        return default
+
+    def values(self):
+        return [self[level_id] for level_id in self]
+
+    def items(self):
+        return [(level_id, self[level_id]) for level_id in self]
+
+    def is_loaded(self, level_id):
+        return dict.__getitem__(self, level_id) is not None
+
+    # (key, value) pairs of a level in the garage document. Levels not materialized are written from
+    # their level document.
+    def json_items(self, level_id):
+        if self.documents is None or self.is_loaded(level_id):
+            return self[level_id].json_items
+        document = self.documents[level_id]
+        return lambda: document_items(document)
+
+
+# (key, value) pairs of a loaded document, in the form of json_items
+def document_items(document):
+    for key, value in document.items():
+        if isinstance(value, dict) and value:
+            yield key, lambda value=value: document_items(value)
+        else:
+            yield key, value
+
+
+def no_json_items():
+    return iter(())
+
+
+# RowSpots maps the spot ids of a row to Spot objects over the row's range of spot numbers in the spot table
+class RowSpots(Mapping):
+    __slots__ = ('table', 'start', 'end')
+
+    def __init__(self, table, start, end):
+        self.table = table
+        self.start = start
+        self.end = end
+
+    # returns spot number of spot id, or None
+    def number(self, spot_id):
+        try:
+            value = int(spot_id)
+        except (TypeError, ValueError):
+            return None
+        if isinstance(spot_id, str) and str(value) != spot_id:
+            return None
+        return self.table.find(value, self.start, self.end)
+
+    def __getitem__(self, spot_id):
+        number = self.number(spot_id)
+        if number is None:
+            raise KeyError(spot_id)
+        return Garage.Spot(self.table, number)
+
+    def __contains__(self, spot_id):
+        return self.number(spot_id) is not None
+
+    def __iter__(self):
+        return map(str, self.table.spot_ids[self.start:self.end])
+
+    def __len__(self):
+        return self.end - self.start
+
+    def values(self):
+        return [Garage.Spot(self.table, number) for number in range(self.start, self.end)]
+
+    def items(self):
+        return [(str(self.table.spot_ids[number]), Garage.Spot(self.table, number))
+                for number in range(self.start, self.end)]
+
+
+# LevelRows maps the row ids of a level to Row objects, created on access from the level's row offsets
+class LevelRows(Mapping):
+    __slots__ = ('level',)
+
+    def __init__(self, level):
+        self.level = level
+
+    # returns Row object of a row ordinal of the level
+    def row(self, ordinal):
+        level = self.level
+        return Garage.Row(level.row_ids[ordinal],
+                          RowSpots(level.table, level.row_offsets[ordinal], level.row_offsets[ordinal + 1]))
+
+    def __getitem__(self, row_id):
+        return self.row(self.level.row_ordinals[row_id])
+
+    def __contains__(self, row_id):
+        return row_id in self.level.row_ordinals
+
+    def __iter__(self):
+        return iter(self.level.row_ids)
+
+    def __len__(self):
+        return len(self.level.row_ids)
+
+    def values(self):
+        return [self.row(ordinal) for ordinal in range(len(self.level.row_ids))]
+
+    def items(self):
+        return [(row.id, row) for row in self.values()]
+
+
+# SpotType members by value, so Spot objects skip the Enum lookup
+SPOT_TYPES = tuple(Garage.Spot.SpotType)
+
+
+# GarageDocumentCache keeps the Garage built from each garage document, and the status computed from it,
+# keyed on a stat fingerprint of the file. The document is only re-read and re-parsed when the
+# fingerprint shows another process has changed the file.
+class GarageDocumentCache(object):
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    # cheap file identity. Changes whenever the file is rewritten or replaced.
+    @staticmethod
+    def fingerprint(fn=None):
+        stat = os.stat(get_file_path(fn))
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    # returns True if the file changed since the cached Garage was built
+    def changed(self, fn=None):
+        with self._lock:
+            entry = self._entries.get(get_file_path(fn))
+            return entry is None or entry['fingerprint'] != self.fingerprint(fn)
+
+    # returns cached Garage of the document, rebuilding it if the file changed
+    def get_garage(self, fn=None):
+        with self._lock:
+            return self.get_entry(fn)['garage']
+
+    # returns cached status of the document, computing it with builder if the file or garage changed
+    def get_status(self, fn, builder):
+        with self._lock:
+            entry = self.get_entry(fn)
+            if entry['status'] is None:
+                logger.debug('Building garage status')
+                entry['status'] = builder(entry['garage'])
+            return entry['status']
+
+    def get_entry(self, fn=None):
+        fqn = get_file_path(fn)
+        if self.changed(fn):
+            logger.debug('Garage document changed. Rebuilding Garage: ' + fqn)
+            fingerprint = self.fingerprint(fn)
+            self._entries[fqn] = {'fingerprint': fingerprint,
+                                  'garage': build_garage(fn=fn),
+                                  'status': None}
+        return self._entries[fqn]
+
+    # record the fingerprint of a document this process just wrote from the cached Garage
+    def refresh(self, fn=None):
+        with self._lock:
+            entry = self._entries.get(get_file_path(fn))
+            if entry is not None:
+                entry['fingerprint'] = self.fingerprint(fn)
+                entry['status'] = None
+
+    # drop the cached status after the cached Garage changed
+    def clear_status(self, fn=None):
+        with self._lock:
+            entry = self._entries.get(get_file_path(fn))
+            if entry is not None:
+                entry['status'] = None
+
+    def invalidate(self, fn=None):
+        with self._lock:
+            self._entries.pop(get_file_path(fn), None)
+
+
+garage_cache = GarageDocumentCache()
 
 
 def build_garage_doc(fn=None):
@@ -524,11 +1046,76 @@ def build_garage_doc(fn=None):
     return doc_data
 
 
-def write_garage_doc(fn=None, data=None):
+# build Garage of a garage document. With level summaries written for the current version of the document,
+# levels are only materialized from the document when first used, so status and operations on one level
+# do not build the whole garage.
+def build_garage(fn=None, strategy_name=None):
+    fingerprint = GarageDocumentCache.fingerprint(fn)
+    summaries = read_level_summaries(fn, fingerprint)
+    document = build_garage_doc(fn=fn)
+    levels = document.get('levels', {})
+    if summaries is None or set(summaries) != set(levels) or GarageDocumentCache.fingerprint(fn) != fingerprint:
+        logger.debug('No current level summaries. Building all levels.')
+        return Garage(document, strategy_name=strategy_name)
+
+    # level documents are dropped as their levels are materialized
+    return Garage(dict(document, levels=LazyLevels(levels.pop, summaries, levels)), strategy_name=strategy_name)
+
+
+# level summaries are kept next to the garage document, e.g. data/main_garage_v1.json.summary
+def get_summary_path(fn=None):
+    return get_file_path(fn) + '.summary'
+
+
+# returns level summaries of the garage document, or None if they were not written for its fingerprint
+def read_level_summaries(fn=None, fingerprint=None):
+    path = get_summary_path(fn)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as summary_file:
+            data = json.load(summary_file)
+    except ValueError:
+        logger.debug('Unreadable level summaries: ' + path)
+        return None
+
+    if fingerprint is None:
+        fingerprint = GarageDocumentCache.fingerprint(fn)
+    if data.get('fingerprint') != list(fingerprint):
+        logger.debug('Level summaries are stale: ' + path)
+        return None
+    return data['levels']
+
+
+# write summaries of the levels of garage, for the garage document just written from it.
+# Only the levels changed since their last summary are counted again. As with the garage document,
+# the summaries are written to a temporary file of this process and replace the old ones in one rename.
+def write_level_summaries(fn=None, garage=None, sync=False):
+    path = get_summary_path(fn)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    data = {'fingerprint': list(GarageDocumentCache.fingerprint(fn)),
+            'levels': {level_id: garage.level_summary(level_id) for level_id in garage.levels}}
+    with open(tmp_path, 'w') as summary_file:
+        json.dump(data, summary_file)
+        if sync:
+            summary_file.flush()
+            os.fsync(summary_file.fileno())
+    os.replace(tmp_path, path)
+
+
+# write garage document of data. extra_items are (key, value) pairs written after those of the garage.
+# The document is written to a temporary file of this process and replaces the old one in one rename,
+# so other processes never read it half-written.
+def write_garage_doc(fn=None, data=None, sync=False, extra_items=()):
     fqn = get_file_path(fn)
-    parsed_dict = data.garage_to_dict()
-    with open(fqn, 'w') as json_file:
-        json.dump(parsed_dict, json_file, indent=2)
+    tmp_fqn = '{}.{}.tmp'.format(fqn, os.getpid())
+    with open(tmp_fqn, 'w') as json_file:
+        for chunk in iter_json_dict(chain(data.json_items(), extra_items)):
+            json_file.write(chunk)
+        if sync:
+            json_file.flush()
+            os.fsync(json_file.fileno())
+    os.replace(tmp_fqn, fqn)
 
 
 def get_file_path(fn=None):
@@ -0,0 +1,80 @@
+import heapq
+import logging
+
+from src.garage.api.bitmap import Bitmap, bit_count, set_bits
+
+logger = logging.getLogger(__name__)
+
+
+# VehicleIdPool hands out the lowest free vehicle id of 0 to size - 1. Assigned ids are bits of a Bitmap
+# and the lowest id that may still be free is remembered, so acquire and release are O(1) amortized.
+# Ids are ints here and only become strings where the Garage hands them out.
+class VehicleIdPool(object):
+    def __init__(self, size, assigned=()):
+        self.size = size
+        self.bitmap = Bitmap(bytearray(Bitmap.byte_length(size)), size)
+        # ids outside 0 to size - 1 found in a garage document. They are never handed out.
+        self.outside = set()
+        self.lowest = 0
+        assigned = list(assigned)
+        if assigned and (min(assigned) < 0 or max(assigned) >= size):
+            self.outside.update(vehicle_id for vehicle_id in assigned if not 0 <= vehicle_id < size)
+            assigned = [vehicle_id for vehicle_id in assigned if 0 <= vehicle_id < size]
+        set_bits(self.bitmap.buffer, assigned)
+        self.count = bit_count(self.bitmap.buffer)
+
+    def __contains__(self, vehicle_id):
+        if 0 <= vehicle_id < self.size:
+            return self.bitmap.get(vehicle_id)
+        return vehicle_id in self.outside
+
+    def __len__(self):
+        return self.count + len(self.outside)
+
+    def available_count(self):
+        return self.size - self.count
+
+    # returns lowest free id and marks it assigned, or None if every id is assigned
+    def acquire(self):
+        vehicle_id = self.bitmap.find_first_zero(self.lowest)
+        if vehicle_id is None:
+            self.lowest = self.size
+            return None
+        self.bitmap.set(vehicle_id)
+        self.count += 1
+        self.lowest = vehicle_id + 1
+        return vehicle_id
+
+    # marks a specific id assigned. Returns False if it already was.
+    def reserve(self, vehicle_id):
+        if vehicle_id in self:
+            return False
+        if 0 <= vehicle_id < self.size:
+            self.bitmap.set(vehicle_id)
+            self.count += 1
+        else:
+            self.outside.add(vehicle_id)
+        return True
+
+    # marks an assigned id free again. Returns False if it was not assigned.
+    def release(self, vehicle_id):
+        if vehicle_id not in self:
+            return False
+        if 0 <= vehicle_id < self.size:
+            self.bitmap.clear(vehicle_id)
+            self.count -= 1
+            self.lowest = min(self.lowest, vehicle_id)
+        else:
+            self.outside.discard(vehicle_id)
+        return True
+
+    # assigned ids from start on, in ascending order
+    def assigned(self, start=0):
+        inside = self.bitmap.iter_set(start)
+        if not self.outside:
+            return inside
+        return heapq.merge(inside, sorted(vehicle_id for vehicle_id in self.outside if vehicle_id >= start))
+
+    # free ids in ascending order
+    def available(self):
+        return (vehicle_id for vehicle_id in range(self.size) if not self.bitmap.get(vehicle_id))
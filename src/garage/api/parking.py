@@ -1,8 +1,7 @@
 import logging
 
-from src.garage.api.garage import (Garage,
-                                   build_garage_doc,
-                                   write_garage_doc)
+from src.garage.api.garage import Garage
+from src.garage.api.state import garage_state
 from src.garage.utils import (validate_request_body,
                               APIError,
                               status_codes)
@@ -10,117 +9,144 @@ from src.garage.utils import (validate_request_body,
 logger = logging.getLogger(__name__)
 
 
-# create instance of Garage object from json file
-def get_garage_data(fn='main_garage_v1.json'):
-    return build_garage_doc(fn=fn)
+# get long-lived Garage object from garage state, or a one-off Garage from the supplied document
+def get_garage_data(document=None):
+    if document:
+        logger.debug('Instantiating Garage class object from document')
+        return Garage(document)
 
+    return garage_state.garage
 
-def update_garage_data(garage, fn='main_garage_v1.json'):
-    return write_garage_doc(fn, garage)
+
+# persist changes of the long-lived Garage. A one-off Garage of a supplied document is not stored.
+def update_garage_data(garage, document=None):
+    if document:
+        logger.debug('Garage of the supplied document is not saved')
+        return
+    return garage_state.save(garage)
 
 
 def http_put(request, response, params, document=None):
     """ Resource = garage/v1/parking """
 
-    if not document:
-        logger.debug('Loading garage document')
-        document = get_garage_data()
+    # the garage is taken under the lock, so it is the live one while it is changed
+    with garage_state.lock:
+        logger.debug('Loading garage')
+        garage = get_garage_data(document)
+        response_dict = park_vehicle(garage, request.body)
+
+    # update garage document
+    update_garage_data(garage, document)
 
-    # create instance of Garage object from json file
-    logger.debug('Instantiating Garage class object')
-    garage = Garage(document)
+    response.status = status_codes.HTTP_CREATED
+    response.body = response_dict
 
+
+def park_vehicle(garage, request_body):
     # check the garage overall availability
     logger.debug('Checking available status')
-    if garage.available:
-
-        # validate request body
-        validate_request_body(request.body,
-                              required_params={'vehicle_type': int})
-
-        # validate vehicle type
-        selected_vehicle_type = request.body['vehicle_type']
-        if not garage.Vehicle.VehicleType(selected_vehicle_type):
-            raise APIError(code='Invalid Vehicle Type',
-                           cause='Invalid Vehicle Type',
-                           message='Please enter correct Vehicle Type',
-                           status=status_codes.HTTP_BAD_REQUEST)
-
-        # get new vehicle id from vehicle counter
-        # instantiate new vehicle object
-
-        logger.debug('Creating Vehicle')
-        vehicle = garage.set_vehicle(selected_vehicle_type)
-
-        # look for available spot for this vehicle type
-        logger.debug('Getting Spot for Vehicle')
-        available = garage.get_next_spot(vehicle.vehicle_type)
-        if available.spots:
-            # place vehicle object in spot object
-            garage.assign_spot(available, vehicle)
-
-            # format assigned spot for readability
-            spots = garage.format_spot(available.spots)
-
-            # populate response dict
-            response_dict = {'vehicle_id': vehicle.id,
-                             'vehicle_type': vehicle.vehicle_type.name,
-                             'level': available.level.id,
-                             'row': available.row.id,
-                             'spot_id': spots['spot_id'],
-                             'spot_type': spots['spot_type']}
-
-            # update garage document
-            update_garage_data(garage=garage)
-
-        # else here means that no spot permissible for this vehicle type was found
-        else:
-            raise APIError(code='Full for Vehicle Type: ' + vehicle.vehicle_type.name,
-                           cause='Full for Vehicle Type: ' + vehicle.vehicle_type.name,
-                           message='Please come again',
-                           status=status_codes.HTTP_BAD_REQUEST)
-
-    # else here means that the garage is not available, and is marked as such
-    else:
+    if not garage.available:
         raise APIError(code='Garage Full',
                        cause='Garage Full',
                        message='Please come again',
                        status=status_codes.HTTP_BAD_REQUEST)
 
-    response.status = status_codes.HTTP_CREATED
-    response.body = response_dict
+    # validate request body
+    validate_request_body(request_body,
+                          required_params={'vehicle_type': int})
+
+    # validate vehicle type
+    selected_vehicle_type = request_body['vehicle_type']
+    if not garage.Vehicle.VehicleType(selected_vehicle_type):
+        raise APIError(code='Invalid Vehicle Type',
+                       cause='Invalid Vehicle Type',
+                       message='Please enter correct Vehicle Type',
+                       status=status_codes.HTTP_BAD_REQUEST)
+    vehicle_type = garage.Vehicle.VehicleType(selected_vehicle_type)
+
+    # look for available spot for this vehicle type before taking a vehicle id,
+    # so a rejected request leaves the live garage untouched
+    logger.debug('Getting Spot for Vehicle')
+    available = garage.get_next_spot(vehicle_type)
+    if not available.spots:
+        raise APIError(code='Full for Vehicle Type: ' + vehicle_type.name,
+                       cause='Full for Vehicle Type: ' + vehicle_type.name,
+                       message='Please come again',
+                       status=status_codes.HTTP_BAD_REQUEST)
+
+    # get new vehicle id from vehicle counter
+    # instantiate new vehicle object
+    logger.debug('Creating Vehicle')
+    vehicle = garage.set_vehicle(selected_vehicle_type)
+
+    # place vehicle object in spot object
+    garage.assign_spot(available, vehicle)
+
+    return parked_response(garage, available, vehicle)
+
+
+# response dict of a vehicle assigned to location
+def parked_response(garage, location, vehicle):
+    # format assigned spot for readability
+    spots = garage.format_spot(location.spots)
+
+    # populate response dict
+    return {'vehicle_id': vehicle.id,
+            'vehicle_type': vehicle.vehicle_type.name,
+            'level': location.level.id,
+            'row': location.row.id,
+            'spot_id': spots['spot_id'],
+            'spot_type': spots['spot_type']}
 
 
 def http_delete(request, response, params, document=None):
     """ Resource = garage/v1/parking """
-    if not document:
-        logger.debug('Loading garage document')
-        document = get_garage_data()
 
-    # create instance of Garage object from json file
-    logger.debug('Instantiating Garage class object')
-    garage = Garage(document)
+    # the garage is taken under the lock, so it is the live one while it is changed
+    with garage_state.lock:
+        logger.debug('Loading garage')
+        garage = get_garage_data(document)
+        unpark_vehicle(garage, request.body)
 
+    logger.debug('Updating garage document')
+    update_garage_data(garage, document)
+
+
+# unpark vehicle by vehicle id. Level, row and spot id are optional. When given, they must match
+# where the vehicle is parked; otherwise the vehicle is found through the vehicle location index.
+def unpark_vehicle(garage, request_body):
     # validate request body
-    validate_request_body(request.body,
-                          required_params={'vehicle_id': str,
-                                           'spot_id': str,
+    validate_request_body(request_body,
+                          required_params={'vehicle_id': str},
+                          optional_params={'spot_id': str,
                                            'row': str,
                                            'level': str})
 
-    selected_vehicle = request.body['vehicle_id']
-    selected_spots = garage.decouple_spot_id(request.body['spot_id'])
-    selected_row = request.body['row']
-    selected_level = request.body['level']
-    location = Garage.Location
+    selected_vehicle = request_body['vehicle_id']
 
     logger.debug('Checking assigned vehicle ids')
-    if selected_vehicle not in garage.assigned_ids:
+    if not garage.is_assigned(selected_vehicle):
         raise APIError(code='Invalid Vehicle ID',
                        cause='Invalid Vehicle ID',
                        message='Please enter correct Vehicle ID',
                        status=status_codes.HTTP_NOT_FOUND)
 
+    if not any(param in request_body for param in ('spot_id', 'row', 'level')):
+        logger.debug('Locating vehicle')
+        location = garage.locate_vehicle(selected_vehicle)
+        logger.debug('Unassigning vehicle')
+        garage.unassign_spot(location, garage.check_spot(location))
+        return
+
+    validate_request_body(request_body,
+                          required_params={'spot_id': str,
+                                           'row': str,
+                                           'level': str})
+    selected_spots = garage.decouple_spot_id(request_body['spot_id'])
+    selected_row = request_body['row']
+    selected_level = request_body['level']
+    location = Garage.Location()
+
     logger.debug('Checking location')
     if selected_level in garage.levels:
         location.level = garage.levels[selected_level]
@@ -140,7 +166,6 @@ def http_delete(request, response, params, document=None):
 
     valid_spots = []
     for spot in selected_spots:
-        # spot = garage.levels[selected_level].rows[selected_row].spots[spot]
         if spot in garage.levels[selected_level].rows[selected_row].spots:
             valid_spots.append(garage.levels[selected_level].rows[selected_row].spots[spot])
     if not valid_spots:
@@ -148,17 +173,15 @@ def http_delete(request, response, params, document=None):
                        cause='Invalid Spot ID',
                        message='Please enter correct Spot ID',
                        status=status_codes.HTTP_BAD_REQUEST)
-    else:
-        location.spots = valid_spots
-        logger.debug('Checking for vehicle in locaton')
-        vehicle_in_location = garage.check_spot(location)
-        if vehicle_in_location.id != selected_vehicle:
-            raise APIError(code='Vehicle Not in Spot',
-                           cause='Vehicle Not in Spot',
-                           message='Please enter correct Spot ID or Vehicle ID',
-                           status=status_codes.HTTP_BAD_REQUEST)
-        else:
-            logger.debug('Unassigning vehicle')
-            garage.unassign_spot(location, vehicle_in_location)
-            logger.debug('Updating garage document')
-            update_garage_data(garage=garage)
+
+    location.spots = valid_spots
+    logger.debug('Checking for vehicle in locaton')
+    vehicle_in_location = garage.check_spot(location)
+    if not vehicle_in_location or vehicle_in_location.id != selected_vehicle:
+        raise APIError(code='Vehicle Not in Spot',
+                       cause='Vehicle Not in Spot',
+                       message='Please enter correct Spot ID or Vehicle ID',
+                       status=status_codes.HTTP_BAD_REQUEST)
+
+    logger.debug('Unassigning vehicle')
+    garage.unassign_spot(location, vehicle_in_location)
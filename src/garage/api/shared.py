@@ -0,0 +1,310 @@
+import fcntl
+import logging
+import mmap
+import os
+import struct
+from array import array
+
+from src.garage.api.bitmap import Bitmap
+from src.garage.api.spots import EMPTY
+from src.garage.utils import APIError, status_codes
+
+logger = logging.getLogger(__name__)
+
+# Shared garage region layout, all little endian. The region is an mmap'd file, e.g. under /dev/shm,
+# so every worker process on the host sees the same occupancy.
+#   header:            magic, version, level count, spot count, ring size, last change sequence,
+#                      free spots per spot type
+#   occupancy bitmap:  one bit per spot, in document order
+#   vehicle id bitmap: one bit per vehicle id
+#   vehicle id table:  int32 per spot, -1 when empty
+#   vehicle type table: uint8 per spot
+#   change ring:       (sequence, spot position) of the last ring size spot changes
+# Workers lock byte 0 of the file while touching the header, ring and vehicle ids,
+# and byte 1 + level index while claiming or releasing spots of a level.
+MAGIC = b'GRGM'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIQ3i')
+RING_ENTRY = struct.Struct('<QI4x')
+HEADER_SIZE = 64
+EMPTY_VEHICLE_ID = -1
+
+
+def aligned(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+# SharedGarage keeps the occupancy of a Garage in a region shared by every worker process.
+# Each worker keeps its own Garage object graph and replays the spot changes of the other workers
+# from the change ring before serving a request.
+class SharedGarage(object):
+    def __init__(self, path, garage, ring_size=4096):
+        self.path = path
+        self.garage = garage
+        self.table = garage.spot_table
+        # position in the region, in document order, to spot number of the spot table, and back.
+        # Lazy levels may have been added to the spot table out of document order.
+        self.numbers = array('q')
+        self.rows = []
+        self.level_indexes = {}
+        for level_id, level in garage.levels.items():
+            self.level_indexes[level_id] = len(self.level_indexes)
+            for row_id, row in level.rows.items():
+                self.numbers.extend(range(row.start, row.end))
+                self.rows.extend([(level_id, row_id)] * (row.end - row.start))
+        self.positions = array('q', [-1]) * len(self.table)
+        for position, number in enumerate(self.numbers):
+            self.positions[number] = position
+        self.spot_count = len(self.numbers)
+        self.ring_size = ring_size
+
+        self._occupancy_offset = HEADER_SIZE
+        self._ids_offset = self._occupancy_offset + Bitmap.byte_length(self.spot_count)
+        self._vehicle_id_offset = aligned(self._ids_offset + Bitmap.byte_length(self.spot_count))
+        self._vehicle_type_offset = self._vehicle_id_offset + 4 * self.spot_count
+        self._ring_offset = aligned(self._vehicle_type_offset + self.spot_count)
+        self.region_size = self._ring_offset + RING_ENTRY.size * ring_size
+
+        # the vehicle id bitmap has one bit per id the vehicle id pool hands out, 0 to spot count - 1.
+        # Vehicles of the garage document with other ids cannot be shared.
+        outside = sorted(vehicle_id for vehicle_id in garage.vehicle_ids.outside if vehicle_id < 0)
+        outside.extend(garage.vehicle_ids.assigned(self.spot_count))
+        if outside:
+            raise ValueError('Vehicle ids {} are outside the vehicle ids 0 to {} of shared garage region: {}'
+                             .format(outside, self.spot_count - 1, path))
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.lock_header()
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                self.initialize()
+            self._map = mmap.mmap(self._fd, self.region_size)
+        finally:
+            self.unlock_header()
+
+        magic, version, level_count, spot_count, ring_size = HEADER.unpack_from(self._map, 0)[:5]
+        if magic != MAGIC or version != VERSION or spot_count != self.spot_count or ring_size != self.ring_size:
+            self.close()
+            raise ValueError('Shared garage region does not match garage: ' + path)
+
+        self.occupancy = Bitmap(memoryview(self._map)[self._occupancy_offset:self._ids_offset], self.spot_count)
+        self.vehicle_ids = Bitmap(memoryview(self._map)[self._ids_offset:self._vehicle_id_offset], self.spot_count)
+        self.vehicle_id_table = memoryview(self._map)[self._vehicle_id_offset:self._vehicle_type_offset].cast('i')
+        self.vehicle_type_table = memoryview(self._map)[self._vehicle_type_offset:self._ring_offset]
+
+        # the first worker wrote the region from its own garage, every other worker catches up here
+        self.seq = 0
+        self.resync()
+
+    # write the region from the garage of the first worker
+    def initialize(self):
+        logger.debug('Initializing shared garage region: ' + self.path)
+        os.ftruncate(self._fd, self.region_size)
+        region = mmap.mmap(self._fd, self.region_size)
+        occupancy = Bitmap(memoryview(region)[self._occupancy_offset:self._ids_offset], self.spot_count)
+        vehicle_ids = Bitmap(memoryview(region)[self._ids_offset:self._vehicle_id_offset], self.spot_count)
+        vehicle_id_table = memoryview(region)[self._vehicle_id_offset:self._vehicle_type_offset].cast('i')
+        free = [0, 0, 0]
+        for position, number in enumerate(self.numbers):
+            vehicle_id_table[position] = EMPTY_VEHICLE_ID
+            if self.table.vehicle_ids[number] != EMPTY:
+                occupancy.set(position)
+                vehicle_ids.set(self.vehicle_index(self.table.vehicle_ids[number]))
+                vehicle_id_table[position] = self.table.vehicle_ids[number]
+                region[self._vehicle_type_offset + position] = self.table.vehicle_types[number]
+            else:
+                free[self.table.spot_types[number]] += 1
+        HEADER.pack_into(region, 0, MAGIC, VERSION, len(self.level_indexes), self.spot_count, self.ring_size,
+                         0, free[0], free[1], free[2])
+        del occupancy, vehicle_ids, vehicle_id_table
+        region.flush()
+        region.close()
+
+    # returns bit of a vehicle id in the vehicle id bitmap, checked against its size
+    def vehicle_index(self, vehicle_id):
+        vehicle_id = int(vehicle_id)
+        if not 0 <= vehicle_id < self.spot_count:
+            raise ValueError('Vehicle id {} is outside the vehicle ids 0 to {} of shared garage region: {}'
+                             .format(vehicle_id, self.spot_count - 1, self.path))
+        return vehicle_id
+
+    def lock_header(self, shared=False):
+        fcntl.lockf(self._fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX, 1, 0)
+
+    def unlock_header(self):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+
+    def lock_level(self, level_id):
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 1 + self.level_indexes[level_id])
+
+    def unlock_level(self, level_id):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 1 + self.level_indexes[level_id])
+
+    # returns free spots per spot type value across every worker
+    def free_counts(self):
+        return list(HEADER.unpack_from(self._map, 0)[6:9])
+
+    # claim the spots of location and the vehicle id of vehicle. When another worker took one of them first,
+    # catch up and claim the next spot for the vehicle type, or the next vehicle id, instead.
+    # location and vehicle are updated in place with what was actually claimed.
+    def claim(self, location, vehicle):
+        while True:
+            if not location.spots or vehicle.id is None:
+                if vehicle.id is not None:
+                    self.garage.unassign_vehicle_id(vehicle)
+                raise APIError(code='Full for Vehicle Type: ' + vehicle.vehicle_type.name,
+                               cause='Full for Vehicle Type: ' + vehicle.vehicle_type.name,
+                               message='Please come again',
+                               status=status_codes.HTTP_BAD_REQUEST)
+
+            level_id = location.level.id
+            positions = [self.positions[spot.number] for spot in location.spots]
+            self.lock_level(level_id)
+            try:
+                if not any(self.occupancy.get(position) for position in positions):
+                    # vehicle ids are shared by every level, so they are only safe under the header lock
+                    self.lock_header()
+                    try:
+                        if not self.vehicle_ids.get(self.vehicle_index(vehicle.id)):
+                            self.vehicle_ids.set(self.vehicle_index(vehicle.id))
+                            for position in positions:
+                                self.occupancy.set(position)
+                                self.vehicle_id_table[position] = int(vehicle.id)
+                                self.vehicle_type_table[position] = vehicle.vehicle_type.value
+                            self.record(positions, -1)
+                            return location
+                    finally:
+                        self.unlock_header()
+            finally:
+                self.unlock_level(level_id)
+
+            logger.debug('Spot or vehicle id taken by another worker. Syncing shared garage.')
+            self.lock_header(shared=True)
+            try:
+                self.catch_up()
+                vehicle_id_taken = self.vehicle_ids.get(self.vehicle_index(vehicle.id))
+            finally:
+                self.unlock_header()
+            if vehicle_id_taken:
+                # the other worker's vehicle now holds the id locally as well, so it stays assigned
+                vehicle.id = self.garage.get_vehicle_id() if self.garage.available_id_count() else None
+            if any(spot.vehicle for spot in location.spots):
+                next_location = self.garage.get_spot(vehicle.vehicle_type)
+                location.level = next_location.level
+                location.row = next_location.row
+                location.spots = next_location.spots
+
+    # release the spots of location and the vehicle id of vehicle
+    def release(self, location, vehicle):
+        level_id = location.level.id
+        positions = [self.positions[spot.number] for spot in location.spots]
+        self.lock_level(level_id)
+        try:
+            if any(self.vehicle_id_table[position] != int(vehicle.id) for position in positions):
+                raise APIError(code='Vehicle Not in Spot',
+                               cause='Vehicle Not in Spot',
+                               message='Please enter correct Spot ID or Vehicle ID',
+                               status=status_codes.HTTP_BAD_REQUEST)
+            self.lock_header()
+            try:
+                for position in positions:
+                    self.occupancy.clear(position)
+                    self.vehicle_id_table[position] = EMPTY_VEHICLE_ID
+                self.vehicle_ids.clear(self.vehicle_index(vehicle.id))
+                self.record(positions, 1)
+            finally:
+                self.unlock_header()
+        finally:
+            self.unlock_level(level_id)
+
+    # bump free counters and append changed positions to the ring. Caller holds the header lock.
+    def record(self, positions, free_delta):
+        header = list(HEADER.unpack_from(self._map, 0))
+        seq = header[5]
+        for position in positions:
+            seq += 1
+            RING_ENTRY.pack_into(self._map, self._ring_offset + (seq % self.ring_size) * RING_ENTRY.size,
+                                 seq, position)
+            header[6 + self.table.spot_types[self.numbers[position]]] += free_delta
+        # only skip ahead when caught up. Otherwise the next sync replays the other workers' changes,
+        # and this worker's own changes are found already applied.
+        if self.seq == header[5]:
+            self.seq = seq
+        header[5] = seq
+        HEADER.pack_into(self._map, 0, *header)
+
+    # apply spot changes made by other workers since the last sync to the local garage
+    def sync(self):
+        self.lock_header(shared=True)
+        try:
+            self.catch_up()
+        finally:
+            self.unlock_header()
+
+    # replay the changed positions from the ring. Caller holds the header lock.
+    def catch_up(self):
+        head = HEADER.unpack_from(self._map, 0)[5]
+        if head == self.seq:
+            return
+        if head - self.seq > self.ring_size:
+            positions = None
+        else:
+            positions = set()
+            for seq in range(self.seq + 1, head + 1):
+                entry_seq, position = RING_ENTRY.unpack_from(
+                    self._map, self._ring_offset + (seq % self.ring_size) * RING_ENTRY.size)
+                if entry_seq != seq:
+                    positions = None
+                    break
+                positions.add(position)
+        if positions is None:
+            logger.debug('Shared garage ring overrun. Comparing every spot.')
+            positions = range(self.spot_count)
+        self.apply(positions)
+        self.seq = head
+
+    # compare every spot with the shared region
+    def resync(self):
+        self.lock_header(shared=True)
+        try:
+            self.apply(range(self.spot_count))
+            self.seq = HEADER.unpack_from(self._map, 0)[5]
+        finally:
+            self.unlock_header()
+
+    # bring local spots at positions in line with the shared region, vacating before occupying
+    def apply(self, positions):
+        vacated = {}
+        occupied = {}
+        for position in positions:
+            level_id, row_id = self.rows[position]
+            number = self.numbers[position]
+            shared_id = self.vehicle_id_table[position]
+            local_id = self.table.vehicle_ids[number]
+            if local_id == shared_id:
+                continue
+            if local_id != EMPTY_VEHICLE_ID:
+                vacated[local_id] = (level_id, row_id, self.table.vehicle_types[number])
+            if shared_id != EMPTY_VEHICLE_ID:
+                occupied.setdefault(shared_id, (level_id, row_id, self.vehicle_type_table[position], []))
+                occupied[shared_id][3].append(str(self.table.spot_ids[number]))
+
+        for vehicle_id, (level_id, row_id, vehicle_type) in vacated.items():
+            spot_ids = [spot_id for spot_id, spot in self.garage.levels[level_id].rows[row_id].spots.items()
+                        if spot.vehicle and spot.vehicle.id == str(vehicle_id)]
+            self.garage.apply_change({'op': 'unassign', 'level': level_id, 'row': row_id, 'spots': spot_ids,
+                                      'vehicle_id': str(vehicle_id), 'vehicle_type': vehicle_type}, remote=True)
+
+        for vehicle_id, (level_id, row_id, vehicle_type, spot_ids) in occupied.items():
+            self.garage.apply_change({'op': 'assign', 'level': level_id, 'row': row_id, 'spots': spot_ids,
+                                      'vehicle_id': str(vehicle_id), 'vehicle_type': vehicle_type}, remote=True)
+
+    def close(self):
+        self.occupancy = self.vehicle_ids = None
+        self.vehicle_id_table = self.vehicle_type_table = None
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
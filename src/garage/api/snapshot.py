@@ -0,0 +1,212 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# Binary garage snapshot layout, all little endian:
+#   header:      magic, format version, name length, level count, row count, spot count
+#   name:        utf-8 garage name, padded to a multiple of 4 bytes
+#   level table: one record per level. level id, index of first row, row count
+#   row table:   one record per row. row id, position of first spot, spot count
+#   spots:       one fixed-width record per spot, in document order.
+#                spot id, vehicle id (-1 when empty), spot type, vehicle type (255 when empty)
+# Level, row, spot and vehicle ids are stored as ints, so documents must use numeric ids.
+MAGIC = b'GRGS'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIII')
+TABLE = struct.Struct('<iII')
+SPOT = struct.Struct('<iiBB2x')
+EMPTY_VEHICLE_ID = -1
+EMPTY_VEHICLE_TYPE = 255
+
+
+# GarageSnapshot reads a binary garage snapshot in place through mmap
+class GarageSnapshot(object):
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        self._file = open(path, 'r+b' if writable else 'rb')
+        access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+        self._map = mmap.mmap(self._file.fileno(), 0, access=access)
+
+        magic, version, name_length, self.level_count, self.row_count, self.spot_count = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('Not a version {} garage snapshot: {}'.format(VERSION, path))
+
+        offset = HEADER.size
+        self.name = bytes(self._map[offset:offset + name_length]).decode('utf-8')
+        self._level_offset = offset + padded(name_length)
+        self._row_offset = self._level_offset + self.level_count * TABLE.size
+        self._spot_offset = self._row_offset + self.row_count * TABLE.size
+
+    # returns (level id, first row index, row count) of level at index
+    def level(self, index):
+        return TABLE.unpack_from(self._map, self._level_offset + index * TABLE.size)
+
+    # returns (row id, first spot position, spot count) of row at index
+    def row(self, index):
+        return TABLE.unpack_from(self._map, self._row_offset + index * TABLE.size)
+
+    # returns (spot id, vehicle id, spot type, vehicle type) of spot at position
+    def spot(self, position):
+        return SPOT.unpack_from(self._map, self._spot_offset + position * SPOT.size)
+
+    # iterate spot records without copying the spot section
+    def iter_spots(self, first=0, count=None):
+        if count is None:
+            count = self.spot_count - first
+        start = self._spot_offset + first * SPOT.size
+        return SPOT.iter_unpack(memoryview(self._map)[start:start + count * SPOT.size])
+
+    # update occupancy of spot at position in place
+    def set_vehicle(self, position, vehicle_id=None, vehicle_type=None):
+        spot_id, _, spot_type, _ = self.spot(position)
+        if vehicle_id is None:
+            vehicle_id = EMPTY_VEHICLE_ID
+            vehicle_type = EMPTY_VEHICLE_TYPE
+        SPOT.pack_into(self._map, self._spot_offset + position * SPOT.size,
+                       spot_id, int(vehicle_id), spot_type, vehicle_type)
+
+    def flush(self):
+        if self.writable:
+            self._map.flush()
+
+    # append the spot records to the arrays of a SpotTable by slicing the spot section, without a pass
+    # per spot. Returns (level id, row ids, row offsets) of every level, with row offsets as kept by
+    # Garage.Level: the spot number of the first spot of each row, followed by the end of the level.
+    # The fields of a spot are interleaved in its record, so a column of the table cannot be a view of
+    # the map and each column is copied out once. That is about a tenth of loading a garage; the rest is
+    # the counts and id sets map_status builds, which a view would not save.
+    def fill_table(self, table):
+        start = len(table)
+        records = self._map[self._spot_offset:self._spot_offset + self.spot_count * SPOT.size]
+        # spot and vehicle ids are the first two of the 32 bit words of a record
+        words = array('i', records)
+        if sys.byteorder != 'little':
+            words.byteswap()
+        record_words = SPOT.size // words.itemsize
+        table.spot_ids.extend(words[0::record_words])
+        table.vehicle_ids.extend(words[1::record_words])
+        # empty vehicle type 255 reads as the table's EMPTY, -1, as a signed byte
+        table.spot_types.frombytes(records[8::SPOT.size])
+        table.vehicle_types.frombytes(records[9::SPOT.size])
+
+        levels = []
+        end = start
+        for level_index in range(self.level_count):
+            level_id, first_row, row_count = self.level(level_index)
+            row_ids = []
+            row_offsets = [end]
+            for row_index in range(first_row, first_row + row_count):
+                row_id, first_spot, spot_count = self.row(row_index)
+                row_ids.append(str(row_id))
+                row_offsets[-1] = start + first_spot
+                end = start + first_spot + spot_count
+                row_offsets.append(end)
+            levels.append((str(level_id), row_ids, row_offsets))
+        return levels
+
+    # build garage document dict from the snapshot
+    def to_document(self):
+        levels = {}
+        for level_index in range(self.level_count):
+            level_id, first_row, row_count = self.level(level_index)
+            rows = {}
+            for row_index in range(first_row, first_row + row_count):
+                row_id, first_spot, spot_count = self.row(row_index)
+                spots = {}
+                for spot_id, vehicle_id, spot_type, vehicle_type in self.iter_spots(first_spot, spot_count):
+                    vehicle = {}
+                    if vehicle_id != EMPTY_VEHICLE_ID:
+                        vehicle = {'vehicle_type': vehicle_type, 'vehicle_id': str(vehicle_id)}
+                    spots[str(spot_id)] = {'spot_type': spot_type, 'vehicle': vehicle}
+                rows[str(row_id)] = {'spots': spots}
+            levels[str(level_id)] = {'rows': rows}
+
+        return {'name': self.name, 'levels': levels}
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def padded(length):
+    return (length + 3) & ~3
+
+
+# write garage document dict as binary snapshot
+def write_snapshot(path, document):
+    logger.debug('Writing garage snapshot: ' + path)
+    level_table = []
+    row_table = []
+    spot_count = 0
+    for level_id, level in document.get('levels', {}).items():
+        level_table.append((int(level_id), len(row_table), len(level['rows'])))
+        for row_id, row in level['rows'].items():
+            row_table.append((int(row_id), spot_count, len(row['spots'])))
+            spot_count += len(row['spots'])
+
+    name = document.get('name', '').encode('utf-8')
+    with open(path, 'wb') as snapshot_file:
+        snapshot_file.write(HEADER.pack(MAGIC, VERSION, len(name), len(level_table), len(row_table), spot_count))
+        snapshot_file.write(name.ljust(padded(len(name)), b'\0'))
+        for record in level_table:
+            snapshot_file.write(TABLE.pack(*record))
+        for record in row_table:
+            snapshot_file.write(TABLE.pack(*record))
+        for level in document.get('levels', {}).values():
+            for row in level['rows'].values():
+                for spot_id, spot in row['spots'].items():
+                    vehicle = spot['vehicle']
+                    vehicle_id = EMPTY_VEHICLE_ID
+                    vehicle_type = EMPTY_VEHICLE_TYPE
+                    if vehicle:
+                        vehicle_id = int(vehicle['vehicle_id'])
+                        vehicle_type = vehicle['vehicle_type']
+                    snapshot_file.write(SPOT.pack(int(spot_id), vehicle_id, spot['spot_type'], vehicle_type))
+
+
+# read binary snapshot as garage document dict
+def read_snapshot(path):
+    snapshot = GarageSnapshot(path)
+    try:
+        return snapshot.to_document()
+    finally:
+        snapshot.close()
+
+
+# convert garage documents to and from binary snapshots.
+# e.g. python -m src.garage.api.snapshot to-binary data/main_garage_v1.json data/main_garage_v1.grg
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Convert garage documents to and from binary snapshots')
+    parser.add_argument('command', choices=['to-binary', 'to-json'])
+    parser.add_argument('source')
+    parser.add_argument('target', nargs='?')
+    parsed = parser.parse_args(args)
+
+    if parsed.command == 'to-binary':
+        target = parsed.target or os.path.splitext(parsed.source)[0] + '.grg'
+        with open(parsed.source, 'r') as json_file:
+            write_snapshot(target, json.load(json_file))
+    else:
+        target = parsed.target or os.path.splitext(parsed.source)[0] + '.json'
+        with open(target, 'w') as json_file:
+            json.dump(read_snapshot(parsed.source), json_file, indent=2)
+
+    print(target)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import logging
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# vehicle id and vehicle type of a spot without a vehicle
+EMPTY = -1
+
+
+# SpotTable keeps the spots of a garage as a struct of arrays indexed by spot number: spot id, spot type,
+# and id and type of the vehicle in the spot. Every row takes a contiguous range of spot numbers and every
+# level a contiguous range of rows, so a pass over a level or the garage walks flat arrays.
+# Spot and vehicle ids are kept as 32 bit ints, as the vehicle id pool, spot bit sets and shared region assume.
+class SpotTable(object):
+    def __init__(self):
+        self.spot_ids = array('i')
+        self.spot_types = array('b')
+        self.vehicle_ids = array('i')
+        self.vehicle_types = array('b')
+
+    def __len__(self):
+        return len(self.spot_ids)
+
+    # append the spots of a row document. Returns (start, end) spot numbers of the row.
+    def append_spots(self, spots):
+        start = len(self.spot_ids)
+        for spot_id, spot in spots.items():
+            vehicle = spot['vehicle']
+            self.spot_ids.append(int(spot_id))
+            self.spot_types.append(spot['spot_type'])
+            if vehicle:
+                self.vehicle_ids.append(int(vehicle['vehicle_id']))
+                self.vehicle_types.append(vehicle['vehicle_type'])
+            else:
+                self.vehicle_ids.append(EMPTY)
+                self.vehicle_types.append(EMPTY)
+        return start, len(self.spot_ids)
+
+    # returns spot number of spot id within start to end - 1, or None
+    def find(self, spot_id, start, end):
+        if start >= end:
+            return None
+        # spot ids mostly count up within a row, so the offset from the first spot id is tried first
+        number = start + spot_id - self.spot_ids[start]
+        if start <= number < end and self.spot_ids[number] == spot_id:
+            return number
+        try:
+            return self.spot_ids.index(spot_id, start, end)
+        except ValueError:
+            return None
+
+    # (spot id, spot type, vehicle id, vehicle type) of spot numbers start to end - 1
+    def spots(self, start, end):
+        return zip(self.spot_ids[start:end], self.spot_types[start:end],
+                   self.vehicle_ids[start:end], self.vehicle_types[start:end])
+
+    def is_free(self, number):
+        return self.vehicle_ids[number] == EMPTY
+
+    def set_vehicle(self, number, vehicle_id, vehicle_type):
+        self.vehicle_ids[number] = vehicle_id
+        self.vehicle_types[number] = vehicle_type
+
+    def clear_vehicle(self, number):
+        self.vehicle_ids[number] = EMPTY
+        self.vehicle_types[number] = EMPTY
@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+
+from src.garage.utils import etag_matches
+from src.garage.api.shared import SharedGarage
+from src.garage.api.storage import get_storage
+from src.garage.api.writer import get_writer, raise_persistence_error
+
+logger = logging.getLogger(__name__)
+
+
+# GarageState holds the long-lived Garage object shared by every handler of the process.
+# The garage is loaded once from storage and the live object graph is kept between requests.
+# With shared_path, or the SHARED_STATE_PATH environment variable, occupancy is kept in a region
+# shared by every worker process and each request first catches up with the other workers' changes.
+class GarageState(object):
+    def __init__(self, fn='main_garage_v1.json', storage=None, shared_path=None):
+        self.fn = fn
+        self.lock = threading.RLock()
+        self.storage = storage
+        self.shared_path = shared_path
+        self.shared = None
+        self.writer = None
+        self._garage = None
+        self._status = None
+        self._listeners = []
+
+    # returns the live Garage, loading it on first use or when another process changed the stored garage.
+    # The stored garage is only checked and reloaded holding the lock, so a handler that took the Garage
+    # under the lock changes the live one. Readers outside the lock keep the Garage they got.
+    @property
+    def garage(self):
+        with self.lock:
+            if self._garage is None:
+                self.load()
+            elif self.shared is not None:
+                self.shared.sync()
+            elif self.storage.changed():
+                self.reload()
+            return self._garage
+
+    # build the Garage object graph from storage and record its changes back to storage
+    def load(self, fn=None, storage=None):
+        with self.lock:
+            if fn:
+                self.fn = fn
+            if storage is not None:
+                self.storage = storage
+            if self.storage is None:
+                self.storage = get_storage(self.fn)
+            shared_path = self.shared_path or os.getenv('SHARED_STATE_PATH')
+            if shared_path and self.storage.single_process:
+                raise ValueError('{} is written by one process and cannot be used with shared garage state'
+                                 .format(type(self.storage).__name__))
+            logger.debug('Loading garage state: ' + self.fn)
+            self.detach()
+            # storage may hand out the Garage it cached, so this state may have had it before
+            self._garage = self.storage.load()
+            self._garage.add_listener(self.record)
+            if shared_path:
+                self.shared = SharedGarage(shared_path, self._garage)
+                self._garage.attach_shared(self.shared)
+            self.writer = get_writer(self.storage, self.lock)
+            self.writer.start(self._garage)
+            return self._garage
+
+    # rebuild the live Garage from storage after another process changed it
+    def reload(self):
+        with self.lock:
+            logger.debug('Stored garage changed. Reloading garage state: ' + self.fn)
+            self._garage.remove_listener(self.record)
+            self._garage = self.storage.load()
+            self._garage.add_listener(self.record)
+            self.writer.start(self._garage)
+            return self._garage
+
+    # stop recording the changes of the live Garage, which may outlive this state in a storage cache
+    def detach(self):
+        if self._garage is None:
+            return
+        self._garage.remove_listener(self.record)
+        if self.shared is not None:
+            self._garage.attach_shared(None)
+
+    # change listener. Changes of other workers were persisted by the worker that made them.
+    def record(self, change):
+        if not change.get('remote'):
+            self.storage.record(change)
+        for listener in self._listeners:
+            listener(change, self._garage)
+
+    # register a callable that receives (change, garage) after every change of the live Garage.
+    # Listeners stay registered when the live Garage is reloaded.
+    def add_listener(self, listener):
+        logger.debug('Adding garage state listener')
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        logger.debug('Removing garage state listener')
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    # returns status of the live Garage, computed with builder only when there is no status of its version
+    def get_status(self, builder):
+        return self.get_versioned_status(builder)[1]
+
+    # returns (ETag, status) of the live Garage. The status is cached per ETag and is None when
+    # if_none_match names the current ETag, so unchanged polls do not look at the status at all.
+    # Without cache the status is built on every call, as for status queries.
+    def get_versioned_status(self, builder, if_none_match=None, cache=True):
+        garage = self.garage
+        with self.lock:
+            etag = self.etag(garage)
+            if etag_matches(if_none_match, etag):
+                return etag, None
+            if not cache:
+                return etag, builder(garage)
+            if self._status is None or self._status[0] != etag:
+                logger.debug('Building garage status: ' + etag)
+                if self.shared is None:
+                    status = self.storage.get_status(garage, builder)
+                else:
+                    status = builder(garage)
+                self._status = (etag, status)
+            return self._status
+
+    # entity tag of the state of a Garage
+    @staticmethod
+    def etag(garage):
+        return '"{}-{}"'.format(garage.epoch, garage.version)
+
+    # persist the changes made to the live Garage per persistence mode.
+    # Call after releasing the lock, as batched mode waits for the writer thread.
+    # Changes made to a Garage that is no longer the live one are not persisted, so the request fails.
+    def save(self, garage=None):
+        if garage is not None and garage is not self._garage:
+            logger.error('Garage is not the live garage state. Changes were not saved.')
+            raise_persistence_error(RuntimeError('garage was reloaded before its changes were saved'))
+        logger.debug('Saving garage state: ' + self.fn)
+        self.writer.commit()
+
+    # drop the live Garage so the next access reloads it
+    def reset(self):
+        # the writer takes the lock for its final flush, so stop it first
+        if self.writer is not None:
+            self.writer.stop()
+        with self.lock:
+            logger.debug('Resetting garage state')
+            if self.storage is not None:
+                self.storage.close()
+            self.detach()
+            if self.shared is not None:
+                self.shared.close()
+            self.shared = None
+            self._status = None
+            self.writer = None
+            self.storage = None
+            self._garage = None
+
+
+garage_state = GarageState()
@@ -1,59 +1,360 @@
+import bisect
+import itertools
 import logging
 
 from src.garage import utils
-from src.garage.api.garage import (Garage,
-                                   build_garage_doc,
-                                   write_garage_doc)
+from src.garage.utils import (raise_invalid_param_error,
+                              APIError,
+                              status_codes)
+from src.garage.api.aggregate import aggregate, aggregate_filtered, filtered_ids, TYPE_COUNT
+from src.garage.api.garage import Garage, LazyLevels
+from src.garage.api.state import garage_state
 
 logger = logging.getLogger(__name__)
 
+# status fields, in response order. fields= selects among them.
+STATUS_FIELDS = ('name', 'max_capacity', 'occupancy', 'cars', 'motorcycles', 'buses', 'available',
+                 'available_spot_types', 'available_spots_total', 'available_spots', 'assigned_spots',
+                 'next_car_spot', 'next_moto_spot', 'next_bus_spot')
+# fields holding spot id lists. Only these are paged with limit and cursor.
+SPOT_LIST_FIELDS = ('available_spots', 'assigned_spots')
+# status fields counting the vehicles of each vehicle type value
+VEHICLE_COUNT_FIELDS = ('motorcycles', 'cars', 'buses')
+QUERY_PARAMS = ('level', 'row', 'spot_type', 'vehicle_type', 'fields', 'limit', 'cursor')
 
-# create instance of Garage object from json file
-def get_garage_data(fn='main_garage_v1.json'):
-    return build_garage_doc(fn=fn)
 
+# get long-lived Garage object from garage state, or a one-off Garage from the supplied document
+def get_garage_data(document=None):
+    if document:
+        logger.debug('Instantiating Garage class object from document')
+        return Garage(document)
 
-def update_garage_data(garage, fn='main_garage_v1.json'):
-    return write_garage_doc(fn, garage)
+    return garage_state.garage
 
 
 def http_get(request, response, params, document=None):
     """ Resource = garage/v1/status """
 
-    if not document:
-        logger.debug('Loading garage document')
-        document = get_garage_data()
+    query = parse_query(getattr(request, 'params', None) or {})
+    if document:
+        garage = get_garage_data(document)
+        response.body = build_status(garage) if query is None else StatusQuery(garage, query).build()
+        return
 
-    # create instance of Garage object from json file
-    logger.debug('Instantiating Garage class object')
-    garage = Garage(document)
+    logger.debug('Loading garage status')
+    if query is None:
+        etag, status = garage_state.get_versioned_status(build_status, utils.get_header(request, 'If-None-Match'))
+    else:
+        logger.debug('Querying garage status: ' + str(query))
+        etag, status = garage_state.get_versioned_status(lambda garage: StatusQuery(garage, query).build(),
+                                                         utils.get_header(request, 'If-None-Match'),
+                                                         cache=False)
+    response.set_header('ETag', etag)
+    if status is None:
+        logger.debug('Garage status not modified: ' + etag)
+        response.status = status_codes.HTTP_NOT_MODIFIED
+        return
 
+    response.body = status
+
+
+def build_status(garage):
     available = str(garage.available)
     available_spot_types = utils.list_of_strings(garage.available_spot_types)
-    available_spots_total = len(garage.available_spots)
+    available_spots_total = sum(garage.free_spots())
     available_spots = utils.list_of_strings(garage.available_spots)
     assigned_spots = utils.list_of_strings(garage.assigned_ids)
-    next_car_spot = str(garage.get_next_spot(garage.Vehicle.VehicleType.CAR).spots[0].id)
-    next_moto_spot = str(garage.get_next_spot(garage.Vehicle.VehicleType.MOTORCYCLE).spots[0].id)
 
+    return {'name': garage.name,
+            'max_capacity': garage.max_capacity,
+            'occupancy': garage.vehicle_count,
+            'cars': garage.car_count,
+            'motorcycles': garage.moto_count,
+            'buses': garage.bus_count,
+            'available': available,
+            'available_spot_types': available_spot_types,
+            'available_spots_total': available_spots_total,
+            'available_spots': available_spots,
+            'assigned_spots': assigned_spots,
+            'next_car_spot': next_spot_id(garage, garage.Vehicle.VehicleType.CAR),
+            'next_moto_spot': next_spot_id(garage, garage.Vehicle.VehicleType.MOTORCYCLE),
+            'next_bus_spot': next_bus_spot(garage)}
+
+
+def next_spot_id(garage, vehicle_type):
+    return str(garage.get_next_spot(vehicle_type).spots[0].id)
+
+
+def next_bus_spot(garage):
     next_bus_spot = []
     next_bus = garage.get_next_spot(garage.Vehicle.VehicleType.BUS).spots
     for bus_spot in next_bus:
         next_bus_spot.append(bus_spot.id)
+    return next_bus_spot
+
+
+# returns status query of the query string params, or None if there are no query params
+def parse_query(params):
+    if not any(param in params for param in QUERY_PARAMS):
+        return None
+
+    query = {'level': params.get('level'),
+             'row': params.get('row'),
+             'spot_type': parse_enum(params, 'spot_type', Garage.Spot.SpotType),
+             'vehicle_type': parse_enum(params, 'vehicle_type', Garage.Vehicle.VehicleType),
+             'fields': STATUS_FIELDS,
+             'limit': parse_int(params, 'limit', 1),
+             'cursor': parse_cursor(params)}
+    if query['row'] is not None and query['level'] is None:
+        raise_invalid_param_error('level', 'level is required with row')
+
+    if 'fields' in params:
+        fields = params['fields']
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        fields = [field.strip() for field in fields]
+        for field in fields:
+            if field not in STATUS_FIELDS:
+                raise_invalid_param_error('fields', field + ' is not a status field')
+        query['fields'] = tuple(field for field in STATUS_FIELDS if field in fields)
+    return query
+
+
+# returns value of an Enum param given by name or value, or None
+def parse_enum(params, param, enum):
+    if param not in params:
+        return None
+    value = str(params[param]).strip()
+    if value.upper() in enum.__members__:
+        return enum[value.upper()].value
+    try:
+        return enum(int(value)).value
+    except ValueError:
+        raise_invalid_param_error(param, param + ' must be one of ' + ', '.join(enum.__members__))
+
+
+# returns int param of at least minimum, or None
+def parse_int(params, param, minimum):
+    if param not in params:
+        return None
+    try:
+        value = int(params[param])
+    except (TypeError, ValueError):
+        value = None
+    if value is None or value < minimum:
+        raise_invalid_param_error(param, param + ' must be an int of at least ' + str(minimum))
+    return value
+
+
+# cursor of the next page, the last available spot id and the last assigned vehicle id given so far
+def format_cursor(cursor):
+    return '{}_{}'.format(*[cursor[field] for field in SPOT_LIST_FIELDS])
+
+
+def parse_cursor(params):
+    if 'cursor' not in params:
+        return None
+    try:
+        positions = list(map(int, str(params['cursor']).split('_')))
+    except ValueError:
+        positions = []
+    if len(positions) != len(SPOT_LIST_FIELDS) or min(positions) < -1:
+        raise_invalid_param_error('cursor', 'cursor must be the next_cursor of a previous page')
+    return dict(zip(SPOT_LIST_FIELDS, positions))
+
+
+# StatusQuery builds the status fields of a query for the spots of a level, a row, a spot type or a
+# vehicle type. Only the fields asked for are computed.
+# Counts of the whole garage come from the garage counters and its lists from the spot id bit set and
+# the vehicle id pool, so they are paged without walking the garage. A level or row walks only its own
+# range of the spot table, and a level that is not materialized gives its counts from its summary.
+# Counts by spot type or vehicle type of a level or the whole garage come from the free spot counters of
+# the spot index and the spot type counts the garage keeps per level. Their lists are taken from the
+# spot table only when asked for, from the cursor on.
+# As in the status, assigned_spots lists the ids of the vehicles parked. Both lists are ascending and
+# paged together: a page holds up to limit ids of each, and the cursor carries the last id of each.
+class StatusQuery(object):
+    def __init__(self, garage, query):
+        self.garage = garage
+        self.query = query
+        self.fields = query['fields']
+        # spot type values a selected spot may have
+        self.spot_types = None
+        if query['spot_type'] is not None or query['vehicle_type'] is not None:
+            self.spot_types = {spot_type.value for spot_type in Garage.Spot.SpotType}
+        if query['spot_type'] is not None:
+            self.spot_types &= {query['spot_type']}
+        if query['vehicle_type'] is not None:
+            vehicle_type = Garage.Vehicle.VehicleType(query['vehicle_type'])
+            self.spot_types &= {spot_type.value for spot_type, vehicle_types in garage.spot_type_map.items()
+                                if vehicle_type in vehicle_types}
+        self.level = self.select_level()
+        self._counts = None
+
+    # returns id of the selected level, checked against the garage, or None for the whole garage
+    def select_level(self):
+        level_id = self.query['level']
+        if level_id is None:
+            return None
+        if level_id not in self.garage.levels:
+            raise APIError(code='Invalid Level ID',
+                           cause='Invalid Level ID',
+                           message='Please enter correct Level ID',
+                           status=status_codes.HTTP_BAD_REQUEST)
+        row_id = self.query['row']
+        if row_id is not None and row_id not in self.garage.levels[level_id].rows:
+            raise APIError(code='Invalid Row ID',
+                           cause='Invalid Row ID',
+                           message='Please enter correct Row ID',
+                           status=status_codes.HTTP_BAD_REQUEST)
+        return level_id
+
+    # True if the query selects every spot of the garage
+    def is_whole_garage(self):
+        return self.level is None and self.spot_types is None
+
+    # True if the counts of the selected spot types are kept by the spot index and the garage
+    def is_indexed(self):
+        return self.query['row'] is None and self.spot_types is not None
+
+    # True if the counts of the selected level are in its summary
+    def is_summary(self):
+        return (self.query['row'] is None and self.spot_types is None and isinstance(self.garage.levels, LazyLevels)
+                and not self.garage.levels.is_loaded(self.level))
+
+    # (start, end) spot number ranges of the selected level or row, or of every level
+    def ranges(self):
+        if self.level is None:
+            return [(level.start, level.end) for level in self.garage.levels.values()]
+        level = self.garage.levels[self.level]
+        if self.query['row'] is None:
+            return [(level.start, level.end)]
+        row = level.rows[self.query['row']]
+        return [(row.start, row.end)]
+
+    # counts of the selected spots in the form of aggregate. Without a spot type or vehicle type, with
+    # spot id lists sorted.
+    def counts(self):
+        if self._counts is None:
+            if self.is_indexed():
+                self._counts = self.indexed_counts()
+            elif self.spot_types is not None:
+                self._counts = aggregate_filtered(self.garage.spot_table, self.ranges(), self.spot_types,
+                                                  self.query['vehicle_type'])
+            elif self.is_summary():
+                self._counts = self.summary_counts(self.garage.levels.summaries[self.level])
+            else:
+                (start, end), = self.ranges()
+                self._counts = aggregate(self.garage.spot_table, start, end, [(start, end)])
+                self._counts['available_spots'].sort()
+        return self._counts
+
+    # counts of the selected spot types of the selected level or of every level, without spot id lists
+    def indexed_counts(self):
+        free_spots = self.garage.free_spots(self.level)
+        level_ids = list(self.garage.levels) if self.level is None else [self.level]
+        counts = {'spot_count': 0,
+                  'free_spots': [0] * TYPE_COUNT,
+                  'vehicle_counts': [0] * TYPE_COUNT}
+        for spot_type in self.spot_types:
+            counts['free_spots'][spot_type] = free_spots[spot_type]
+        for level_id in level_ids:
+            spot_type_counts, parked_counts = self.garage.type_counts(level_id)
+            for spot_type in self.spot_types:
+                counts['spot_count'] += spot_type_counts[spot_type]
+                for vehicle_type, count in enumerate(parked_counts[spot_type]):
+                    if self.query['vehicle_type'] in (None, vehicle_type):
+                        counts['vehicle_counts'][vehicle_type] += count
+        return counts
+
+    @staticmethod
+    def summary_counts(summary):
+        vehicle_counts = [0, 0, 0]
+        for vehicle_type in summary['vehicles'].values():
+            vehicle_counts[vehicle_type] += 1
+        return {'spot_count': summary['max_capacity'],
+                'free_spots': list(summary['free_spots']),
+                'vehicle_counts': vehicle_counts,
+                'vehicle_ids': sorted(map(int, summary['vehicles'])),
+                'available_spots': sorted(map(int, summary['available_spots']))}
+
+    def count(self, field):
+        if self.is_whole_garage():
+            garage = self.garage
+            return {'max_capacity': garage.max_capacity,
+                    'occupancy': garage.vehicle_count,
+                    'cars': garage.car_count,
+                    'motorcycles': garage.moto_count,
+                    'buses': garage.bus_count,
+                    'available_spots_total': sum(garage.free_spots())}[field]
+        counts = self.counts()
+        if field == 'max_capacity':
+            return counts['spot_count']
+        if field == 'available_spots_total':
+            return sum(counts['free_spots'])
+        if field == 'occupancy':
+            return sum(counts['vehicle_counts'])
+        return counts['vehicle_counts'][VEHICLE_COUNT_FIELDS.index(field)]
+
+    # ids of a list field greater than after, ascending. Lists by spot type or vehicle type give at
+    # most limit ids.
+    def list_ids(self, field, after, limit=None):
+        if self.is_whole_garage():
+            if field == 'available_spots':
+                spot_ids = self.garage.available_spot_ids
+                return spot_ids.iter_from(spot_ids.rank(after + 1))
+            return self.garage.vehicle_ids.assigned(after + 1)
+        if self.spot_types is not None:
+            return iter(filtered_ids(self.garage.spot_table, self.ranges(), self.spot_types, field, after,
+                                     self.query['vehicle_type'], limit))
+        ids = self.counts()['available_spots' if field == 'available_spots' else 'vehicle_ids']
+        return iter(ids[bisect.bisect_right(ids, after):])
+
+    # returns ({list field: ids}, next cursor) of the page of the list fields asked for
+    def page(self):
+        cursor = self.query['cursor'] or dict.fromkeys(SPOT_LIST_FIELDS, -1)
+        limit = self.query['limit']
+        lists = {}
+        more = False
+        next_cursor = dict(cursor)
+        for field in SPOT_LIST_FIELDS:
+            if field not in self.fields:
+                continue
+            # one id past the page tells if there is a next page
+            ids = self.list_ids(field, cursor[field], None if limit is None else limit + 1)
+            lists[field] = [str(list_id) for list_id in itertools.islice(ids, limit)]
+            if lists[field]:
+                next_cursor[field] = int(lists[field][-1])
+            if limit is not None and next(ids, None) is not None:
+                more = True
+        if not more:
+            return lists, None
+        return lists, format_cursor(next_cursor)
 
-    response_dict = {'name': garage.name,
-                     'max_capacity': garage.max_capacity,
-                     'occupancy': garage.vehicle_count,
-                     'cars': garage.car_count,
-                     'motorcycles': garage.moto_count,
-                     'buses': garage.bus_count,
-                     'available': available,
-                     'available_spot_types': available_spot_types,
-                     'available_spots_total': available_spots_total,
-                     'available_spots': available_spots,
-                     'assigned_spots': assigned_spots,
-                     'next_car_spot': next_car_spot,
-                     'next_moto_spot': next_moto_spot,
-                     'next_bus_spot': next_bus_spot}
-
-    response.body = response_dict
+    def build(self):
+        garage = self.garage
+        status = {}
+        lists = {}
+        next_cursor = None
+        if any(field in self.fields for field in SPOT_LIST_FIELDS):
+            lists, next_cursor = self.page()
+        for field in self.fields:
+            if field == 'name':
+                status[field] = garage.name
+            elif field == 'available':
+                status[field] = str(garage.available)
+            elif field == 'available_spot_types':
+                status[field] = utils.list_of_strings(garage.available_spot_types)
+            elif field in SPOT_LIST_FIELDS:
+                status[field] = lists[field]
+            elif field == 'next_car_spot':
+                status[field] = next_spot_id(garage, garage.Vehicle.VehicleType.CAR)
+            elif field == 'next_moto_spot':
+                status[field] = next_spot_id(garage, garage.Vehicle.VehicleType.MOTORCYCLE)
+            elif field == 'next_bus_spot':
+                status[field] = next_bus_spot(garage)
+            else:
+                status[field] = self.count(field)
+        if self.query['limit'] is not None or self.query['cursor'] is not None:
+            status['next_cursor'] = next_cursor
+        return status
@@ -0,0 +1,518 @@
+import copy
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from src.garage.api.garage import (Garage,
+                                   LazyLevels,
+                                   iter_json_dict,
+                                   build_garage,
+                                   build_garage_doc,
+                                   write_garage_doc,
+                                   write_level_summaries,
+                                   get_file_path,
+                                   get_summary_path,
+                                   garage_cache)
+from src.garage.api.snapshot import GarageSnapshot, write_snapshot
+from src.garage.api.spots import SpotTable
+
+logger = logging.getLogger(__name__)
+
+
+# GarageStorage is the interface every storage backend of the live Garage implements.
+# load builds the Garage, record receives every change as it happens, and flush persists
+# the recorded changes when the persistence writer decides to.
+class GarageStorage(object):
+    # True if the storage can only be written by one process, so it cannot back shared garage state
+    single_process = False
+
+    def __new__(cls, *args, **kwargs):
+        if cls is GarageStorage:
+            raise TypeError('GarageStorage class may not be instantiated')
+        return object.__new__(cls)
+
+    def load(self):
+        raise NotImplementedError('load is not implemented')
+
+    def record(self, change):
+        raise NotImplementedError('record is not implemented')
+
+    def flush(self, garage, sync=False):
+        raise NotImplementedError('flush is not implemented')
+
+    # returns True if another process changed the stored garage since it was loaded
+    def changed(self):
+        return False
+
+    # returns status of the garage computed with builder
+    def get_status(self, garage, builder):
+        return builder(garage)
+
+    def close(self):
+        pass
+
+
+# DocumentStorage rewrites the whole garage document whenever there are changes to persist.
+# The Garage and its status come from the document cache, so processes sharing the document
+# only rebuild them when the file actually changed.
+class DocumentStorage(GarageStorage):
+    def __init__(self, fn='main_garage_v1.json'):
+        self.fn = fn
+        self.dirty = False
+
+    # build Garage object from the garage document
+    def load(self):
+        logger.debug('Loading garage document: ' + self.fn)
+        return garage_cache.get_garage(self.fn)
+
+    # change listener. Marks the document as needing a rewrite.
+    def record(self, change):
+        self.dirty = True
+        garage_cache.clear_status(self.fn)
+
+    # changes not yet written win over changes made by other processes, as the rewrite replaces them
+    def changed(self):
+        return not self.dirty and garage_cache.changed(self.fn)
+
+    def get_status(self, garage, builder):
+        return garage_cache.get_status(self.fn, builder)
+
+    # rewrite the garage document if anything changed
+    def flush(self, garage, sync=False):
+        if not self.dirty:
+            return
+        logger.debug('Rewriting garage document: ' + self.fn)
+        write_garage_doc(self.fn, garage, sync=sync)
+        write_level_summaries(self.fn, garage, sync=sync)
+        garage_cache.refresh(self.fn)
+        self.dirty = False
+
+
+# JournalStorage appends one compact record per change to a journal file next to the garage document.
+# The garage document serves as the snapshot and is rewritten every snapshot_events changes
+# or snapshot_seconds seconds, after which the journal is truncated.
+# Journal records are numbered and the snapshot keeps the number of the last record it includes,
+# so records the snapshot already includes are skipped on load.
+# Record numbers are kept by the process and a snapshot truncates the journal, so one process owns the
+# journal. load fails when another process holds it.
+class JournalStorage(GarageStorage):
+    single_process = True
+
+    def __init__(self, fn='main_garage_v1.json', snapshot_events=1000, snapshot_seconds=300):
+        self.fn = fn
+        self.journal_path = get_file_path(fn) + '.journal'
+        self.snapshot_events = snapshot_events
+        self.snapshot_seconds = snapshot_seconds
+        self.events_since_snapshot = 0
+        self.last_snapshot = time.time()
+        # number of the last journal record written
+        self.sequence = 0
+        self._journal = None
+        self._lock_fd = None
+
+    # build Garage object from the last snapshot and replay the journal tail
+    def load(self):
+        self.lock_journal()
+        logger.debug('Loading garage snapshot: ' + self.fn)
+        garage = build_garage(fn=self.fn)
+        self.sequence = garage.journal_sequence
+        self.events_since_snapshot = self.replay(garage)
+        self.last_snapshot = time.time()
+        self.open_journal()
+        return garage
+
+    # apply every change in the journal the snapshot does not include and return the number of changes applied
+    def replay(self, garage):
+        if not os.path.exists(self.journal_path):
+            logger.debug('No journal to replay')
+            return 0
+
+        logger.debug('Replaying journal: ' + self.journal_path)
+        events = 0
+        with open(self.journal_path, 'r') as journal_file:
+            for line in journal_file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    # an interrupted append can only leave the last line incomplete
+                    logger.warning('Ignoring incomplete journal record: {}'.format(line))
+                    continue
+                sequence = change.get('sequence')
+                if sequence is not None:
+                    if sequence <= self.sequence:
+                        # written before the snapshot, which was taken before the journal was truncated.
+                        # Replaying it could free a vehicle id that was reused since.
+                        continue
+                    self.sequence = sequence
+                garage.apply_change(change)
+                events += 1
+        return events
+
+    # lock the lock file next to the journal until close. Held per process, so storages of this
+    # process share it and another process is refused.
+    def lock_journal(self):
+        if self._lock_fd is not None:
+            return
+        lock_fd = os.open(self.journal_path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.lockf(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(lock_fd)
+            raise ValueError('Garage journal is used by another process: ' + self.journal_path +
+                             '. Run one worker with journal storage, or use another storage.')
+        self._lock_fd = lock_fd
+
+    def open_journal(self):
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a')
+
+    # change listener. Appends the change to the journal, numbered after the last record.
+    def record(self, change):
+        self.open_journal()
+        self.sequence += 1
+        self._journal.write(json.dumps(dict(change, sequence=self.sequence), separators=(',', ':')) + '\n')
+        self.events_since_snapshot += 1
+
+    # push journal records to disk and compact the journal when a snapshot is due
+    def flush(self, garage, sync=False):
+        if self._journal is not None:
+            self._journal.flush()
+            if sync:
+                os.fsync(self._journal.fileno())
+        if self.snapshot_due():
+            self.snapshot(garage)
+
+    def snapshot_due(self):
+        if not self.events_since_snapshot:
+            return False
+        if self.events_since_snapshot >= self.snapshot_events:
+            return True
+        return time.time() - self.last_snapshot >= self.snapshot_seconds
+
+    # write the garage document atomically, then truncate the journal it replaces
+    def snapshot(self, garage):
+        logger.debug('Writing garage snapshot after {} changes'.format(self.events_since_snapshot))
+        tmp_fn = self.fn + '.tmp'
+        write_garage_doc(tmp_fn, garage, sync=True, extra_items=[('journal_sequence', self.sequence)])
+        write_level_summaries(tmp_fn, garage, sync=True)
+        os.replace(get_file_path(tmp_fn), get_file_path(self.fn))
+        # the summaries name the fingerprint of the snapshot, so they stay current across the rename
+        os.replace(get_summary_path(tmp_fn), get_summary_path(self.fn))
+
+        # a crash between the replace and the truncate leaves records the snapshot includes in the journal.
+        # They are numbered up to the journal sequence of the snapshot, so load skips them.
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, 'w')
+        self.events_since_snapshot = 0
+        self.last_snapshot = time.time()
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+# SQLiteStorage keeps one row per spot. A flush updates only the spots changed since the last flush,
+# in a single transaction. The database is created from the garage document on first use.
+class SQLiteStorage(GarageStorage):
+    def __init__(self, fn='main_garage_v1.json', db_fn=None):
+        self.fn = fn
+        if not db_fn:
+            db_fn = os.path.splitext(fn)[0] + '.db'
+        self.db_path = get_file_path(db_fn)
+        self.pending = {}
+        self._connection = None
+
+    def connect(self):
+        if self._connection is None:
+            logger.debug('Connecting to garage database: ' + self.db_path)
+            # the persistence writer thread flushes through the same connection under the garage lock
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            with self._connection:
+                self._connection.execute('CREATE TABLE IF NOT EXISTS garage (name TEXT)')
+                self._connection.execute('CREATE TABLE IF NOT EXISTS spots ('
+                                         'position INTEGER PRIMARY KEY, '
+                                         'level TEXT, row TEXT, spot TEXT, spot_type INTEGER, '
+                                         'vehicle_id TEXT, vehicle_type INTEGER, '
+                                         'UNIQUE (level, row, spot))')
+        return self._connection
+
+    # build Garage object from the spot rows, importing the garage document if the database is empty
+    def load(self):
+        connection = self.connect()
+        if connection.execute('SELECT COUNT(*) FROM garage').fetchone()[0] == 0:
+            self.import_document(build_garage_doc(fn=self.fn))
+
+        logger.debug('Loading garage from database')
+        name = connection.execute('SELECT name FROM garage').fetchone()[0]
+        document = {'name': name, 'levels': {}}
+        levels = document['levels']
+        for level_id, row_id, spot_id, spot_type, vehicle_id, vehicle_type in connection.execute(
+                'SELECT level, row, spot, spot_type, vehicle_id, vehicle_type FROM spots ORDER BY position'):
+            vehicle = {}
+            if vehicle_id is not None:
+                vehicle = {'vehicle_type': vehicle_type, 'vehicle_id': vehicle_id}
+            rows = levels.setdefault(level_id, {'rows': {}})['rows']
+            spots = rows.setdefault(row_id, {'spots': {}})['spots']
+            spots[spot_id] = {'spot_type': spot_type, 'vehicle': vehicle}
+
+        return Garage(document)
+
+    def import_document(self, document):
+        logger.debug('Importing garage document into database')
+        records = []
+        for level_id, level in document.get('levels', {}).items():
+            for row_id, row in level['rows'].items():
+                for spot_id, spot in row['spots'].items():
+                    vehicle = spot['vehicle']
+                    records.append((len(records), level_id, row_id, spot_id, spot['spot_type'],
+                                    vehicle.get('vehicle_id'), vehicle.get('vehicle_type')))
+        with self._connection:
+            self._connection.execute('INSERT INTO garage (name) VALUES (?)', (document.get('name', ''),))
+            self._connection.executemany('INSERT INTO spots VALUES (?, ?, ?, ?, ?, ?, ?)', records)
+
+    # change listener. Keeps the latest state of every changed spot until the next flush.
+    def record(self, change):
+        vehicle_id = None
+        vehicle_type = None
+        if change['op'] == 'assign':
+            vehicle_id = change['vehicle_id']
+            vehicle_type = change['vehicle_type']
+        for spot_id in change['spots']:
+            self.pending[(change['level'], change['row'], spot_id)] = (vehicle_id, vehicle_type)
+
+    # update the changed spot rows in one transaction
+    def flush(self, garage, sync=False):
+        if not self.pending:
+            return
+        logger.debug('Updating {} spot rows'.format(len(self.pending)))
+        records = [(vehicle_id, vehicle_type, level_id, row_id, spot_id)
+                   for (level_id, row_id, spot_id), (vehicle_id, vehicle_type) in self.pending.items()]
+        with self._connection:
+            self._connection.executemany('UPDATE spots SET vehicle_id = ?, vehicle_type = ? '
+                                         'WHERE level = ? AND row = ? AND spot = ?', records)
+        self.pending = {}
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+# SnapshotStorage keeps the garage in a binary snapshot that is mapped into memory.
+# The Garage is loaded straight into the spot table from the mapped spot records, and a flush rewrites
+# only the fixed-width records of the changed spots, in place.
+# The snapshot is created from the garage document on first use.
+class SnapshotStorage(GarageStorage):
+    def __init__(self, fn='main_garage_v1.json', snapshot_fn=None):
+        self.fn = fn
+        if not snapshot_fn:
+            snapshot_fn = os.path.splitext(fn)[0] + '.grg'
+        self.snapshot_path = get_file_path(snapshot_fn)
+        self.pending = {}
+        self._snapshot = None
+        self._garage = None
+
+    # build Garage object from the snapshot, writing the snapshot from the garage document if missing
+    def load(self):
+        if not os.path.exists(self.snapshot_path):
+            write_snapshot(self.snapshot_path, build_garage_doc(fn=self.fn))
+
+        logger.debug('Loading garage snapshot: ' + self.snapshot_path)
+        self._snapshot = GarageSnapshot(self.snapshot_path, writable=True)
+        # spots are appended in snapshot order, so the spot number of a spot is its position in the snapshot
+        table = SpotTable()
+        levels = {level_id: Garage.Level.from_table(level_id, table, row_ids, row_offsets)
+                  for level_id, row_ids, row_offsets in self._snapshot.fill_table(table)}
+        self._garage = Garage({'name': self._snapshot.name, 'levels': levels}, spot_table=table)
+        return self._garage
+
+    # change listener. Keeps the latest state of every changed spot until the next flush.
+    def record(self, change):
+        vehicle_id = None
+        vehicle_type = None
+        if change['op'] == 'assign':
+            vehicle_id = change['vehicle_id']
+            vehicle_type = change['vehicle_type']
+        spots = self._garage.levels[change['level']].rows[change['row']].spots
+        for spot_id in change['spots']:
+            self.pending[spots.number(spot_id)] = (vehicle_id, vehicle_type)
+
+    # write the changed spot records in place
+    def flush(self, garage, sync=False):
+        if not self.pending:
+            return
+        logger.debug('Updating {} spot records'.format(len(self.pending)))
+        for position, (vehicle_id, vehicle_type) in self.pending.items():
+            self._snapshot.set_vehicle(position, vehicle_id, vehicle_type)
+        if sync:
+            self._snapshot.flush()
+        self.pending = {}
+
+    def close(self):
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+
+
+# ShardedStorage keeps one document per level plus a manifest with the name, the level files and
+# a summary of every level. Levels are only read when allocation or a query touches them and a flush
+# rewrites only the levels changed since the last flush. The shards are split from the garage
+# document on first use.
+class ShardedStorage(GarageStorage):
+    def __init__(self, fn='main_garage_v1.json', shard_dir=None):
+        self.fn = fn
+        if not shard_dir:
+            shard_dir = os.path.splitext(fn)[0]
+        self.shard_path = get_file_path(shard_dir)
+        self.manifest_path = os.path.join(self.shard_path, 'manifest.json')
+        self.manifest = None
+        self.dirty = set()
+
+    # build Garage object over the manifest, splitting the garage document if there are no shards yet
+    def load(self):
+        if not os.path.exists(self.manifest_path):
+            self.split_document(build_garage_doc(fn=self.fn))
+
+        logger.debug('Loading garage manifest: ' + self.manifest_path)
+        with open(self.manifest_path, 'r') as manifest_file:
+            self.manifest = json.load(manifest_file)
+        self.dirty = set()
+        summaries = {}
+        for level_id, entry in self.manifest['levels'].items():
+            if entry['fingerprint'] != self.fingerprint(entry['file']):
+                # a flush was interrupted between the shard and the manifest
+                logger.warning('Level shard newer than manifest. Summarizing level: ' + level_id)
+                entry['summary'] = Garage.Level(level_id, self.read_level(level_id)['rows']).summary()
+            summaries[level_id] = entry['summary']
+        return Garage({'name': self.manifest['name'], 'levels': LazyLevels(self.read_level, summaries)})
+
+    # returns the document of one level
+    def read_level(self, level_id):
+        level_path = os.path.join(self.shard_path, self.manifest['levels'][level_id]['file'])
+        logger.debug('Reading level shard: ' + level_path)
+        with open(level_path, 'r') as level_file:
+            return json.load(level_file)
+
+    # stat identity of a shard file, as [mtime_ns, size]
+    def fingerprint(self, level_fn):
+        stat = os.stat(os.path.join(self.shard_path, level_fn))
+        return [stat.st_mtime_ns, stat.st_size]
+
+    # write one shard per level of the garage document and the manifest
+    def split_document(self, document):
+        logger.debug('Splitting garage document into level shards: ' + self.shard_path)
+        if not os.path.isdir(self.shard_path):
+            os.makedirs(self.shard_path)
+        self.manifest = {'name': document.get('name', ''), 'levels': {}}
+        for level_id, level in document.get('levels', {}).items():
+            level = Garage.Level(level_id, level['rows'])
+            self.manifest['levels'][level_id] = {'file': 'level_{}.json'.format(level_id),
+                                                'fingerprint': None,
+                                                'summary': None}
+            self.write_level(level)
+        self.write_manifest()
+
+    # write the level shard atomically and refresh its summary in the manifest
+    def write_level(self, level, sync=False):
+        entry = self.manifest['levels'][level.id]
+        level_path = os.path.join(self.shard_path, entry['file'])
+        logger.debug('Writing level shard: ' + level_path)
+        with open(level_path + '.tmp', 'w') as level_file:
+            for chunk in iter_json_dict(level.json_items()):
+                level_file.write(chunk)
+            if sync:
+                level_file.flush()
+                os.fsync(level_file.fileno())
+        os.replace(level_path + '.tmp', level_path)
+        entry['fingerprint'] = self.fingerprint(entry['file'])
+        entry['summary'] = level.summary()
+
+    def write_manifest(self, sync=False):
+        with open(self.manifest_path + '.tmp', 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=2)
+            if sync:
+                manifest_file.flush()
+                os.fsync(manifest_file.fileno())
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    # change listener. Marks the level of the change as needing a rewrite.
+    def record(self, change):
+        self.dirty.add(change['level'])
+
+    # rewrite the changed levels, then the manifest that summarizes them
+    def flush(self, garage, sync=False):
+        if not self.dirty:
+            return
+        logger.debug('Rewriting {} level shards'.format(len(self.dirty)))
+        for level_id in sorted(self.dirty):
+            self.write_level(garage.levels[level_id], sync=sync)
+        self.write_manifest(sync=sync)
+        self.dirty = set()
+
+
+# MemoryStorage keeps the garage document in memory only. Used for benchmarks and tests.
+class MemoryStorage(GarageStorage):
+    def __init__(self, document=None, fn='main_garage_v1.json'):
+        self.fn = fn
+        self.document = document
+
+    def load(self):
+        if self.document is None:
+            self.document = build_garage_doc(fn=self.fn)
+        logger.debug('Loading garage from memory')
+        return Garage(copy.deepcopy(self.document))
+
+    # change listener. Applies the change to the in-memory document.
+    def record(self, change):
+        apply_change_to_doc(self.document, change)
+
+    def flush(self, garage, sync=False):
+        pass
+
+    # returns copy of the stored garage document
+    def get_document(self):
+        return copy.deepcopy(self.document)
+
+
+# apply a change record to a garage document dict
+def apply_change_to_doc(document, change):
+    spots = document['levels'][change['level']]['rows'][change['row']]['spots']
+    for spot_id in change['spots']:
+        if change['op'] == 'assign':
+            spots[spot_id]['vehicle'] = {'vehicle_type': change['vehicle_type'],
+                                         'vehicle_id': change['vehicle_id']}
+        else:
+            spots[spot_id]['vehicle'] = {}
+
+
+# create storage per GARAGE_STORAGE environment variable
+def get_storage(fn='main_garage_v1.json'):
+    storage_type = os.getenv('GARAGE_STORAGE', 'document')
+    logger.debug('Garage storage is: ' + storage_type)
+    if storage_type == 'journal':
+        return JournalStorage(fn,
+                              snapshot_events=int(os.getenv('JOURNAL_SNAPSHOT_EVENTS', '1000')),
+                              snapshot_seconds=float(os.getenv('JOURNAL_SNAPSHOT_SECONDS', '300')))
+    if storage_type == 'document':
+        return DocumentStorage(fn)
+    if storage_type == 'sqlite':
+        return SQLiteStorage(fn)
+    if storage_type == 'snapshot':
+        return SnapshotStorage(fn)
+    if storage_type == 'sharded':
+        return ShardedStorage(fn)
+    if storage_type == 'memory':
+        return MemoryStorage(fn=fn)
+
+    raise ValueError('Unknown garage storage: ' + storage_type)
@@ -0,0 +1,39 @@
+import logging
+
+from src.garage.api.parking import get_garage_data, parked_response
+from src.garage.api.state import garage_state
+from src.garage.utils import (validate_params,
+                              APIError,
+                              status_codes)
+
+logger = logging.getLogger(__name__)
+
+
+def http_get(request, response, params, document=None):
+    """ Resource = garage/v1/vehicles/{vehicle_id} """
+
+    # the garage is taken under the lock, so it is not reloaded while it is read
+    with garage_state.lock:
+        logger.debug('Loading garage')
+        garage = get_garage_data(document)
+        response.body = find_vehicle(garage, params)
+
+    response.status = status_codes.HTTP_OK
+
+
+# returns where a parked vehicle is, in the same form as the park response
+def find_vehicle(garage, params):
+    # validate route params
+    validate_params(params,
+                    required_params={'vehicle_id': str})
+
+    selected_vehicle = params['vehicle_id']
+    logger.debug('Locating vehicle: ' + selected_vehicle)
+    location = garage.locate_vehicle(selected_vehicle)
+    if location is None:
+        raise APIError(code='Invalid Vehicle ID',
+                       cause='Invalid Vehicle ID',
+                       message='Please enter correct Vehicle ID',
+                       status=status_codes.HTTP_NOT_FOUND)
+
+    return parked_response(garage, location, garage.check_spot(location))
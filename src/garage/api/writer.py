@@ -0,0 +1,143 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from src.garage.utils import APIError, status_codes
+
+logger = logging.getLogger(__name__)
+
+
+# PersistenceWriter decides when the changes of the live Garage are written to storage.
+#   sync:    flush and fsync before the request returns
+#   batched: the request waits for the next group commit. One flush covers every change
+#            made during the commit window.
+#   async:   the request returns right away. The background thread flushes every commit window.
+# A failed flush fails the requests of sync and batched modes. In async mode it can only be logged.
+class PersistenceWriter(object):
+    modes = ('sync', 'batched', 'async')
+
+    def __init__(self, storage, lock, mode='sync', window=0.005):
+        if mode not in self.modes:
+            raise ValueError('Unknown persistence mode: ' + mode)
+
+        self.storage = storage
+        self.lock = lock
+        self.mode = mode
+        self.window = window
+        self._garage = None
+        self._condition = threading.Condition()
+        self._requested = 0
+        self._flushed = 0
+        # group commit the next flush of the background thread covers
+        self._group = GroupCommit()
+        self._running = False
+        self._thread = None
+
+    # start background thread for batched and async modes
+    def start(self, garage):
+        self._garage = garage
+        if self.mode == 'sync' or self._running:
+            return
+
+        logger.debug('Starting persistence writer in {} mode'.format(self.mode))
+        self._running = True
+        self._thread = threading.Thread(target=self.run, name='garage-persistence-writer')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    # persist the changes made so far per persistence mode.
+    # Must not be called while holding the garage lock in batched mode, as the writer needs it to flush.
+    def commit(self):
+        if self.mode == 'sync' or not self._running:
+            error = self.flush()
+        else:
+            with self._condition:
+                self._requested += 1
+                group = self._group
+                self._condition.notify_all()
+
+                if self.mode != 'batched':
+                    return
+                # the group is finished by the background thread, or by stop for the final flush
+                while not group.done:
+                    self._condition.wait()
+            error = group.error
+
+        if error is not None:
+            raise_persistence_error(error)
+
+    # background loop. Waits for commits, lets the window fill up, then flushes once for all of them.
+    def run(self):
+        while True:
+            with self._condition:
+                while self._requested == self._flushed and self._running:
+                    self._condition.wait()
+                if not self._running and self._requested == self._flushed:
+                    return
+
+            time.sleep(self.window)
+            self.group_commit()
+
+    # flush once for every commit requested so far and pass the outcome to the requests waiting on it
+    def group_commit(self):
+        with self._condition:
+            target = self._requested
+            group = self._group
+            self._group = GroupCommit()
+
+        error = self.flush()
+
+        with self._condition:
+            self._flushed = target
+            group.done = True
+            group.error = error
+            self._condition.notify_all()
+
+    # flush the recorded changes to storage. Returns the exception raised, or None.
+    def flush(self):
+        with self.lock:
+            logger.debug('Group commit of garage changes')
+            try:
+                self.storage.flush(self._garage, sync=True)
+            except Exception as e:
+                logger.error('Error persisting garage changes: {}'.format(e))
+                return e
+        return None
+
+    # flush outstanding changes and stop the background thread
+    def stop(self):
+        if not self._running:
+            return
+
+        logger.debug('Stopping persistence writer')
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join()
+        self.group_commit()
+
+
+# GroupCommit is one flush of the background thread. done and error tell the requests it covers how it went.
+class GroupCommit(object):
+    def __init__(self):
+        self.done = False
+        self.error = None
+
+
+# fail the request whose changes could not be persisted
+def raise_persistence_error(error):
+    raise APIError(code='Persistence Error',
+                   cause=str(error),
+                   message='Garage changes could not be saved. Please try again',
+                   status=status_codes.HTTP_INTERNAL_SERVER_ERROR)
+
+
+# create writer per PERSISTENCE_MODE and PERSISTENCE_WINDOW_MS environment variables
+def get_writer(storage, lock):
+    mode = os.getenv('PERSISTENCE_MODE', 'sync')
+    window = float(os.getenv('PERSISTENCE_WINDOW_MS', '5')) / 1000
+    logger.debug('Persistence mode is: ' + mode)
+    return PersistenceWriter(storage, lock, mode=mode, window=window)
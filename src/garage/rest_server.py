@@ -4,6 +4,7 @@ import importlib
 import logging.config
 import os
 import re
+import socketserver
 from enum import Enum
 from pprint import pformat
 from wsgiref import simple_server
@@ -13,6 +14,8 @@ import falcon
 import yaml
 from packaging.version import Version
 
+from src.garage.api.state import garage_state
+
 logger = logging.getLogger(__name__)
 
 
@@ -52,6 +55,10 @@ class MicroRestServer(object):
         self._context_root = self.set_context_root()
         logger.info('Context root is [[ {} ]]'.format(self._context_root))
 
+        # Load long-lived garage state shared by all handlers
+        logger.debug('Loading garage state')
+        garage_state.load()
+
         # Process route maps from yaml
         logger.debug('Processing route maps')
         self._route_maps = route_maps
@@ -103,10 +110,11 @@ class MicroRestServer(object):
 
         return wsgi_app
 
-    # starts falcon.API instance as callable WSGI app
+    # starts falcon.API instance as callable WSGI app. Requests are handled on a thread each,
+    # so open event streams do not hold up other requests.
     @staticmethod
     def start(wsgi_app=None):
-        httpd = simple_server.make_server('', 8080, wsgi_app)
+        httpd = simple_server.make_server('', 8080, wsgi_app, server_class=ThreadingWSGIServer)
         logger.debug('Server started.')
         httpd.serve_forever()
 
@@ -226,6 +234,10 @@ class MicroRestServer(object):
         return config_file_to_process
 
 
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, simple_server.WSGIServer):
+    daemon_threads = True
+
+
 class ReplaceVarsWith(Enum):
     do_not_replace = 0
     empty_string = 1
@@ -44,6 +44,30 @@ def raise_invalid_param_error(param, cause):
                    status=status_codes.HTTP_BAD_REQUEST)
 
 
+# returns value of a request header, or None. Header names are matched case-insensitively.
+def get_header(request, name):
+    name = name.upper()
+    for key, value in request.headers.items():
+        if key.upper() == name:
+            return value
+    return None
+
+
+# returns True if an If-None-Match header value names the entity tag. Weak tags match too.
+def etag_matches(if_none_match, etag):
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
 def list_of_strings(objects):
         logger.debug('Converting list of Objects to list of strings')
         str_objects = list(map(str, objects))
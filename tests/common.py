@@ -15,5 +15,9 @@ class Response(object):
     def __init__(self, body='', status='200 OK'):
         self.body = body
         self.status = status
+        self.headers = {}
+
+    def set_header(self, name, value):
+        self.headers[name] = value
 
 
@@ -5,8 +5,27 @@ dir_path = os.path.dirname(os.path.realpath(__file__))
 project_root, tail = os.path.split(dir_path)
 sys.path.insert(0, os.path.abspath(os.path.join(project_root, '..')))
 
-from src.garage.api.garage import build_garage_doc, Garage
-from src.garage.api.parking import http_put, http_delete
-from src.garage.api.status import http_get
+from src.garage.api.aggregate import aggregate, numpy
+from src.garage.api.allocation import RunTree, STRATEGIES
+from src.garage.api.batch import http_put as batch_http_put, http_delete as batch_http_delete, park_vehicles, unpark_vehicles
+from src.garage.api.bitmap import BitSet
+from src.garage.api.changelog import ChangeLog
+from src.garage.api.changes import http_get as changes_http_get, get_changes
+from src.garage.api.events import http_get as events_http_get, EventHub, KEEPALIVE
+from src.garage.api.ids import VehicleIdPool
+from src.garage.api.garage import (build_garage, build_garage_doc, write_garage_doc, write_level_summaries, get_file_path,
+                                   get_summary_path, Garage, LazyLevels)
+from src.garage.api.parking import http_put, http_delete, park_vehicle, unpark_vehicle
+from src.garage.api.status import http_get, build_status, parse_query, StatusQuery
+from src.garage.api.vehicles import http_get as vehicles_http_get
+from src.garage.api.state import garage_state, GarageState
+from benchmarks.simulation import build_document, build_trace, simulate
+from src.garage.api.snapshot import GarageSnapshot, read_snapshot, write_snapshot
+from src.garage.api.storage import (DocumentStorage, JournalStorage, MemoryStorage, ShardedStorage, SnapshotStorage,
+                                    SQLiteStorage, apply_change_to_doc)
+from src.garage.api.writer import PersistenceWriter
 from src.garage.utils import APIError, status_codes
 from tests.common import Request, Response
+
+# the live garage state of the test run is kept in memory, so tests never rewrite the garage document
+garage_state.load(storage=MemoryStorage(build_garage_doc(fn='main_garage_v1.json')))
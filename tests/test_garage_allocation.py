@@ -0,0 +1,309 @@
+import os
+import random
+import sys
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(dir_path, '..')))
+
+from tests.context import (BitSet,
+                           build_document,
+                           build_garage_doc,
+                           build_trace,
+                           simulate,
+                           RunTree,
+                           STRATEGIES,
+                           park_vehicle,
+                           unpark_vehicle,
+                           Garage,
+                           VehicleIdPool,
+                           APIError)
+
+
+# first spot(s) for vehicle type found by walking levels, rows and spots in document order.
+# A bus needs 5 adjacent spots.
+def walk_spot(garage, vehicle_type):
+    spots_required = 5 if vehicle_type == Garage.Vehicle.VehicleType.BUS else 1
+    for level in garage.levels.values():
+        for row in level.rows.values():
+            spots_found = []
+            for spot in row.spots.values():
+                if vehicle_type in garage.spot_type_map[spot.spot_type] and not spot.vehicle:
+                    spots_found.append(spot.id)
+                elif spots_required > 1:
+                    spots_found = []
+                if len(spots_found) == spots_required:
+                    return level.id, row.id, spots_found
+    return None
+
+
+class TestGarageAllocation(unittest.TestCase):
+    def test_index_matches_first_fit(self):
+        for fn in ('main_garage_v1.json', 'full_garage_v1.json', 'full_garage_bus_v1.json'):
+            garage = Garage(build_garage_doc(fn=fn))
+            parked = []
+            random.seed(fn)
+
+            for _ in range(300):
+                # ---------- evaluate response ----------
+                # assert indexed next spot of every vehicle type matches the document walk
+                for vehicle_type in Garage.Vehicle.VehicleType:
+                    location = garage.get_spot(vehicle_type)
+                    found = None
+                    if location.spots:
+                        found = location.level.id, location.row.id, [spot.id for spot in location.spots]
+                    self.assertEqual(walk_spot(garage, vehicle_type), found)
+
+                # ---------- call method ----------
+                # random arrivals and departures
+                if parked and random.random() < 0.5:
+                    response = parked.pop(random.randrange(len(parked)))
+                    unpark_vehicle(garage, {'vehicle_id': response['vehicle_id'],
+                                            'spot_id': response['spot_id'],
+                                            'row': response['row'],
+                                            'level': response['level']})
+                else:
+                    try:
+                        parked.append(park_vehicle(garage, {'vehicle_type': random.choice([0, 1, 1, 2])}))
+                    except APIError:
+                        pass
+
+    def test_free_spot_counters(self):
+        garage = Garage(build_garage_doc(fn='main_garage_v1.json'))
+        parked = []
+        random.seed(12)
+
+        for _ in range(200):
+            # ---------- call method ----------
+            if parked and random.random() < 0.4:
+                response = parked.pop(random.randrange(len(parked)))
+                unpark_vehicle(garage, {'vehicle_id': response['vehicle_id'],
+                                        'spot_id': response['spot_id'],
+                                        'row': response['row'],
+                                        'level': response['level']})
+            else:
+                try:
+                    parked.append(park_vehicle(garage, {'vehicle_type': random.choice([0, 1, 1, 2])}))
+                except APIError:
+                    pass
+
+            # ---------- evaluate response ----------
+            # assert counters match a count of the free spots per row, level and garage
+            total = [0, 0, 0]
+            for level_id, level in garage.levels.items():
+                level_free = [0, 0, 0]
+                for row_id, row in level.rows.items():
+                    row_free = [0, 0, 0]
+                    for spot in row.spots.values():
+                        if not spot.vehicle:
+                            row_free[spot.spot_type.value] += 1
+                    self.assertEqual(row_free, garage.free_spots(level_id, row_id))
+                    level_free = [a + b for a, b in zip(level_free, row_free)]
+                self.assertEqual(level_free, garage.free_spots(level_id))
+                total = [a + b for a, b in zip(total, level_free)]
+            self.assertEqual(total, garage.free_spots())
+            self.assertEqual(len(garage.available_spots), sum(garage.free_spots()))
+
+            # assert availability per vehicle type follows the next spot
+            for vehicle_type in Garage.Vehicle.VehicleType:
+                self.assertEqual(bool(garage.get_next_spot(vehicle_type).spots), bool(garage.capacity(vehicle_type)))
+                self.assertEqual(bool(garage.capacity(vehicle_type)), vehicle_type.name in garage.available_spot_types)
+
+    def test_strategies(self):
+        for strategy_name in sorted(STRATEGIES):
+            garage = Garage(build_garage_doc(fn='main_garage_v1.json'), strategy_name=strategy_name)
+            parked = []
+            random.seed(strategy_name)
+
+            for _ in range(200):
+                # ---------- evaluate response ----------
+                for vehicle_type in Garage.Vehicle.VehicleType:
+                    location = garage.get_spot(vehicle_type)
+                    # assert a location is found exactly when the vehicle type fits
+                    self.assertEqual(bool(location.spots), bool(garage.capacity(vehicle_type)))
+                    if not location.spots or vehicle_type == Garage.Vehicle.VehicleType.BUS:
+                        continue
+                    spot = location.spots[0]
+                    self.assertIsNone(spot.vehicle)
+                    compatible = [spot_type.value for spot_type, vehicle_types in garage.spot_type_map.items()
+                                  if vehicle_type in vehicle_types]
+
+                    # assert best fit takes the smallest compatible spot type with free spots
+                    if strategy_name in ('best-fit', 'bus-preserving'):
+                        free_spots = garage.free_spots()
+                        self.assertEqual(min(spot_type for spot_type in compatible if free_spots[spot_type]),
+                                         spot.spot_type.value)
+
+                    # assert level balancing takes the level with the most room for the vehicle type
+                    if strategy_name == 'level-balancing':
+                        room = {level_id: sum(garage.free_spots(level_id)[spot_type] for spot_type in compatible)
+                                for level_id in garage.levels}
+                        self.assertEqual(max(room.values()), room[location.level.id])
+
+                # ---------- call method ----------
+                if parked and random.random() < 0.4:
+                    response = parked.pop(random.randrange(len(parked)))
+                    unpark_vehicle(garage, {'vehicle_id': response['vehicle_id'],
+                                            'spot_id': response['spot_id'],
+                                            'row': response['row'],
+                                            'level': response['level']})
+                else:
+                    try:
+                        parked.append(park_vehicle(garage, {'vehicle_type': random.choice([0, 1, 1, 2])}))
+                    except APIError:
+                        pass
+
+    def test_bus_preserving_strategy(self):
+        # one level, two rows of 2 MOTORCYCLE, 3 COMPACT and 5 LARGE spots
+        document = build_document(1, 2, 10)
+        vehicle_id = 0
+        for row_id, row in document['levels']['1']['rows'].items():
+            for spot_number, spot in enumerate(row['spots'].values()):
+                # every MOTORCYCLE and COMPACT spot is taken, and a car splits the LARGE spots of row 2
+                if spot['spot_type'] < 2 or (row_id == '2' and spot_number == 7):
+                    spot['vehicle'] = {'vehicle_type': 1, 'vehicle_id': str(vehicle_id)}
+                    vehicle_id += 1
+        garage = Garage(document)
+
+        # ---------- call method ----------
+        # vehicle type 1 is car
+        garage.set_strategy('bus-preserving')
+        response = park_vehicle(garage, {'vehicle_type': 1})
+
+        # ---------- evaluate response ----------
+        # assert the car took a LARGE spot of the split row and a bus still fits in row 1
+        self.assertEqual(response['row'], '2')
+        self.assertEqual(garage.get_spot(Garage.Vehicle.VehicleType.BUS).row.id, '1')
+
+        # ---------- call method ----------
+        garage = Garage(document, strategy_name='first-fit')
+        response = park_vehicle(garage, {'vehicle_type': 1})
+
+        # ---------- evaluate response ----------
+        # assert first fit breaks up the only run a bus fits in
+        self.assertEqual(response['row'], '1')
+        self.assertFalse(garage.capacity(Garage.Vehicle.VehicleType.BUS))
+
+    def test_simulation(self):
+        document = build_document(2, 4, 20)
+        trace = build_trace(2000, seed=3, mean_stay=400)
+
+        # ---------- call method ----------
+        results = {strategy_name: simulate(document, strategy_name, trace) for strategy_name in STRATEGIES}
+
+        # ---------- evaluate response ----------
+        # assert every strategy saw the same arrivals, and preserving bus runs turns away no more buses
+        for result in results.values():
+            self.assertEqual(sum(result['arrivals']), 2000)
+            self.assertTrue(0 <= result['fragmentation'] <= 1)
+        self.assertLessEqual(results['bus-preserving']['turned_away'][2], results['first-fit']['turned_away'][2])
+
+    def test_run_tree(self):
+        random.seed(11)
+        free = [random.random() < 0.7 for _ in range(37)]
+        tree = RunTree(free)
+
+        for _ in range(200):
+            # ---------- call method ----------
+            index = random.randrange(len(free))
+            free[index] = not free[index]
+            tree.set(index, free[index])
+
+            # ---------- evaluate response ----------
+            # assert longest run and first run of k match a scan of the row
+            runs = ''.join('1' if spot_free else '0' for spot_free in free)
+            self.assertEqual(max(len(run) for run in runs.split('0')), tree.longest())
+            for k in (1, 3, 5):
+                first = runs.find('1' * k)
+                self.assertEqual(None if first < 0 else first, tree.find(k))
+
+    def test_vehicle_id_pool(self):
+        random.seed(17)
+        assigned = {1, 2, 5, 40}
+        pool = VehicleIdPool(37, assigned)
+
+        for _ in range(500):
+            # ---------- call method ----------
+            if assigned and random.random() < 0.45:
+                vehicle_id = random.choice(sorted(assigned))
+                self.assertTrue(pool.release(vehicle_id))
+                assigned.remove(vehicle_id)
+            else:
+                free = sorted(set(range(37)) - assigned)
+                vehicle_id = pool.acquire()
+
+                # ---------- evaluate response ----------
+                # assert the lowest free id is handed out, and None once every id is taken
+                self.assertEqual(free[0] if free else None, vehicle_id)
+                if vehicle_id is not None:
+                    assigned.add(vehicle_id)
+
+            # assert ids outside the pool stay assigned until released, and are never handed out
+            self.assertEqual(sorted(assigned), list(pool.assigned()))
+            self.assertEqual(sorted(set(range(37)) - assigned), list(pool.available()))
+            self.assertEqual(len(assigned), len(pool))
+
+    def test_bit_set(self):
+        random.seed(18)
+        members = set(random.sample(range(9000), 300))
+        bit_set = BitSet(members)
+
+        for _ in range(300):
+            # ---------- call method ----------
+            member = random.randrange(12000)
+            if random.random() < 0.6:
+                bit_set.add(member)
+                members.add(member)
+            else:
+                bit_set.discard(member)
+                members.discard(member)
+
+            # ---------- evaluate response ----------
+            # assert ordered iteration, rank and select match the sorted members
+            ordered = sorted(members)
+            self.assertEqual(ordered, list(bit_set))
+            self.assertEqual(len(ordered), len(bit_set))
+            self.assertEqual(member in members, member in bit_set)
+            self.assertEqual(len([value for value in ordered if value < member]), bit_set.rank(member))
+            k = random.randrange(len(ordered))
+            self.assertEqual(ordered[k], bit_set.select(k))
+            self.assertEqual(ordered[k:], list(bit_set.iter_from(k)))
+
+    def test_spot_table(self):
+        garage = Garage(build_garage_doc())
+
+        # ---------- evaluate response ----------
+        # assert rows take contiguous ranges of spot numbers, in document order, within their level
+        numbers = []
+        for level in garage.levels.values():
+            self.assertEqual(level.rows[next(iter(level.rows))].start, level.start)
+            for row in level.rows.values():
+                numbers.extend(range(row.start, row.end))
+            self.assertEqual(numbers[-1] + 1, level.end)
+        self.assertEqual(list(range(len(garage.spot_table))), numbers)
+
+        # ---------- call method ----------
+        # vehicle type 1 is car
+        parked = park_vehicle(garage, {'vehicle_type': 1})
+        row = garage.levels[parked['level']].rows[parked['row']]
+        spot = row.spots[parked['spot_id']]
+
+        # ---------- evaluate response ----------
+        # assert Spot objects are views of the spot table without a __dict__
+        self.assertEqual(parked['vehicle_id'], spot.vehicle.id)
+        self.assertEqual(int(parked['vehicle_id']), garage.spot_table.vehicle_ids[spot.number])
+        self.assertEqual(spot, row.spots[parked['spot_id']])
+        self.assertNotIn('0' + parked['spot_id'], row.spots)
+        self.assertFalse(hasattr(spot, '__dict__'))
+        self.assertFalse(hasattr(spot.vehicle, '__dict__'))
+
+        # ---------- call method ----------
+        spot.vehicle = None
+
+        # ---------- evaluate response ----------
+        # assert writing through the view changes the garage document
+        self.assertEqual(build_garage_doc(), garage.garage_to_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
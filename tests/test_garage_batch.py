@@ -0,0 +1,156 @@
+import os
+import sys
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(dir_path, '..')))
+
+from tests.context import (build_garage_doc,
+                           batch_http_delete,
+                           batch_http_put,
+                           park_vehicle,
+                           park_vehicles,
+                           unpark_vehicle,
+                           unpark_vehicles,
+                           Garage,
+                           garage_state,
+                           APIError,
+                           status_codes,
+                           Request,
+                           Response)
+
+
+class TestGarageBatchParking(unittest.TestCase):
+    def setUp(self):
+        self.req = Request()
+        self.resp = Response()
+        self.params = ''
+
+    def test_batch_park(self):
+        original = garage_state.storage.get_document()
+        sequential = Garage(build_garage_doc())
+
+        # ---------- call method ----------
+        # vehicle types 0 motorcycle, 1 car, 2 bus
+        self.req.body = {'vehicle_types': [1, 0, 2, 1, 1]}
+        batch_http_put(self.req, self.resp, self.params)
+
+        # ---------- evaluate response ----------
+        # assert one result per vehicle, matching what parking them one by one returns
+        self.assertEqual(self.resp.status, status_codes.HTTP_CREATED)
+        expected = [park_vehicle(sequential, {'vehicle_type': vehicle_type})
+                    for vehicle_type in self.req.body['vehicle_types']]
+        self.assertEqual(expected, self.resp.body['results'])
+
+        # assert persisted document, lists and next spots match the sequential garage
+        garage = garage_state.garage
+        self.assertEqual(sequential.garage_to_dict(), garage_state.storage.get_document())
+        self.assertEqual(sequential.available_ids, garage.available_ids)
+        self.assertEqual(sequential.assigned_ids, garage.assigned_ids)
+        self.assertEqual(sequential.available_spots, garage.available_spots)
+        self.assertEqual(sequential.assigned_spots, garage.assigned_spots)
+        for vehicle_type in Garage.Vehicle.VehicleType:
+            self.assertEqual([spot.id for spot in sequential.get_next_spot(vehicle_type).spots],
+                             [spot.id for spot in garage.get_next_spot(vehicle_type).spots])
+
+        # ---------- call method ----------
+        for result in self.resp.body['results']:
+            with garage_state.lock:
+                unpark_vehicle(garage, {'vehicle_id': result['vehicle_id'],
+                                        'spot_id': result['spot_id'],
+                                        'row': result['row'],
+                                        'level': result['level']})
+        garage_state.save(garage)
+
+        # ---------- evaluate response ----------
+        self.assertEqual(original, garage_state.storage.get_document())
+
+    def test_batch_park_errors(self):
+        garage = Garage(build_garage_doc(fn='full_garage_bus_v1.json'))
+
+        # ---------- call method ----------
+        # a bus does not fit, 7 is no vehicle type, and a car fits
+        results = park_vehicles(garage, {'vehicle_types': [2, 7, 1]})
+
+        # ---------- evaluate response ----------
+        # assert per vehicle errors and the car parked with the first free vehicle id
+        self.assertEqual(results[0]['error']['code'], 'Full for Vehicle Type: BUS')
+        self.assertEqual(results[1]['error']['code'], 'Invalid Vehicle Type')
+        self.assertNotIn('error', results[2])
+        self.assertNotIn(results[2]['vehicle_id'], garage.available_ids)
+        self.assertIn(results[2]['vehicle_id'], garage.assigned_ids)
+
+    def test_batch_park_multi_status(self):
+        garage_doc = build_garage_doc(fn='full_garage_v1.json')
+
+        # ---------- call method ----------
+        self.req.body = {'vehicle_types': [1, 0]}
+        batch_http_put(self.req, self.resp, self.params, document=garage_doc)
+
+        # ---------- evaluate response ----------
+        self.assertEqual(self.resp.status, status_codes.HTTP_MULTI_STATUS)
+        # assert every vehicle id of the full garage is taken
+        self.assertEqual([result['error']['code'] for result in self.resp.body['results']],
+                         ['Garage Full', 'Garage Full'])
+
+    def test_batch_park_invalid_body(self):
+        # ---------- call method ----------
+        self.req.body = {'vehicle_types': 1}
+        with self.assertRaises(APIError) as context:
+            batch_http_put(self.req, self.resp, self.params)
+
+        # ---------- evaluate response ----------
+        self.assertEqual(context.exception.code, 'Invalid Input: vehicle_types')
+
+
+class TestGarageBatchExit(unittest.TestCase):
+    def setUp(self):
+        self.req = Request()
+        self.resp = Response()
+        self.params = ''
+
+    def test_batch_exit(self):
+        original = garage_state.storage.get_document()
+        garage = garage_state.garage
+        with garage_state.lock:
+            parked = park_vehicles(garage, {'vehicle_types': [1, 2, 0, 1]})
+        garage_state.save(garage)
+
+        # ---------- call method ----------
+        self.req.body = {'vehicle_ids': [result['vehicle_id'] for result in parked]}
+        batch_http_delete(self.req, self.resp, self.params)
+
+        # ---------- evaluate response ----------
+        # assert every vehicle left the spots it was parked in
+        self.assertEqual(self.resp.status, status_codes.HTTP_OK)
+        self.assertEqual([{'vehicle_id': result['vehicle_id'],
+                           'level': result['level'],
+                           'row': result['row'],
+                           'spot_id': result['spot_id']} for result in parked],
+                         self.resp.body['results'])
+
+        # assert persisted document, id pool and counters are back to the original garage
+        reference = Garage(original)
+        self.assertEqual(original, garage_state.storage.get_document())
+        self.assertEqual(reference.available_ids, garage.available_ids)
+        self.assertEqual(reference.assigned_spots, garage.assigned_spots)
+        self.assertEqual(reference.vehicle_count, garage.vehicle_count)
+        self.assertEqual(reference.free_spots(), garage.free_spots())
+
+    def test_batch_exit_errors(self):
+        garage = Garage(build_garage_doc())
+        vehicle_id = garage.assigned_ids[0]
+
+        # ---------- call method ----------
+        # the vehicle is listed twice, and 999 and 5 are no parked vehicles
+        results = unpark_vehicles(garage, {'vehicle_ids': [vehicle_id, '999', vehicle_id, 5]})
+
+        # ---------- evaluate response ----------
+        self.assertNotIn('error', results[0])
+        self.assertEqual([result['error']['code'] for result in results[1:]], ['Invalid Vehicle ID'] * 3)
+        self.assertIn(vehicle_id, garage.available_ids)
+        self.assertNotIn(vehicle_id, garage.assigned_ids)
+
+
+if __name__ == '__main__':
+    unittest.main()
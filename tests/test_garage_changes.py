@@ -0,0 +1,120 @@
+import os
+import sys
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(dir_path, '..')))
+
+from tests.context import (apply_change_to_doc,
+                           build_garage_doc,
+                           changes_http_get,
+                           get_changes,
+                           park_vehicle,
+                           unpark_vehicle,
+                           ChangeLog,
+                           Garage,
+                           status_codes,
+                           Request,
+                           Response)
+
+
+class TestGarageChanges(unittest.TestCase):
+    def setUp(self):
+        self.garage = Garage(build_garage_doc())
+
+    # park two cars and take the first back out
+    def change_garage(self):
+        parked = [park_vehicle(self.garage, {'vehicle_type': 1}) for _ in range(2)]
+        unpark_vehicle(self.garage, {'vehicle_id': parked[0]['vehicle_id']})
+
+    def test_changes_since(self):
+        mirror = get_changes(self.garage, {})
+
+        # ---------- call method ----------
+        self.change_garage()
+        body = get_changes(self.garage, {'since': str(mirror['sequence']), 'epoch': mirror['epoch']})
+
+        # ---------- evaluate response ----------
+        # assert changes come in sequence order and bring the mirror up to date
+        self.assertEqual([change['op'] for change in body['changes']], ['assign', 'assign', 'unassign'])
+        self.assertEqual([change['sequence'] for change in body['changes']],
+                         list(range(mirror['sequence'] + 1, mirror['sequence'] + 4)))
+        self.assertEqual(body['sequence'], self.garage.version)
+        self.assertFalse(body['more'])
+        for change in body['changes']:
+            apply_change_to_doc(mirror['snapshot'], change)
+        self.assertEqual(mirror['snapshot'], self.garage.garage_to_dict())
+
+        # assert an up to date mirror gets no changes
+        body = get_changes(self.garage, {'since': str(body['sequence']), 'epoch': body['epoch']})
+        self.assertEqual(body['changes'], [])
+
+    def test_changes_pages(self):
+        sequence = self.garage.version
+        self.change_garage()
+
+        # ---------- call method ----------
+        pages = []
+        more = True
+        while more:
+            body = get_changes(self.garage, {'since': str(sequence), 'epoch': self.garage.epoch, 'limit': '2'})
+            pages.append(len(body['changes']))
+            sequence = body['sequence']
+            more = body['more']
+
+        # ---------- evaluate response ----------
+        # assert pages of up to limit changes
+        self.assertEqual(pages, [2, 1])
+        self.assertEqual(sequence, self.garage.version)
+
+    def test_changes_resync(self):
+        self.garage.changes = ChangeLog(2)
+        sequence = self.garage.version
+
+        # ---------- call method ----------
+        self.change_garage()
+        aged_out = get_changes(self.garage, {'since': str(sequence), 'epoch': self.garage.epoch})
+        other_epoch = get_changes(self.garage, {'since': str(self.garage.version), 'epoch': 'other'})
+        kept = get_changes(self.garage, {'since': str(sequence + 1), 'epoch': self.garage.epoch})
+
+        # ---------- evaluate response ----------
+        # assert mirrors behind the change log or of another epoch resync from a snapshot
+        for body in (aged_out, other_epoch):
+            self.assertTrue(body['resync'])
+            self.assertEqual(body['sequence'], self.garage.version)
+            self.assertEqual(body['snapshot'], self.garage.garage_to_dict())
+
+        # assert changes still kept are returned
+        self.assertEqual(len(kept['changes']), 2)
+
+    def test_change_log_since(self):
+        # sequence numbers with gaps, as versions that record no change leave
+        change_log = ChangeLog(5)
+        sequences = [1, 2, 4, 7, 8, 9, 12]
+        for sequence in sequences:
+            change_log.append(sequence, {'op': 'assign'})
+
+        for since in range(change_log.floor, 13):
+            for limit in (None, 1, 2, 10):
+                # ---------- call method ----------
+                changes = change_log.since(since, limit)
+
+                # ---------- evaluate response ----------
+                # assert the oldest changes after since, up to limit
+                expected = [sequence for sequence in sequences[-5:] if sequence > since][:limit]
+                self.assertEqual([change['sequence'] for change in changes], expected)
+
+        # assert changes that left the log are not returned
+        self.assertIsNone(change_log.since(change_log.floor - 1))
+
+    def test_http_get(self):
+        response = Response()
+
+        # ---------- call method ----------
+        changes_http_get(Request(params={'since': '0', 'epoch': 'unknown'}), response, '')
+
+        # ---------- evaluate response ----------
+        # assert unknown epoch answers a snapshot
+        self.assertEqual(response.status, status_codes.HTTP_OK)
+        self.assertTrue(response.body['resync'])
+        self.assertIn('snapshot', response.body)
@@ -0,0 +1,106 @@
+import json
+import os
+import sys
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(dir_path, '..')))
+
+from tests.context import (build_garage_doc,
+                           events_http_get,
+                           park_vehicle,
+                           EventHub,
+                           GarageState,
+                           MemoryStorage,
+                           KEEPALIVE,
+                           Request,
+                           Response)
+
+
+# returns (event name, data) of an encoded server-sent event
+def parse_event(event):
+    fields = dict(line.split(': ', 1) for line in event.decode('utf-8').strip().split('\n'))
+    return fields['event'], json.loads(fields['data'])
+
+
+class TestGarageEvents(unittest.TestCase):
+    def setUp(self):
+        self.state = GarageState(storage=MemoryStorage(build_garage_doc()))
+        self.state.load()
+        self.hub = EventHub(buffer_size=4, keepalive=0.01)
+        self.state.add_listener(self.hub.publish_change)
+
+    def tearDown(self):
+        self.state.reset()
+
+    def test_event_stream(self):
+        stream = self.hub.stream(self.state)
+
+        # ---------- call method ----------
+        snapshot = parse_event(next(stream))
+        response = park_vehicle(self.state.garage, {'vehicle_type': 1})
+
+        # ---------- evaluate response ----------
+        # assert the watcher gets a snapshot, then the change, then keepalives while idle
+        self.assertEqual(snapshot[0], 'snapshot')
+        self.assertEqual(snapshot[1]['occupancy'] + 1, self.state.garage.vehicle_count)
+        event = parse_event(next(stream))
+        self.assertEqual(event[0], 'park')
+        self.assertEqual(event[1]['vehicle_id'], response['vehicle_id'])
+        self.assertEqual(event[1]['spots'], [response['spot_id']])
+        self.assertEqual(next(stream), KEEPALIVE)
+
+        # assert closed streams stop counting as watchers
+        stream.close()
+        self.assertEqual(self.hub.watchers, 0)
+
+    def test_slow_watcher_snapshot(self):
+        streams = [self.hub.stream(self.state) for _ in range(2)]
+        for stream in streams:
+            next(stream)
+
+        # ---------- call method ----------
+        # more changes than the event log holds while the watchers do not read
+        for _ in range(5):
+            park_vehicle(self.state.garage, {'vehicle_type': 0})
+        events = [next(stream) for stream in streams]
+
+        # ---------- evaluate response ----------
+        # assert both watchers drop to one shared snapshot of the current counts
+        self.assertIs(events[0], events[1])
+        name, data = parse_event(events[0])
+        self.assertEqual(name, 'snapshot')
+        self.assertEqual(data['occupancy'], self.state.garage.vehicle_count)
+        for stream in streams:
+            stream.close()
+
+    def test_resume(self):
+        stream = self.hub.stream(self.state)
+        next(stream)
+        park_vehicle(self.state.garage, {'vehicle_type': 1})
+        last_event_id = next(stream).decode('utf-8').split('\n')[0][len('id: '):]
+        stream.close()
+
+        # ---------- call method ----------
+        # reconnect with the id of the last event read, once the next change happened
+        stream = self.hub.stream(self.state, last_event_id)
+        response = park_vehicle(self.state.garage, {'vehicle_type': 1})
+
+        # ---------- evaluate response ----------
+        # assert the watcher resumes with the change it missed instead of a snapshot
+        event = parse_event(next(stream))
+        self.assertEqual(event[0], 'park')
+        self.assertEqual(event[1]['vehicle_id'], response['vehicle_id'])
+        stream.close()
+
+    def test_http_get(self):
+        response = Response()
+
+        # ---------- call method ----------
+        events_http_get(Request(), response, '')
+
+        # ---------- evaluate response ----------
+        # assert an event stream opening with a snapshot
+        self.assertEqual(response.content_type, 'text/event-stream')
+        self.assertEqual(parse_event(next(response.stream))[0], 'snapshot')
+        response.stream.close()
@@ -7,6 +7,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(dir_path, '..')))
 
 from tests.context import (build_garage_doc,
                            Garage,
+                           garage_state,
                            http_put,
                            http_delete,
                            APIError,
@@ -15,7 +16,10 @@ from tests.context import (build_garage_doc,
                            Response)
 
 
+# main garage document is read from the in-memory storage of the live garage state
 def get_garage_data(fn='main_garage_v1.json'):
+    if fn == 'main_garage_v1.json':
+        return garage_state.storage.get_document()
     return build_garage_doc(fn=fn)
 
 
@@ -280,6 +284,31 @@ class TestGarageParking(unittest.TestCase):
                 updated['levels'][self.req.body['level']]['rows'][self.req.body['row']]['spots'][spot]
             self.assertEqual({}, updated_location['vehicle'])
 
+    def test_garage_state_reused(self):
+        # get original
+        original = get_garage_data()
+        live_garage = garage_state.garage
+
+        # ---------- call method ----------
+        # vehicle type 1 is car
+        self.req.body = {'vehicle_type': 1}
+        http_put(self.req, self.resp, self.params)
+
+        self.req.body = {'vehicle_id': self.resp.body['vehicle_id'],
+                         'spot_id': self.resp.body['spot_id'],
+                         'row': self.resp.body['row'],
+                         'level': self.resp.body['level']}
+        http_delete(self.req, self.resp, self.params)
+
+        # get updated document
+        updated = get_garage_data()
+
+        # ---------- evaluate response ----------
+        # assert the same Garage object served both requests and is still usable
+        self.assertIs(live_garage, garage_state.garage)
+        self.assertEqual(original, updated)
+        self.assertEqual(original, live_garage.garage_to_dict())
+
 
 class TestGarageParkingFailures(unittest.TestCase):
     def setUp(self):
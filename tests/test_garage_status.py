@@ -6,13 +6,26 @@ dir_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.insert(0, os.path.abspath(os.path.join(dir_path, '..')))
 
 from tests.context import (build_garage_doc,
+                           build_status,
                            http_get,
+                           garage_state,
+                           park_vehicle,
+                           unpark_vehicle,
+                           numpy,
+                           parse_query,
+                           StatusQuery,
+                           LazyLevels,
+                           APIError,
                            status_codes,
+                           Garage,
                            Request,
                            Response)
 
 
+# main garage document is read from the in-memory storage of the live garage state
 def get_garage_data(fn='main_garage_v1.json'):
+    if fn == 'main_garage_v1.json':
+        return garage_state.storage.get_document()
     return build_garage_doc(fn=fn)
 
 
@@ -55,6 +68,210 @@ class TestGarageStatus(unittest.TestCase):
         # assert document did not change
         self.assertEqual(original, not_updated)
 
+    def test_get_status_not_modified(self):
+        http_get(self.req, self.resp, self.params)
+        etag = self.resp.headers['ETag']
+
+        # ---------- call method ----------
+        not_modified = Response(body=None)
+        http_get(Request(headers={'If-None-Match': etag}), not_modified, self.params)
+
+        # ---------- evaluate response ----------
+        # assert unchanged garage answers 304 without a body
+        self.assertEqual(not_modified.status, status_codes.HTTP_NOT_MODIFIED)
+        self.assertEqual(not_modified.headers['ETag'], etag)
+        self.assertIsNone(not_modified.body)
+
+        # ---------- call method ----------
+        # park and unpark a car, leaving the same occupancy in a newer version
+        parked = park_vehicle(garage_state.garage, {'vehicle_type': 1})
+        unpark_vehicle(garage_state.garage, {'vehicle_id': parked['vehicle_id'], 'spot_id': parked['spot_id'],
+                                             'row': parked['row'], 'level': parked['level']})
+        modified = Response()
+        http_get(Request(headers={'If-None-Match': etag}), modified, self.params)
+
+        # ---------- evaluate response ----------
+        # assert changed garage answers the status with a new ETag
+        self.assertEqual(modified.status, status_codes.HTTP_OK)
+        self.assertNotEqual(modified.headers['ETag'], etag)
+        self.assertEqual(self.resp.body, modified.body)
+
+
+class TestGarageStatusQuery(unittest.TestCase):
+    def setUp(self):
+        self.params = ''
+        self.garage = Garage(build_garage_doc())
+        for vehicle_type in (0, 1, 1, 2):
+            park_vehicle(self.garage, {'vehicle_type': vehicle_type})
+        self.document = self.garage.garage_to_dict()
+
+    def query(self, **params):
+        resp = Response()
+        http_get(Request(params=params), resp, self.params, document=self.document)
+        return resp.body
+
+    def test_query_fields(self):
+        # ---------- call method ----------
+        body = self.query(fields='occupancy,cars,available_spots_total')
+
+        # ---------- evaluate response ----------
+        # assert only the selected fields are returned
+        self.assertEqual(body, {'occupancy': self.garage.vehicle_count,
+                                'cars': self.garage.car_count,
+                                'available_spots_total': sum(self.garage.free_spots())})
+
+    def test_query_pages(self):
+        status = build_status(self.garage)
+        available_spots = []
+        assigned_spots = []
+
+        # ---------- call method ----------
+        body = self.query(limit='3')
+        while True:
+            available_spots.extend(body['available_spots'])
+            assigned_spots.extend(body['assigned_spots'])
+            self.assertLessEqual(len(body['available_spots']), 3)
+            if body['next_cursor'] is None:
+                break
+            body = self.query(limit='3', cursor=body['next_cursor'])
+
+        # ---------- evaluate response ----------
+        # assert pages add up to the full spot lists
+        self.assertEqual(status['available_spots'], available_spots)
+        self.assertEqual(status['assigned_spots'], assigned_spots)
+
+    def test_query_filters(self):
+        # ---------- call method ----------
+        levels = [self.query(level=level_id, fields='max_capacity,occupancy,available_spots')
+                  for level_id in self.garage.levels]
+        large = self.query(spot_type='LARGE', fields='max_capacity,available_spots')
+        buses = self.query(vehicle_type='2', fields='occupancy,buses,cars')
+
+        # ---------- evaluate response ----------
+        # assert levels add up to the garage
+        self.assertEqual(sum(level['max_capacity'] for level in levels), self.garage.max_capacity)
+        self.assertEqual(sum(level['occupancy'] for level in levels), self.garage.vehicle_count)
+        self.assertEqual(sorted(sum((level['available_spots'] for level in levels), []), key=int),
+                         self.garage.available_spots)
+
+        # assert spot type and vehicle type filters select their spots and vehicles
+        self.assertEqual(len(large['available_spots']), self.garage.free_spots()[2])
+        self.assertEqual(buses, {'occupancy': self.garage.bus_count, 'cars': 0, 'buses': self.garage.bus_count})
+
+    def test_query_indexed_filters(self):
+        # garage over the same document whose levels are only built on first use
+        summaries = {level_id: self.garage.level_summary(level_id) for level_id in self.garage.levels}
+        lazy_garage = Garage({'name': self.garage.name, 'levels': LazyLevels(self.document['levels'].get, summaries)})
+        park_vehicle(lazy_garage, {'vehicle_type': 1})
+        loaded = [lazy_garage.levels.is_loaded(level_id) for level_id in lazy_garage.levels]
+        filters = ({'spot_type': 'LARGE'}, {'vehicle_type': 'CAR'}, {'spot_type': 'COMPACT', 'vehicle_type': '0'},
+                   {'spot_type': 'LARGE', 'level': '1'})
+
+        # ---------- call method ----------
+        counts = [StatusQuery(lazy_garage, parse_query(dict(params, fields='max_capacity,occupancy,motorcycles,'
+                                                                          'cars,buses,available_spots_total'))).build()
+                  for params in filters]
+
+        # ---------- evaluate response ----------
+        # assert counts by spot type and vehicle type are read without building a level
+        self.assertEqual([lazy_garage.levels.is_loaded(level_id) for level_id in lazy_garage.levels], loaded)
+
+        for params, body in zip(filters, counts):
+            query = parse_query(dict(params, limit='2'))
+            available_spots = []
+            assigned_spots = []
+
+            # ---------- call method ----------
+            page = StatusQuery(lazy_garage, query).build()
+            while True:
+                available_spots.extend(page['available_spots'])
+                assigned_spots.extend(page['assigned_spots'])
+                if page['next_cursor'] is None:
+                    break
+                query['cursor'] = parse_query({'cursor': page['next_cursor']})['cursor']
+                page = StatusQuery(lazy_garage, query).build()
+
+            # counts and lists found by walking the Spot objects of the selected levels
+            expected = {'max_capacity': 0, 'occupancy': 0, 'motorcycles': 0, 'cars': 0, 'buses': 0,
+                        'available_spots_total': 0}
+            expected_available = []
+            vehicles = set()
+            spot_types = {spot_type.value for spot_type, vehicle_types in lazy_garage.spot_type_map.items()
+                          if query['spot_type'] in (None, spot_type.value) and
+                          query['vehicle_type'] in [None] + [vehicle_type.value for vehicle_type in vehicle_types]}
+            level_ids = [params['level']] if 'level' in params else list(lazy_garage.levels)
+            for level_id in level_ids:
+                for row in lazy_garage.levels[level_id].rows.values():
+                    for spot in row.spots.values():
+                        if spot.spot_type.value not in spot_types:
+                            continue
+                        expected['max_capacity'] += 1
+                        if not spot.vehicle:
+                            expected['available_spots_total'] += 1
+                            expected_available.append(int(spot.id))
+                        elif query['vehicle_type'] in (None, spot.vehicle.vehicle_type.value) and \
+                                spot.vehicle.id not in vehicles:
+                            vehicles.add(spot.vehicle.id)
+                            expected['occupancy'] += 1
+                            expected[('motorcycles', 'cars', 'buses')[spot.vehicle.vehicle_type.value]] += 1
+
+            # ---------- evaluate response ----------
+            # assert counts and pages match the walk
+            self.assertEqual(body, expected)
+            self.assertEqual(list(map(int, available_spots)), sorted(expected_available))
+            self.assertEqual(list(map(int, assigned_spots)), sorted(map(int, vehicles)))
+
+    def test_query_invalid(self):
+        for params in ({'fields': 'spots'}, {'limit': '0'}, {'cursor': '3'}, {'row': '1'}, {'level': '9'},
+                       {'spot_type': 'BUS'}):
+            # ---------- evaluate response ----------
+            # assert invalid query params are rejected
+            with self.assertRaises(APIError):
+                self.query(**params)
+
+
+class TestGarageStatusAggregation(unittest.TestCase):
+    def test_level_counts(self):
+        garage = Garage(build_garage_doc())
+        for vehicle_type in (0, 1, 1, 2, 2):
+            park_vehicle(garage, {'vehicle_type': vehicle_type})
+
+        for level in garage.levels.values():
+            # counts found by walking the Spot objects of the level
+            vehicles = {}
+            expected = {'spot_count': 0, 'spot_type_counts': [0, 0, 0], 'free_spots': [0, 0, 0],
+                        'vehicle_counts': [0, 0, 0], 'parked_counts': [[0, 0, 0], [0, 0, 0], [0, 0, 0]],
+                        'available_spots': [], 'assigned_spots': [], 'row_free': []}
+            for row in level.rows.values():
+                expected['row_free'].append(0)
+                for spot in row.spots.values():
+                    expected['spot_count'] += 1
+                    expected['spot_type_counts'][spot.spot_type.value] += 1
+                    if spot.vehicle:
+                        expected['assigned_spots'].append(int(spot.id))
+                        if int(spot.vehicle.id) not in vehicles:
+                            expected['parked_counts'][spot.spot_type.value][spot.vehicle.vehicle_type.value] += 1
+                        vehicles[int(spot.vehicle.id)] = spot.vehicle.vehicle_type.value
+                    else:
+                        expected['available_spots'].append(int(spot.id))
+                        expected['free_spots'][spot.spot_type.value] += 1
+                        expected['row_free'][-1] += 1
+            for vehicle_type in vehicles.values():
+                expected['vehicle_counts'][vehicle_type] += 1
+            expected['vehicle_ids'] = sorted(vehicles)
+            expected['vehicle_types'] = [vehicles[vehicle_id] for vehicle_id in sorted(vehicles)]
+
+            # ---------- evaluate response ----------
+            # assert the pure Python pass and the NumPy pass, if installed, match the walk
+            self.assertEqual(expected, level.counts(use_numpy=False))
+            if numpy is not None:
+                self.assertEqual(expected, level.counts(use_numpy=True))
+
+        # assert a garage rebuilt from the document counts each bus once although it takes 5 spots
+        rebuilt = Garage(garage.garage_to_dict())
+        self.assertEqual((garage.vehicle_count, garage.moto_count, garage.car_count, garage.bus_count),
+                         (rebuilt.vehicle_count, rebuilt.moto_count, rebuilt.car_count, rebuilt.bus_count))
+
 
 class TestParkingGarageParkVehicleFailures(unittest.TestCase):
     # no relevant failure tests
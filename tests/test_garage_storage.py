@@ -0,0 +1,586 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(dir_path, '..')))
+
+from tests.context import (build_garage,
+                           build_garage_doc,
+                           get_file_path,
+                           get_summary_path,
+                           park_vehicle,
+                           unpark_vehicle,
+                           write_garage_doc,
+                           write_level_summaries,
+                           Garage,
+                           GarageState,
+                           DocumentStorage,
+                           MemoryStorage,
+                           ShardedStorage,
+                           build_status,
+                           JournalStorage,
+                           SQLiteStorage,
+                           SnapshotStorage,
+                           GarageSnapshot,
+                           read_snapshot,
+                           write_snapshot,
+                           PersistenceWriter,
+                           APIError,
+                           status_codes)
+
+
+class TestGarageDocumentStorage(unittest.TestCase):
+    def setUp(self):
+        self.fn = 'test_document_garage_v1.json'
+
+    def tearDown(self):
+        for path in (get_file_path(self.fn), get_summary_path(self.fn)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_write_keeps_garage_usable(self):
+        garage = Garage(build_garage_doc())
+
+        # ---------- call method ----------
+        write_garage_doc(self.fn, garage)
+        park_vehicle(garage, {'vehicle_type': 1})
+        write_garage_doc(self.fn, garage)
+
+        # ---------- evaluate response ----------
+        # assert streamed document matches the live garage after repeated writes
+        self.assertEqual(garage.garage_to_dict(), build_garage_doc(fn=self.fn))
+        self.assertEqual(garage.vehicle_count, 8)
+
+    def test_write_replaces_document(self):
+        garage = Garage(build_garage_doc())
+        write_garage_doc(self.fn, garage)
+        original = build_garage_doc(fn=self.fn)
+
+        # ---------- call method ----------
+        # another process is reading the document while it is rewritten
+        with open(get_file_path(self.fn)) as json_file:
+            park_vehicle(garage, {'vehicle_type': 1})
+            write_garage_doc(self.fn, garage)
+            read = json.load(json_file)
+
+        # ---------- evaluate response ----------
+        # assert the reader sees the whole old document and the new one replaced it
+        self.assertEqual(original, read)
+        self.assertEqual(garage.garage_to_dict(), build_garage_doc(fn=self.fn))
+        self.assertEqual([fn for fn in os.listdir(os.path.dirname(get_file_path(self.fn))) if fn.endswith('.tmp')],
+                         [])
+
+    def test_document_cache(self):
+        shutil.copy(get_file_path('main_garage_v1.json'), get_file_path(self.fn))
+        state = GarageState(self.fn, storage=DocumentStorage(self.fn))
+        live_garage = state.garage
+
+        # ---------- evaluate response ----------
+        # assert unchanged document reuses the Garage and the status
+        status = state.get_status(build_status)
+        self.assertIs(live_garage, state.garage)
+        self.assertIs(status, state.get_status(build_status))
+
+        # ---------- call method ----------
+        # another process parks a car
+        other_garage = Garage(build_garage_doc(fn=self.fn))
+        park_vehicle(other_garage, {'vehicle_type': 1})
+        write_garage_doc(self.fn, other_garage)
+
+        # ---------- evaluate response ----------
+        # assert changed document rebuilds the Garage and the status
+        self.assertIsNot(live_garage, state.garage)
+        self.assertEqual(other_garage.garage_to_dict(), state.garage.garage_to_dict())
+        self.assertEqual(status['occupancy'] + 1, state.get_status(build_status)['occupancy'])
+        state.reset()
+
+    def test_reload_holds_lock(self):
+        shutil.copy(get_file_path('main_garage_v1.json'), get_file_path(self.fn))
+        state = GarageState(self.fn, storage=DocumentStorage(self.fn))
+        live_garage = state.garage
+        other_garage = Garage(build_garage_doc(fn=self.fn))
+        park_vehicle(other_garage, {'vehicle_type': 1})
+        garages = []
+
+        # ---------- call method ----------
+        # another process parks a car while a handler holds the lock
+        with state.lock:
+            write_garage_doc(self.fn, other_garage)
+            reader = threading.Thread(target=lambda: garages.append(state.garage))
+            reader.start()
+            reader.join(0.2)
+
+            # ---------- evaluate response ----------
+            # assert the live Garage is not replaced under the handler
+            self.assertEqual(garages, [])
+            self.assertIs(live_garage, state._garage)
+        reader.join()
+
+        # assert the changed document is loaded once the lock is released
+        self.assertIsNot(live_garage, garages[0])
+        self.assertEqual(other_garage.garage_to_dict(), garages[0].garage_to_dict())
+        state.reset()
+
+    def test_save_stale_garage(self):
+        shutil.copy(get_file_path('main_garage_v1.json'), get_file_path(self.fn))
+        state = GarageState(self.fn, storage=DocumentStorage(self.fn))
+        stale_garage = state.garage
+        # another process parks a car, and the live Garage is reloaded
+        other_garage = Garage(build_garage_doc(fn=self.fn))
+        park_vehicle(other_garage, {'vehicle_type': 1})
+        write_garage_doc(self.fn, other_garage)
+        state.reload()
+        park_vehicle(stale_garage, {'vehicle_type': 1})
+
+        # ---------- evaluate response ----------
+        # assert changes of a Garage that is no longer live fail the request
+        with self.assertRaises(APIError) as context:
+            state.save(stale_garage)
+        self.assertEqual(context.exception.status, status_codes.HTTP_INTERNAL_SERVER_ERROR)
+        state.reset()
+
+    def test_load_after_reset(self):
+        shutil.copy(get_file_path('main_garage_v1.json'), get_file_path(self.fn))
+        state = GarageState(self.fn, storage=DocumentStorage(self.fn))
+        changes = []
+        state.add_listener(lambda change, garage: changes.append(change))
+
+        # ---------- call method ----------
+        # the document cache hands the same Garage to the state again
+        state.load()
+        state.reset()
+        garage = state.load(storage=DocumentStorage(self.fn))
+        park_vehicle(garage, {'vehicle_type': 1})
+
+        # ---------- evaluate response ----------
+        # assert the change is recorded once
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(garage._listeners, [state.record])
+        state.reset()
+        self.assertEqual(garage._listeners, [])
+
+    def test_summary_changed_levels(self):
+        garage = Garage(build_garage_doc())
+        write_garage_doc(self.fn, garage)
+        write_level_summaries(self.fn, garage)
+        summarized = []
+        summary = Garage.Level.summary
+        Garage.Level.summary = lambda level: summarized.append(level.id) or summary(level)
+        try:
+            # ---------- call method ----------
+            parked = park_vehicle(garage, {'vehicle_type': 1})
+            write_garage_doc(self.fn, garage)
+            write_level_summaries(self.fn, garage)
+        finally:
+            Garage.Level.summary = summary
+
+        # ---------- evaluate response ----------
+        # assert only the level of the change is summarized again and the summaries stay current
+        self.assertEqual(summarized, [parked['level']])
+        with open(get_summary_path(self.fn)) as summary_file:
+            self.assertEqual(json.load(summary_file)['levels'],
+                             {level_id: level.summary() for level_id, level in garage.levels.items()})
+        self.assertEqual([fn for fn in os.listdir(os.path.dirname(get_file_path(self.fn))) if fn.endswith('.tmp')],
+                         [])
+
+    def test_summary_lazy_levels(self):
+        garage = Garage(build_garage_doc(fn='full_garage_v1.json'))
+        write_garage_doc(self.fn, garage)
+        write_level_summaries(self.fn, garage)
+
+        # ---------- call method ----------
+        lazy_garage = build_garage(fn=self.fn)
+
+        # ---------- evaluate response ----------
+        # assert counts match the full garage while the last level was not built
+        last_level = list(garage.levels)[-1]
+        for name in ('vehicle_count', 'max_capacity', 'moto_count', 'car_count', 'bus_count', 'assigned_ids', 'assigned_spots'):
+            self.assertEqual(getattr(garage, name), getattr(lazy_garage, name))
+        self.assertFalse(lazy_garage.levels.is_loaded(last_level))
+        loaded = [level_id for level_id in lazy_garage.levels if lazy_garage.levels.is_loaded(level_id)]
+
+        # ---------- call method ----------
+        # unpark a vehicle of the last level from both garages
+        for row_id, row in garage.levels[last_level].rows.items():
+            spot = next((spot for spot in row.spots.values() if spot.vehicle), None)
+            if spot is not None:
+                break
+        document = {'vehicle_id': spot.vehicle.id, 'spot_id': spot.id, 'row': row_id, 'level': last_level}
+        unpark_vehicle(garage, dict(document))
+        unpark_vehicle(lazy_garage, dict(document))
+
+        # ---------- evaluate response ----------
+        # assert only the level of the vehicle was built and the lazy garage writes the same document
+        self.assertEqual([level_id for level_id in lazy_garage.levels if lazy_garage.levels.is_loaded(level_id)],
+                         sorted(loaded + [last_level], key=list(lazy_garage.levels).index))
+        self.assertEqual(garage.garage_to_dict(), lazy_garage.garage_to_dict())
+
+        # assert summaries of an older document are not used
+        write_garage_doc(self.fn, garage)
+        self.assertEqual(garage.garage_to_dict(), build_garage(fn=self.fn).garage_to_dict())
+        self.assertNotIsInstance(build_garage(fn=self.fn).levels, type(lazy_garage.levels))
+
+
+class TestGarageJournalStorage(unittest.TestCase):
+    def setUp(self):
+        self.fn = 'test_journal_garage_v1.json'
+        shutil.copy(get_file_path('main_garage_v1.json'), get_file_path(self.fn))
+
+    def tearDown(self):
+        for path in (get_file_path(self.fn), get_file_path(self.fn) + '.journal',
+                     get_file_path(self.fn) + '.journal.lock', get_summary_path(self.fn)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_journal_replay(self):
+        state = GarageState(self.fn, storage=JournalStorage(self.fn))
+        original = build_garage_doc(fn=self.fn)
+
+        # ---------- call method ----------
+        # vehicle type 1 is car
+        park_vehicle(state.garage, {'vehicle_type': 1})
+        park_vehicle(state.garage, {'vehicle_type': 0})
+        state.save()
+
+        # ---------- evaluate response ----------
+        # assert snapshot untouched and one journal record per change
+        self.assertEqual(original, build_garage_doc(fn=self.fn))
+        with open(get_file_path(self.fn) + '.journal') as journal_file:
+            self.assertEqual(len(journal_file.readlines()), 2)
+
+        # assert snapshot plus journal rebuilds the live garage
+        reloaded = GarageState(self.fn, storage=JournalStorage(self.fn))
+        self.assertEqual(state.garage.garage_to_dict(), reloaded.garage.garage_to_dict())
+        state.reset()
+        reloaded.reset()
+
+    def test_journal_snapshot(self):
+        state = GarageState(self.fn, storage=JournalStorage(self.fn, snapshot_events=2))
+
+        # ---------- call method ----------
+        park_vehicle(state.garage, {'vehicle_type': 1})
+        park_vehicle(state.garage, {'vehicle_type': 1})
+        state.save()
+
+        # ---------- evaluate response ----------
+        # assert snapshot written with the number of the last journal record and journal compacted
+        document = build_garage_doc(fn=self.fn)
+        self.assertEqual(document.pop('journal_sequence'), 2)
+        self.assertEqual(state.garage.garage_to_dict(), document)
+        self.assertEqual(os.path.getsize(get_file_path(self.fn) + '.journal'), 0)
+        state.reset()
+
+    def test_journal_snapshot_interrupted(self):
+        state = GarageState(self.fn, storage=JournalStorage(self.fn))
+        journal_path = get_file_path(self.fn) + '.journal'
+        # vehicle type 2 is bus. The bus is given the vehicle id the car left.
+        car = park_vehicle(state.garage, {'vehicle_type': 1})
+        unpark_vehicle(state.garage, {'vehicle_id': car['vehicle_id']})
+        bus = park_vehicle(state.garage, {'vehicle_type': 2})
+        state.save()
+        with open(journal_path) as journal_file:
+            journal = journal_file.read()
+
+        # ---------- call method ----------
+        # crash after the snapshot replaced the document, before the journal was truncated
+        state.storage.snapshot(state.garage)
+        with open(journal_path, 'w') as journal_file:
+            journal_file.write(journal)
+        reloaded = GarageState(self.fn, storage=JournalStorage(self.fn))
+
+        # ---------- evaluate response ----------
+        # assert journal records the snapshot includes are not replayed again
+        self.assertEqual(bus['vehicle_id'], car['vehicle_id'])
+        self.assertEqual(state.garage.garage_to_dict(), reloaded.garage.garage_to_dict())
+        self.assertTrue(reloaded.garage.is_assigned(bus['vehicle_id']))
+        self.assertNotEqual(park_vehicle(reloaded.garage, {'vehicle_type': 1})['vehicle_id'], bus['vehicle_id'])
+        state.reset()
+        reloaded.reset()
+
+    def test_journal_single_process(self):
+        lock_path = get_file_path(self.fn) + '.journal.lock'
+        # another process holds the journal until its stdin is closed
+        other = subprocess.Popen([sys.executable, '-c',
+                                  'import fcntl, os, sys\n'
+                                  'fd = os.open(sys.argv[1], os.O_RDWR | os.O_CREAT)\n'
+                                  'fcntl.lockf(fd, fcntl.LOCK_EX)\n'
+                                  'print("locked", flush=True)\n'
+                                  'sys.stdin.read()\n', lock_path],
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(other.stdout.readline().strip(), 'locked')
+
+        # ---------- evaluate response ----------
+        # assert the journal of another process is refused on load
+        with self.assertRaises(ValueError):
+            JournalStorage(self.fn).load()
+        other.communicate('')
+
+        # assert journal storage cannot back shared garage state
+        with self.assertRaises(ValueError):
+            GarageState(self.fn, storage=JournalStorage(self.fn), shared_path=lock_path + '.shm').garage
+
+        # assert the journal is taken once the other process is gone
+        storage = JournalStorage(self.fn)
+        self.assertEqual(storage.load().garage_to_dict(), build_garage_doc(fn=self.fn))
+        storage.close()
+
+
+class TestGarageSQLiteStorage(unittest.TestCase):
+    def setUp(self):
+        self.db_fn = 'test_sqlite_garage_v1.db'
+
+    def tearDown(self):
+        if os.path.exists(get_file_path(self.db_fn)):
+            os.remove(get_file_path(self.db_fn))
+
+    def test_sqlite_update(self):
+        state = GarageState(storage=SQLiteStorage(db_fn=self.db_fn))
+
+        # ---------- evaluate response ----------
+        # assert database imported from garage document
+        self.assertEqual(build_garage_doc(), state.garage.garage_to_dict())
+
+        # ---------- call method ----------
+        # vehicle type 2 is bus
+        park_vehicle(state.garage, {'vehicle_type': 2})
+        self.assertEqual(len(state.storage.pending), 5)
+        state.save()
+
+        # ---------- evaluate response ----------
+        # assert changed rows persisted and document untouched
+        self.assertEqual(state.storage.pending, {})
+        reloaded = GarageState(storage=SQLiteStorage(db_fn=self.db_fn))
+        self.assertEqual(state.garage.garage_to_dict(), reloaded.garage.garage_to_dict())
+        self.assertNotEqual(build_garage_doc(), reloaded.garage.garage_to_dict())
+        state.reset()
+        reloaded.reset()
+
+
+class TestGarageSnapshotStorage(unittest.TestCase):
+    def setUp(self):
+        self.snapshot_fn = 'test_snapshot_garage_v1.grg'
+
+    def tearDown(self):
+        if os.path.exists(get_file_path(self.snapshot_fn)):
+            os.remove(get_file_path(self.snapshot_fn))
+
+    def test_snapshot_round_trip(self):
+        for fn in ('main_garage_v1.json', 'full_garage_v1.json', 'full_garage_bus_v1.json'):
+            write_snapshot(get_file_path(self.snapshot_fn), build_garage_doc(fn=fn))
+            self.assertEqual(build_garage_doc(fn=fn), read_snapshot(get_file_path(self.snapshot_fn)))
+
+    def test_snapshot_load(self):
+        for fn in ('main_garage_v1.json', 'full_garage_v1.json', 'full_garage_bus_v1.json'):
+            document = build_garage_doc(fn=fn)
+            write_snapshot(get_file_path(self.snapshot_fn), document)
+
+            # ---------- call method ----------
+            storage = SnapshotStorage(snapshot_fn=self.snapshot_fn)
+            garage = storage.load()
+
+            # ---------- evaluate response ----------
+            # assert garage loaded from the spot records matches the garage built from the document
+            expected = Garage(document)
+            self.assertEqual(document, garage.garage_to_dict())
+            for name in ('max_capacity', 'vehicle_count', 'moto_count', 'car_count', 'bus_count',
+                         'available', 'available_spot_types', 'available_ids', 'assigned_ids',
+                         'available_spots', 'assigned_spots'):
+                self.assertEqual(getattr(expected, name), getattr(garage, name))
+            self.assertEqual(expected.free_spots(), garage.free_spots())
+            storage.close()
+
+    def test_snapshot_update_in_place(self):
+        state = GarageState(storage=SnapshotStorage(snapshot_fn=self.snapshot_fn))
+        state.load()
+        size = os.path.getsize(get_file_path(self.snapshot_fn))
+
+        # ---------- call method ----------
+        # vehicle type 0 is motorcycle, vehicle type 2 is bus
+        park_vehicle(state.garage, {'vehicle_type': 0})
+        park_vehicle(state.garage, {'vehicle_type': 2})
+        state.save()
+
+        # ---------- evaluate response ----------
+        # assert spot records updated without growing the snapshot
+        self.assertEqual(size, os.path.getsize(get_file_path(self.snapshot_fn)))
+        snapshot = GarageSnapshot(get_file_path(self.snapshot_fn))
+        self.assertEqual(state.garage.garage_to_dict(), snapshot.to_document())
+        snapshot.close()
+        state.reset()
+
+
+class TestGarageShardedStorage(unittest.TestCase):
+    def setUp(self):
+        self.shard_dir = 'test_sharded_garage_v1'
+
+    def tearDown(self):
+        if os.path.exists(get_file_path(self.shard_dir)):
+            shutil.rmtree(get_file_path(self.shard_dir))
+
+    def test_sharded_lazy_levels(self):
+        state = GarageState(storage=ShardedStorage(shard_dir=self.shard_dir))
+        garage = state.garage
+
+        # ---------- evaluate response ----------
+        # assert status matches the full garage while only the first level was read
+        self.assertEqual(build_status(Garage(build_garage_doc())), build_status(garage))
+        self.assertEqual([garage.levels.is_loaded(level_id) for level_id in garage.levels], [True, False])
+
+        # ---------- call method ----------
+        level_path = os.path.join(get_file_path(self.shard_dir), 'level_1.json')
+        level_mtime = os.stat(level_path).st_mtime_ns
+        park_vehicle(garage, {'vehicle_type': 2})
+        state.save()
+
+        # ---------- evaluate response ----------
+        # assert only the changed level was rewritten and the shards rebuild the live garage
+        self.assertEqual(level_mtime, os.stat(level_path).st_mtime_ns)
+        reloaded = GarageState(storage=ShardedStorage(shard_dir=self.shard_dir))
+        self.assertEqual(build_status(garage), build_status(reloaded.garage))
+        self.assertEqual(garage.garage_to_dict(), reloaded.garage.garage_to_dict())
+        state.reset()
+        reloaded.reset()
+
+
+class TestGaragePersistenceWriter(unittest.TestCase):
+    def setUp(self):
+        self.fn = 'test_writer_garage_v1.json'
+        shutil.copy(get_file_path('main_garage_v1.json'), get_file_path(self.fn))
+
+    def tearDown(self):
+        for path in (get_file_path(self.fn), get_file_path(self.fn) + '.journal',
+                     get_file_path(self.fn) + '.journal.lock', get_summary_path(self.fn)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_async_commit(self):
+        state = GarageState(self.fn, storage=JournalStorage(self.fn))
+        garage = state.garage
+        state.writer.stop()
+        state.writer = PersistenceWriter(state.storage, state.lock, mode='async', window=0.001)
+        state.writer.start(garage)
+
+        # ---------- call method ----------
+        for _ in range(5):
+            with state.lock:
+                park_vehicle(garage, {'vehicle_type': 0})
+            state.save()
+
+        # ---------- evaluate response ----------
+        # assert stopping the writer flushes every outstanding change
+        state.reset()
+        reloaded = GarageState(self.fn, storage=JournalStorage(self.fn))
+        self.assertEqual(garage.garage_to_dict(), reloaded.garage.garage_to_dict())
+        reloaded.reset()
+
+    def test_batched_commit(self):
+        state = GarageState(self.fn, storage=JournalStorage(self.fn))
+        garage = state.garage
+        state.writer.stop()
+        state.writer = PersistenceWriter(state.storage, state.lock, mode='batched', window=0.001)
+        state.writer.start(garage)
+        journal_path = get_file_path(self.fn) + '.journal'
+
+        # ---------- call method ----------
+        for _ in range(3):
+            with state.lock:
+                park_vehicle(garage, {'vehicle_type': 0})
+            state.save()
+
+        # ---------- evaluate response ----------
+        # assert every commit returned after its change was flushed to the journal
+        with open(journal_path) as journal_file:
+            self.assertEqual(len(journal_file.readlines()), 3)
+
+        # ---------- call method ----------
+        def fail_flush(garage, sync=False):
+            raise OSError('No space left on device')
+        state.storage.flush = fail_flush
+        with state.lock:
+            park_vehicle(garage, {'vehicle_type': 0})
+
+        # ---------- evaluate response ----------
+        # assert a failed group commit fails the request waiting on it
+        with self.assertRaises(APIError) as context:
+            state.save()
+        self.assertEqual(context.exception.status, status_codes.HTTP_INTERNAL_SERVER_ERROR)
+
+        # assert the next group commit persists the change after all
+        del state.storage.flush
+        state.save()
+        with open(journal_path) as journal_file:
+            self.assertEqual(len(journal_file.readlines()), 4)
+        state.reset()
+
+
+class TestGarageSharedState(unittest.TestCase):
+    def setUp(self):
+        self.shared_dir = tempfile.mkdtemp()
+        self.shared_path = os.path.join(self.shared_dir, 'garage.shm')
+
+    def tearDown(self):
+        shutil.rmtree(self.shared_dir)
+
+    def test_shared_occupancy(self):
+        # two workers, each with its own garage document and object graph
+        worker = GarageState(storage=MemoryStorage(build_garage_doc()), shared_path=self.shared_path)
+        other_worker = GarageState(storage=MemoryStorage(build_garage_doc()), shared_path=self.shared_path)
+        garage = worker.garage
+        other_garage = other_worker.garage
+
+        # ---------- call method ----------
+        # both workers park a car without seeing each other's change first
+        parked = park_vehicle(garage, {'vehicle_type': 1})
+        other_parked = park_vehicle(other_garage, {'vehicle_type': 1})
+
+        # ---------- evaluate response ----------
+        # assert the second worker moved to another spot and vehicle id
+        self.assertNotEqual((parked['level'], parked['row'], parked['spot_id']),
+                            (other_parked['level'], other_parked['row'], other_parked['spot_id']))
+        self.assertNotEqual(parked['vehicle_id'], other_parked['vehicle_id'])
+
+        # assert both workers see every vehicle after catching up
+        self.assertEqual(worker.garage.garage_to_dict(), other_worker.garage.garage_to_dict())
+        self.assertEqual(worker.garage.vehicle_count, other_worker.garage.vehicle_count)
+
+        # ---------- call method ----------
+        unpark_vehicle(garage, {'vehicle_id': parked['vehicle_id'],
+                                'spot_id': parked['spot_id'],
+                                'row': parked['row'],
+                                'level': parked['level']})
+
+        # ---------- evaluate response ----------
+        # assert departure reaches the other worker and only the owner persisted each change
+        self.assertEqual(worker.garage.garage_to_dict(), other_worker.garage.garage_to_dict())
+        self.assertNotEqual(worker.storage.get_document(), other_worker.storage.get_document())
+        worker.reset()
+        other_worker.reset()
+
+    def test_shared_vehicle_id_outside(self):
+        # a document vehicle with an id past the spot count of the garage
+        document = build_garage_doc()
+        garage = Garage(document)
+        for row in document['levels'][list(document['levels'])[0]]['rows'].values():
+            spot = next((spot for spot in row['spots'].values() if spot['vehicle']), None)
+            if spot is not None:
+                break
+        spot['vehicle']['vehicle_id'] = str(garage.max_capacity + 7)
+        worker = GarageState(storage=MemoryStorage(document), shared_path=self.shared_path)
+
+        # ---------- evaluate response ----------
+        # assert the garage is refused before the shared region is written
+        with self.assertRaises(ValueError) as context:
+            worker.garage
+        self.assertIn(str(garage.max_capacity + 7), str(context.exception))
+        self.assertFalse(os.path.exists(self.shared_path))
+        worker.reset()
+
+
+if __name__ == '__main__':
+    unittest.main()
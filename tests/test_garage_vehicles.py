@@ -0,0 +1,122 @@
+import json
+import os
+import random
+import shutil
+import sys
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(dir_path, '..')))
+
+from tests.context import (build_garage_doc,
+                           get_file_path,
+                           park_vehicle,
+                           unpark_vehicle,
+                           vehicles_http_get,
+                           Garage,
+                           GarageState,
+                           ShardedStorage,
+                           garage_state,
+                           http_put,
+                           http_delete,
+                           APIError,
+                           status_codes,
+                           Request,
+                           Response)
+
+
+# vehicle id to (level, row, spot ids) found by walking levels, rows and spots
+def walk_vehicles(garage):
+    vehicles = {}
+    for level in garage.levels.values():
+        for row in level.rows.values():
+            for spot in row.spots.values():
+                if spot.vehicle:
+                    vehicles.setdefault(spot.vehicle.id, (level.id, row.id, []))[2].append(spot.id)
+    return vehicles
+
+
+class TestGarageVehicles(unittest.TestCase):
+    def setUp(self):
+        self.req = Request()
+        self.resp = Response()
+        self.fn = 'test_vehicles_garage_v1.json'
+        self.shard_dir = 'test_vehicles_garage_v1'
+
+    def tearDown(self):
+        if os.path.exists(get_file_path(self.fn)):
+            os.remove(get_file_path(self.fn))
+        if os.path.exists(get_file_path(self.shard_dir)):
+            shutil.rmtree(get_file_path(self.shard_dir))
+
+    def test_find_vehicle(self):
+        # vehicle type 2 is bus
+        self.req.body = {'vehicle_type': 2}
+        http_put(self.req, self.resp, '')
+        parked = self.resp.body
+
+        # ---------- call method ----------
+        vehicles_http_get(self.req, self.resp, {'vehicle_id': parked['vehicle_id']})
+
+        # ---------- evaluate response ----------
+        # assert lookup returns what the park response returned
+        self.assertEqual(self.resp.status, status_codes.HTTP_OK)
+        self.assertEqual(parked, self.resp.body)
+
+        # ---------- call method ----------
+        # exit with only the vehicle id
+        self.req.body = {'vehicle_id': parked['vehicle_id']}
+        http_delete(self.req, self.resp, '')
+
+        # ---------- evaluate response ----------
+        # assert the vehicle left and can no longer be found
+        self.assertNotIn(parked['vehicle_id'], garage_state.garage.assigned_ids)
+        with self.assertRaises(APIError) as context:
+            vehicles_http_get(self.req, self.resp, {'vehicle_id': parked['vehicle_id']})
+        self.assertEqual(context.exception.code, 'Invalid Vehicle ID')
+
+    def test_vehicle_index(self):
+        garage = Garage(build_garage_doc())
+        parked = list(garage.assigned_ids)
+        random.seed(16)
+
+        for _ in range(200):
+            # ---------- call method ----------
+            if parked and random.random() < 0.4:
+                unpark_vehicle(garage, {'vehicle_id': parked.pop(random.randrange(len(parked)))})
+            else:
+                try:
+                    parked.append(park_vehicle(garage, {'vehicle_type': random.choice([0, 1, 1, 2])})['vehicle_id'])
+                except APIError:
+                    pass
+
+            # ---------- evaluate response ----------
+            # assert the index holds every parked vehicle where a walk finds it
+            indexed = {}
+            for vehicle_id in garage.vehicle_locations:
+                location = garage.locate_vehicle(vehicle_id)
+                indexed[vehicle_id] = location.level.id, location.row.id, [spot.id for spot in location.spots]
+            self.assertEqual(walk_vehicles(garage), indexed)
+
+    def test_vehicle_index_lazy_levels(self):
+        # a car parked on the second level, which is only read on first use
+        garage_doc = build_garage_doc()
+        garage_doc['levels']['1']['rows']['1']['spots']['74']['vehicle'] = {'vehicle_type': 1, 'vehicle_id': '90'}
+        with open(get_file_path(self.fn), 'w') as json_file:
+            json.dump(garage_doc, json_file)
+        state = GarageState(storage=ShardedStorage(self.fn, shard_dir=self.shard_dir))
+        garage = state.garage
+
+        # ---------- call method ----------
+        self.assertFalse(garage.levels.is_loaded('1'))
+        location = garage.locate_vehicle('90')
+
+        # ---------- evaluate response ----------
+        # assert vehicle of the lazy level is found once its level is read
+        self.assertTrue(garage.levels.is_loaded('1'))
+        self.assertEqual(('1', '1', ['74']), (location.level.id, location.row.id, [spot.id for spot in location.spots]))
+        state.reset()
+
+
+if __name__ == '__main__':
+    unittest.main()